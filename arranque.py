@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Arranque del servidor: precalentamiento de índices y cachés, con tiempos por fase.
+
+    python arranque.py [--en-segundo-plano] [-- opciones de streamlit, p. ej. --server.port 8501]
+
+Carga en este proceso el índice de calles, la caché de geocodificación, el nomenclátor
+y el estado de ingesta, y luego inicia el servidor de Streamlit con mapas.py en el
+mismo proceso: las sesiones encuentran todo ya cargado. Con `streamlit run mapas.py`
+la app llama a iniciar_precalentamiento() en la primera sesión y el precalentamiento
+corre en segundo plano mientras se dibuja la página.
+
+Los tiempos de cada fase (y el tiempo hasta la primera página dibujada) se imprimen,
+se guardan como reporte JSON y se muestran en la barra lateral de la app.
+"""
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+
+INICIO_PROCESO = time.time()
+
+from instrumentacion import RegistroEjecucion # noqa: E402 (INICIO_PROCESO debe medirse antes)
+
+_lock = threading.Lock()
+_arranque = {"registro": None, "terminado": False, "error": None, "primer_render": None}
+
+
+def precalentar(registro=None):
+    """Carga los recursos de proceso que usan las sesiones, midiendo cada fase en registro."""
+    registro = registro or RegistroEjecucion("arranque")
+    with registro.etapa("importaciones"):
+        import procesamiento
+    with registro.etapa("indice_calles") as etapa:
+        etapa["filas"] = len(procesamiento.obtener_indice_calles())
+    with registro.etapa("cache_geocodificacion") as etapa:
+        etapa["filas"] = procesamiento.obtener_cache_geocodificacion().precalentar()
+    with registro.etapa("nomenclator_local") as etapa:
+        nomenclator = procesamiento.obtener_nomenclator_local()
+        etapa["filas"] = len(nomenclator) if nomenclator is not None else 0
+    with registro.etapa("estado_ingesta") as etapa:
+        procesado = procesamiento.obtener_almacen_ingesta().procesado
+        etapa["filas"] = len(procesado) if procesado is not None else 0
+    with registro.etapa("motor_geocodificacion"):
+        procesamiento.obtener_motor_geocodificacion()
+    procesamiento.obtener_cache_mapas()
+    procesamiento.obtener_gestor_trabajos()
+    # Dependencias de los mapas: se cargan aquí, fuera del camino de la primera página
+    with registro.etapa("importaciones_mapas"):
+        for modulo in ("folium.plugins", "branca.colormap", "streamlit_folium"):
+            importlib.import_module(modulo)
+    return registro
+
+
+def _ejecutar(registro, directorio_reportes):
+    try:
+        precalentar(registro)
+    except Exception as e:
+        _arranque["error"] = str(e)
+        print(f"Precalentamiento incompleto: {e}")
+    finally:
+        _arranque["terminado"] = True
+    print(f"<<< Precalentamiento: {registro.resumen_etapas()}")
+    try:
+        print(f"Reporte de arranque guardado en '{registro.guardar_json(directorio_reportes)}'.")
+    except OSError as e_reporte:
+        print(f"No se pudo guardar el reporte de arranque: {e_reporte}")
+
+
+def iniciar_precalentamiento(en_segundo_plano=True, directorio_reportes=None):
+    """Inicia el precalentamiento una sola vez por proceso (las llamadas siguientes no hacen nada)."""
+    with _lock:
+        if _arranque["registro"] is not None:
+            return
+        _arranque["registro"] = RegistroEjecucion("arranque")
+    directorio_reportes = directorio_reportes or os.environ.get("DIRECTORIO_REPORTES", "reportes_ejecucion")
+    if en_segundo_plano:
+        threading.Thread(target=_ejecutar, args=(_arranque["registro"], directorio_reportes), name="precalentamiento", daemon=True).start()
+    else:
+        _ejecutar(_arranque["registro"], directorio_reportes)
+
+
+def registrar_primer_render():
+    """Anota (una vez por proceso) los segundos desde el inicio del proceso hasta la primera página dibujada."""
+    if _arranque["primer_render"] is None:
+        _arranque["primer_render"] = round(time.time() - INICIO_PROCESO, 3)
+        print(f"<<< Primera página dibujada a los {_arranque['primer_render']} s del inicio del proceso.")
+
+
+def estado_arranque():
+    """Fases del arranque (cuando terminó el precalentamiento), tiempo hasta la primera página y error si lo hubo."""
+    registro = _arranque["registro"]
+    return {
+        "terminado": _arranque["terminado"],
+        "fases": registro.resumen_etapas() if registro is not None and _arranque["terminado"] else {},
+        "primer_render": _arranque["primer_render"],
+        "error": _arranque["error"],
+    }
+
+
+def main(argv=None):
+    # mapas.py importa "arranque": que encuentre este mismo módulo (y su estado), no una copia nueva
+    sys.modules.setdefault("arranque", sys.modules[__name__])
+    argv = list(sys.argv[1:] if argv is None else argv)
+    argumentos_streamlit = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+    parser = argparse.ArgumentParser(description="Precalienta índices y cachés y arranca la app en el mismo proceso.")
+    parser.add_argument("--en-segundo-plano", action="store_true", help="Arranca el servidor sin esperar el precalentamiento.")
+    parser.add_argument("--solo-precalentar", action="store_true", help="Solo precalienta y muestra los tiempos (no arranca el servidor).")
+    args = parser.parse_args(argv)
+    iniciar_precalentamiento(en_segundo_plano=args.en_segundo_plano and not args.solo_precalentar)
+    if args.solo_precalentar:
+        return 0
+    from streamlit.web import cli
+    # Mismo proceso que `streamlit run mapas.py ...`: las sesiones ven los recursos ya cargados
+    cli.main(["run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mapas.py"), *argumentos_streamlit], prog_name="streamlit")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Benchmark de velocidad y precisión de la corrección y la geocodificación.
+
+Genera corpus sintéticos de reportes a partir de la lista oficial de calles, con
+errores típicos (tipeo, abreviaturas como "Ote." o "Av.", números faltantes y la
+comuna al final), y mide:
+
+- corrección: filas/s, memoria máxima y precisión/recall contra la calle verdadera;
+- geocodificación: consultas/s y latencias del motor contra servidor_geocodificador_falso.py.
+
+El resultado se escribe en JSON para comparar ejecuciones. Ejemplos:
+
+    python benchmark.py --filas 1000 100000 --salida bench.json
+    python benchmark.py --filas 10000 --umbral 75 85 --calles calles.csv
+    python benchmark.py --filas 1000 --consultas-geocodificacion 500 --latencia 0.05 --tasa-fallos 0.1
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from comunas import detectar_comuna
+from instrumentacion import RegistroEjecucion
+from indice_calles import IndiceCalles
+from motor_geocodificacion import MotorGeocodificacion
+from procesamiento import normalizar, corregir_direcciones, consulta_geocodificacion, obtener_calles_conchali
+from servidor_geocodificador_falso import ServidorGeocodificadorFalso
+
+# Abreviaturas frecuentes en los reportes (palabra completa -> variantes escritas por los vecinos)
+ABREVIATURAS = {
+    "AVENIDA": ["Av.", "Av", "Avda."],
+    "ORIENTE": ["Ote.", "Ote", "Or."],
+    "PONIENTE": ["Pte.", "Pte", "Pon."],
+    "NORTE": ["Nte.", "Nte"],
+    "PASAJE": ["Pje.", "Psje", "Pasj."],
+    "GENERAL": ["Gral.", "Gral"],
+    "SANTA": ["Sta."],
+    "DOCTOR": ["Dr."],
+}
+SUFIJOS_COMUNA = [", Conchalí", " conchali", ", Conchali, Santiago", " CONCHALÍ"]
+TEXTOS_RUIDO = ["frente a la plaza", "no se", "al lado del colegio", "esquina del almacén", "sector norte"]
+
+# Probabilidad de cada alteración por fila
+PROBABILIDADES = {
+    "abreviatura": 0.3,
+    "tipeo": 0.35,
+    "sin_numero": 0.1,
+    "comuna": 0.15,
+    "minusculas": 0.2,
+    "ruido": 0.05, # Fila sin calle real (verdad = None)
+}
+
+
+def _tipeo(texto, rnd):
+    """Un error de tipeo: borrar, duplicar, sustituir o intercambiar una letra."""
+    posiciones = [i for i, c in enumerate(texto) if c.isalpha()]
+    if len(posiciones) < 2:
+        return texto
+    i = rnd.choice(posiciones)
+    operacion = rnd.randrange(4)
+    if operacion == 0:
+        return texto[:i] + texto[i + 1:]
+    if operacion == 1:
+        return texto[:i] + texto[i] + texto[i:]
+    if operacion == 2:
+        return texto[:i] + rnd.choice("abcdefghijklmnopqrstuvwxyz") + texto[i + 1:]
+    j = min(i + 1, len(texto) - 1)
+    return texto[:i] + texto[j] + texto[i] + texto[j + 1:]
+
+
+def _abreviar(calle, rnd):
+    palabras = calle.split()
+    abreviables = [i for i, p in enumerate(palabras) if normalizar(p) in ABREVIATURAS]
+    if not abreviables:
+        return calle, False
+    i = rnd.choice(abreviables)
+    palabras[i] = rnd.choice(ABREVIATURAS[normalizar(palabras[i])])
+    return " ".join(palabras), True
+
+
+def generar_corpus(calles, filas, semilla=0, probabilidades=PROBABILIDADES):
+    """DataFrame con 'Direccion' (texto del reporte), 'calle_verdadera' (None en filas de ruido) y 'alteraciones'."""
+    rnd = random.Random(semilla)
+    direcciones, verdaderas, alteraciones = [], [], []
+    for _ in range(filas):
+        if rnd.random() < probabilidades["ruido"]:
+            direcciones.append(rnd.choice(TEXTOS_RUIDO))
+            verdaderas.append(None)
+            alteraciones.append("ruido")
+            continue
+        calle = rnd.choice(calles)
+        texto, aplicadas = calle, []
+        if rnd.random() < probabilidades["abreviatura"]:
+            texto, abreviada = _abreviar(texto, rnd)
+            if abreviada:
+                aplicadas.append("abreviatura")
+        if rnd.random() < probabilidades["tipeo"]:
+            texto = _tipeo(texto, rnd)
+            aplicadas.append("tipeo")
+        if rnd.random() < probabilidades["minusculas"]:
+            texto = texto.lower()
+            aplicadas.append("minusculas")
+        if rnd.random() < probabilidades["sin_numero"]:
+            aplicadas.append("sin_numero")
+        else:
+            texto = f"{texto} {rnd.randint(1, 9999)}"
+        if rnd.random() < probabilidades["comuna"]:
+            texto += rnd.choice(SUFIJOS_COMUNA)
+            aplicadas.append("comuna")
+        direcciones.append(texto)
+        verdaderas.append(calle)
+        alteraciones.append("+".join(aplicadas) or "ninguna")
+    return pd.DataFrame({"Direccion": direcciones, "calle_verdadera": verdaderas, "alteraciones": alteraciones})
+
+
+def evaluar_correccion(corpus, calle_oficial):
+    """Precisión/recall de calle_oficial contra calle_verdadera (comparando nombres normalizados).
+
+    Un acierto es una calle devuelta igual a la verdadera; devolver una calle distinta (o
+    cualquier calle para una fila de ruido) es un falso positivo; no devolver la verdadera es un falso negativo.
+    """
+    verdadera = corpus["calle_verdadera"].map(lambda c: normalizar(c) if c is not None else None)
+    devuelta = calle_oficial.map(lambda c: normalizar(c) if isinstance(c, str) else None)
+    con_respuesta = devuelta.notna()
+    correctas = con_respuesta & (devuelta == verdadera)
+    positivos_reales = int(verdadera.notna().sum())
+    vp = int(correctas.sum())
+    fp = int((con_respuesta & ~correctas).sum())
+    metricas = {
+        "verdaderos_positivos": vp,
+        "falsos_positivos": fp,
+        "falsos_negativos": positivos_reales - vp,
+        "precision": round(vp / (vp + fp), 4) if vp + fp else None,
+        "recall": round(vp / positivos_reales, 4) if positivos_reales else None,
+    }
+    # Recall por tipo de alteración, para ver qué errores de los vecinos no se corrigen
+    por_alteracion = {}
+    for alteracion, grupo in corpus.groupby("alteraciones").groups.items():
+        if alteracion == "ruido":
+            por_alteracion[alteracion] = {"filas": len(grupo), "falsos_positivos": int(con_respuesta[grupo].sum())}
+        else:
+            por_alteracion[alteracion] = {"filas": len(grupo), "recall": round(float(correctas[grupo].mean()), 4)}
+    metricas["por_alteracion"] = por_alteracion
+    return metricas
+
+
+def _corregir(direcciones, indice, umbral):
+    # Igual que el pipeline: se quita la comuna escrita al final antes de corregir (todo el corpus es de una comuna)
+    return corregir_direcciones(direcciones.map(lambda d: detectar_comuna(d)[1]), indice, umbral=umbral)
+
+
+def medir_correccion(corpus, indice, umbral):
+    """Tiempo, memoria máxima (tracemalloc, en una segunda pasada) y precisión de la corrección."""
+    direcciones = corpus["Direccion"]
+    inicio = time.perf_counter()
+    resultado = _corregir(direcciones, indice, umbral)
+    segundos = time.perf_counter() - inicio
+
+    tracemalloc.start()
+    _corregir(direcciones, indice, umbral)
+    _actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    muestra = direcciones.head(10000)
+    inicio = time.perf_counter()
+    for texto in muestra:
+        normalizar(texto)
+    segundos_normalizar = time.perf_counter() - inicio
+
+    return {
+        "filas": len(corpus),
+        "umbral": umbral,
+        "segundos": round(segundos, 4),
+        "filas_por_segundo": round(len(corpus) / segundos, 1) if segundos > 0 else None,
+        "direcciones_distintas": int(corpus["Direccion"].nunique()),
+        "memoria_pico_mb": round(pico / 2 ** 20, 2),
+        "normalizar_por_segundo": round(len(muestra) / segundos_normalizar, 1) if segundos_normalizar > 0 else None,
+        **evaluar_correccion(corpus, resultado["calle_oficial"]),
+    }
+
+
+def medir_geocodificacion(consultas, latencia=0.0, tasa_fallos=0.0, solicitudes_por_segundo=50.0,
+                          trabajadores=4, reintentos=3, semilla=0):
+    """Geocodifica consultas distintas con MotorGeocodificacion contra el servidor falso local."""
+    registro = RegistroEjecucion("benchmark_geocodificacion")
+    with ServidorGeocodificadorFalso(latencia=latencia, tasa_fallos=tasa_fallos, semilla=semilla) as servidor:
+        motor = MotorGeocodificacion(
+            solicitudes_por_segundo=solicitudes_por_segundo, max_trabajadores=trabajadores, reintentos=reintentos,
+            espera_base=0.05, dominio=servidor.dominio, esquema="http",
+        )
+        inicio = time.perf_counter()
+        resultados = motor.geocodificar_lote(consultas)
+        segundos = time.perf_counter() - inicio
+        solicitudes, fallos_inyectados = servidor.solicitudes, servidor.fallos_inyectados
+    registro.registrar_latencias((r.latencia for r in resultados.values()), (r.espera for r in resultados.values()))
+    estados = pd.Series([r.estado for r in resultados.values()]).value_counts().to_dict()
+    return {
+        "consultas": len(resultados),
+        "latencia_servidor_s": latencia,
+        "tasa_fallos_servidor": tasa_fallos,
+        "solicitudes_por_segundo": solicitudes_por_segundo,
+        "trabajadores": trabajadores,
+        "segundos": round(segundos, 4),
+        "consultas_por_segundo": round(len(resultados) / segundos, 1) if segundos > 0 else None,
+        "solicitudes_http": solicitudes,
+        "fallos_inyectados": fallos_inyectados,
+        "reintentos": int(sum(r.intentos for r in resultados.values()) - len(resultados)),
+        "estados": {str(k): int(v) for k, v in estados.items()},
+        "latencia": registro.percentiles_latencia(),
+        "espera": registro.percentiles_latencia(registro.esperas_geocodificador),
+    }
+
+
+def cargar_calles(ruta=None):
+    """Lista de calles oficiales desde un CSV con columna 'Calle', o desde el snapshot local."""
+    if ruta:
+        calles_df = pd.read_csv(ruta)
+        calles_df["normalizado"] = calles_df["Calle"].map(normalizar)
+    else:
+        calles_df = obtener_calles_conchali()
+    return calles_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de corrección y geocodificación con datos sintéticos.")
+    parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000], help="Tamaños de corpus (por defecto 1000 10000).")
+    parser.add_argument("--umbral", type=int, nargs="+", default=[80], help="Umbrales de corrección a comparar (por defecto 80).")
+    parser.add_argument("--calles", help="CSV con columna 'Calle' (por defecto, el snapshot local de calles).")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--consultas-geocodificacion", type=int, default=200, help="Consultas distintas para el benchmark de geocodificación (0 = omitir).")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada del servidor falso en segundos.")
+    parser.add_argument("--tasa-fallos", type=float, default=0.0, help="Fracción de respuestas 503 del servidor falso.")
+    parser.add_argument("--solicitudes-por-segundo", type=float, default=50.0)
+    parser.add_argument("--trabajadores", type=int, default=4)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto, se imprime en pantalla).")
+    args = parser.parse_args(argv)
+
+    calles_df = cargar_calles(args.calles)
+    if calles_df is None or calles_df.empty:
+        print("Sin lista de calles oficiales: use --calles o genere el snapshot local.", file=sys.stderr)
+        return 1
+    indice = IndiceCalles(calles_df)
+    calles = calles_df["Calle"].tolist()
+
+    resultados = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "semilla": args.semilla,
+        "version_calles": indice.version,
+        "calles": len(indice),
+        "correccion": [],
+        "geocodificacion": None,
+    }
+    for filas in args.filas:
+        corpus = generar_corpus(calles, filas, semilla=args.semilla)
+        for umbral in args.umbral:
+            medicion = medir_correccion(corpus, indice, umbral)
+            print(f"Corrección {filas} filas, umbral {umbral}: {medicion['filas_por_segundo']} filas/s, "
+                  f"precisión {medicion['precision']}, recall {medicion['recall']}, pico {medicion['memoria_pico_mb']} MB", file=sys.stderr)
+            resultados["correccion"].append(medicion)
+
+    if args.consultas_geocodificacion > 0:
+        corpus = generar_corpus(calles, args.consultas_geocodificacion * 2, semilla=args.semilla + 1)
+        corregidas = corregir_direcciones(corpus["Direccion"], indice)["direccion_corregida"]
+        consultas = list(dict.fromkeys(consulta_geocodificacion(d) for d in corregidas))[:args.consultas_geocodificacion]
+        resultados["geocodificacion"] = medir_geocodificacion(
+            consultas, latencia=args.latencia, tasa_fallos=args.tasa_fallos,
+            solicitudes_por_segundo=args.solicitudes_por_segundo, trabajadores=args.trabajadores, semilla=args.semilla,
+        )
+        geo = resultados["geocodificacion"]
+        print(f"Geocodificación {geo['consultas']} consultas: {geo['consultas_por_segundo']} consultas/s, "
+              f"p50 {geo['latencia'].get('p50_ms')} ms, p99 {geo['latencia'].get('p99_ms')} ms "
+              f"(espera de turno p50 {geo['espera'].get('p50_ms')} ms)", file=sys.stderr)
+
+    texto = json.dumps(resultados, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"<<< Resultados guardados en '{args.salida}'.", file=sys.stderr)
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Caché persistente (SQLite) de resultados de geocodificación.
+
+Sobrevive reinicios y redeploys, a diferencia de @st.cache_data. Guarda tanto los
+resultados encontrados como los "no encontrados" (caché negativa, con su propio TTL)
+para no volver a consultar al proveedor por direcciones que no existen.
+"""
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+ESTADO_OK = "OK"
+ESTADO_NO_ENCONTRADO = "NO_ENCONTRADO"
+
+MAX_CLAVES_POR_CONSULTA = 500 # Bajo el límite de parámetros por sentencia de SQLite
+
+EntradaGeocodificacion = namedtuple("EntradaGeocodificacion", ["lat", "lon", "estado", "creado"])
+
+
+class CacheGeocodificacion:
+    """Caché clave -> (lat, lon, estado) con TTL, TTL negativo y desalojo LRU por tamaño."""
+
+    def __init__(self, ruta, ttl=30 * 24 * 3600, ttl_no_encontrado=7 * 24 * 3600, max_entradas=100000):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.ttl_no_encontrado = ttl_no_encontrado
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.aciertos_negativos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        # Streamlit ejecuta cada sesión en su propio hilo: una sola conexión protegida por lock
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocodificaciones (
+                clave TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                estado TEXT NOT NULL,
+                creado REAL NOT NULL,
+                usado REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocodificaciones_usado ON geocodificaciones (usado)")
+        self._conn.commit()
+        # Conteo aproximado de filas: evita un COUNT(*) en cada guardado (ver guardar_lote)
+        self._entradas_aprox = self._conn.execute("SELECT COUNT(*) FROM geocodificaciones").fetchone()[0]
+
+    def _vigente(self, estado, creado, ahora):
+        ttl = self.ttl if estado == ESTADO_OK else self.ttl_no_encontrado
+        return ttl is None or ahora - creado < ttl
+
+    def obtener(self, clave):
+        """Devuelve la EntradaGeocodificacion vigente para la clave, o None si no está (o expiró)."""
+        return self.obtener_lote([clave]).get(clave)
+
+    def obtener_lote(self, claves):
+        """Entradas vigentes de varias claves: dict clave -> EntradaGeocodificacion (las que faltan o expiraron no aparecen).
+
+        Las marcas de uso de los aciertos se actualizan juntas, en una sola transacción por lote.
+        """
+        claves = list(dict.fromkeys(claves))
+        ahora = time.time()
+        entradas = {}
+        with self._lock:
+            for inicio in range(0, len(claves), MAX_CLAVES_POR_CONSULTA):
+                tramo = claves[inicio:inicio + MAX_CLAVES_POR_CONSULTA]
+                filas = self._conn.execute(
+                    f"SELECT clave, lat, lon, estado, creado FROM geocodificaciones WHERE clave IN ({','.join('?' * len(tramo))})",
+                    tramo,
+                ).fetchall()
+                for clave, lat, lon, estado, creado in filas:
+                    if self._vigente(estado, creado, ahora):
+                        entradas[clave] = EntradaGeocodificacion(lat, lon, estado, creado)
+            if entradas:
+                self._conn.executemany("UPDATE geocodificaciones SET usado = ? WHERE clave = ?", [(ahora, c) for c in entradas])
+                self._conn.commit()
+            aciertos = sum(1 for e in entradas.values() if e.estado == ESTADO_OK)
+            self.aciertos += aciertos
+            self.aciertos_negativos += len(entradas) - aciertos
+            self.fallos += len(claves) - len(entradas)
+        return entradas
+
+    def guardar(self, clave, lat, lon, estado=ESTADO_OK):
+        """Guarda (o reemplaza) el resultado de una clave."""
+        self.guardar_lote([(clave, lat, lon, estado)])
+
+    def guardar_lote(self, resultados):
+        """Guarda (o reemplaza) varios resultados (clave, lat, lon, estado) en una sola transacción.
+
+        El tamaño se lleva con un conteo aproximado (los reemplazos cuentan como filas nuevas):
+        la tabla solo se cuenta de verdad, y se desalojan las entradas menos usadas, cuando
+        ese conteo supera max_entradas.
+        """
+        ahora = time.time()
+        filas = [(clave, lat, lon, estado, ahora, ahora) for clave, lat, lon, estado in resultados]
+        if not filas:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geocodificaciones (clave, lat, lon, estado, creado, usado) VALUES (?, ?, ?, ?, ?, ?)",
+                filas,
+            )
+            self._entradas_aprox += len(filas)
+            if self.max_entradas is not None and self._entradas_aprox > self.max_entradas:
+                total = self._conn.execute("SELECT COUNT(*) FROM geocodificaciones").fetchone()[0]
+                if total > self.max_entradas:
+                    self._conn.execute(
+                        "DELETE FROM geocodificaciones WHERE clave IN "
+                        "(SELECT clave FROM geocodificaciones ORDER BY usado ASC LIMIT ?)",
+                        (total - self.max_entradas,),
+                    )
+                    total = self.max_entradas
+                self._entradas_aprox = total
+            self._conn.commit()
+
+    def purgar_expiradas(self):
+        """Elimina las entradas cuyo TTL ya venció. Devuelve cuántas se borraron."""
+        ahora = time.time()
+        with self._lock:
+            borradas = 0
+            if self.ttl is not None:
+                borradas += self._conn.execute(
+                    "DELETE FROM geocodificaciones WHERE estado = ? AND creado < ?", (ESTADO_OK, ahora - self.ttl)
+                ).rowcount
+            if self.ttl_no_encontrado is not None:
+                borradas += self._conn.execute(
+                    "DELETE FROM geocodificaciones WHERE estado != ? AND creado < ?", (ESTADO_OK, ahora - self.ttl_no_encontrado)
+                ).rowcount
+            self._conn.commit()
+            self._entradas_aprox = max(self._entradas_aprox - borradas, 0)
+            return borradas
+
+    def precalentar(self):
+        """Recorre la tabla completa una vez (arranque del servidor) para que las primeras consultas no esperen al disco.
+
+        Solo calienta la caché de páginas del sistema operativo (y la de SQLite, hasta su
+        tamaño): las filas leídas se descartan, no quedan en memoria de Python. No cambia los
+        contadores ni las marcas de uso. Devuelve el número de entradas.
+        """
+        with self._lock:
+            return sum(1 for _ in self._conn.execute("SELECT clave, lat, lon, estado, creado FROM geocodificaciones"))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM geocodificaciones").fetchone()[0]
+
+    def estadisticas(self):
+        """Contadores de aciertos/fallos desde que se abrió la caché."""
+        consultas = self.aciertos + self.aciertos_negativos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "aciertos_negativos": self.aciertos_negativos,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos + self.aciertos_negativos) / consultas if consultas else 0.0,
+            "entradas": len(self),
+        }
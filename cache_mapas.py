@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Caché del HTML renderizado de los mapas folium.
+
+La clave es un hash del contenido de las entradas del mapa (puntos, mapa de
+colores y opciones de renderizado), de modo que un rerun de Streamlit o una
+sesión nueva con los mismos datos reutiliza el HTML ya generado en vez de
+reconstruir y serializar el mapa. Se guarda en memoria (por proceso) y en disco
+(entre reinicios), con un máximo de entradas.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from compartido import huella_contenido
+
+# Subir si cambia la forma de dibujar el mapa: invalida el HTML guardado
+FORMATO_MAPA = 2
+
+
+def huella_mapa(data, columnas, color_map, opciones=None):
+    """Hash sha256 de las columnas usadas para dibujar, el mapa de colores y las opciones."""
+    h = hashlib.sha256()
+    h.update(f"formato={FORMATO_MAPA}\n".encode("utf-8"))
+    h.update(huella_contenido(data, columnas).encode("ascii"))
+    h.update(json.dumps(color_map, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(json.dumps(opciones or {}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+class CacheMapas:
+    """HTML de mapas por huella: LRU en memoria + archivos en disco (seguro entre hilos)."""
+
+    def __init__(self, directorio, max_entradas=20, max_en_memoria=4):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self.max_en_memoria = max_en_memoria
+        os.makedirs(directorio, exist_ok=True)
+        self._memoria = OrderedDict() # clave -> (html, puntos)
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.json")
+
+    def obtener(self, clave):
+        """Devuelve (html, puntos) o None si el mapa no está en caché."""
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.aciertos += 1
+                return self._memoria[clave]
+        try:
+            with open(self._ruta(clave), encoding="utf-8") as f:
+                guardado = json.load(f)
+            os.utime(self._ruta(clave)) # Marca de uso para la poda
+        except (FileNotFoundError, ValueError, KeyError):
+            with self._lock:
+                self.fallos += 1
+            return None
+        entrada = (guardado["html"], guardado["puntos"])
+        with self._lock:
+            self.aciertos += 1
+            self._recordar(clave, entrada)
+        return entrada
+
+    def guardar(self, clave, html, puntos):
+        ruta_temporal = self._ruta(clave) + ".tmp"
+        with open(ruta_temporal, "w", encoding="utf-8") as f:
+            json.dump({"html": html, "puntos": puntos}, f, ensure_ascii=False)
+        os.replace(ruta_temporal, self._ruta(clave))
+        with self._lock:
+            self._recordar(clave, (html, puntos))
+            self._podar()
+
+    def _recordar(self, clave, entrada):
+        self._memoria[clave] = entrada
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_en_memoria:
+            self._memoria.popitem(last=False)
+
+    def _podar(self):
+        archivos = [os.path.join(self.directorio, a) for a in os.listdir(self.directorio) if a.endswith(".json")]
+        archivos.sort(key=os.path.getmtime)
+        for ruta in archivos[:-self.max_entradas]:
+            os.remove(ruta)
+
+    def estadisticas(self):
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "en_memoria": len(self._memoria)}
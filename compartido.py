@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Objetos calculados una vez por proceso y compartidos entre sesiones de Streamlit.
+
+Cada sesión guarda solo una referencia al objeto compartido (p. ej. el resultado
+procesado de una versión de la hoja), en vez de su propia copia. Los objetos se
+tratan como de solo lectura: con pandas >= 3 (copy-on-write) cualquier
+modificación de un DataFrame derivado crea una copia y no altera el compartido.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def huella_contenido(data, columnas=None):
+    """sha256 del contenido de las columnas indicadas (todas por defecto), sin depender del índice."""
+    columnas = [c for c in (columnas if columnas is not None else data.columns) if c in data.columns]
+    h = hashlib.sha256(repr(columnas).encode("utf-8"))
+    h.update(np.ascontiguousarray(pd.util.hash_pandas_object(data[columnas], index=False).to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+class CacheCompartida:
+    """Diccionario LRU acotado y seguro entre hilos de clave -> objeto de solo lectura."""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self._objetos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave not in self._objetos:
+                return None
+            self._objetos.move_to_end(clave)
+            return self._objetos[clave]
+
+    def compartir(self, clave, objeto):
+        """Guarda objeto bajo clave, salvo que ya exista uno: devuelve siempre la instancia compartida."""
+        with self._lock:
+            if clave in self._objetos:
+                self._objetos.move_to_end(clave)
+                return self._objetos[clave]
+            self._objetos[clave] = objeto
+            while len(self._objetos) > self.max_entradas:
+                self._objetos.popitem(last=False)
+            return objeto
+
+    def __len__(self):
+        return len(self._objetos)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Comunas del Gran Santiago y detección de la comuna escrita en una dirección.
+
+Los vecinos suelen terminar la dirección con la comuna ("Tres Ote. 5317, Conchalí",
+"Av. Recoleta 1234 recoleta"). detectar_comuna() reconoce esa comuna al final del
+texto y la separa de la dirección, para corregir la calle con el índice de esa
+comuna y geocodificar en su contexto.
+"""
+import re
+from collections import namedtuple
+
+from unidecode import unidecode
+
+Comuna = namedtuple("Comuna", ["clave", "nombre"])
+
+# clave (slug, igual que en codigo-postal.co) -> nombre oficial
+COMUNAS = {c.clave: c for c in [
+    Comuna("cerrillos", "Cerrillos"),
+    Comuna("cerro-navia", "Cerro Navia"),
+    Comuna("conchali", "Conchalí"),
+    Comuna("el-bosque", "El Bosque"),
+    Comuna("estacion-central", "Estación Central"),
+    Comuna("huechuraba", "Huechuraba"),
+    Comuna("independencia", "Independencia"),
+    Comuna("la-cisterna", "La Cisterna"),
+    Comuna("la-florida", "La Florida"),
+    Comuna("la-granja", "La Granja"),
+    Comuna("la-pintana", "La Pintana"),
+    Comuna("la-reina", "La Reina"),
+    Comuna("las-condes", "Las Condes"),
+    Comuna("lo-barnechea", "Lo Barnechea"),
+    Comuna("lo-espejo", "Lo Espejo"),
+    Comuna("lo-prado", "Lo Prado"),
+    Comuna("macul", "Macul"),
+    Comuna("maipu", "Maipú"),
+    Comuna("nunoa", "Ñuñoa"),
+    Comuna("pedro-aguirre-cerda", "Pedro Aguirre Cerda"),
+    Comuna("penalolen", "Peñalolén"),
+    Comuna("providencia", "Providencia"),
+    Comuna("pudahuel", "Pudahuel"),
+    Comuna("puente-alto", "Puente Alto"),
+    Comuna("quilicura", "Quilicura"),
+    Comuna("quinta-normal", "Quinta Normal"),
+    Comuna("recoleta", "Recoleta"),
+    Comuna("renca", "Renca"),
+    Comuna("san-bernardo", "San Bernardo"),
+    Comuna("san-joaquin", "San Joaquín"),
+    Comuna("san-miguel", "San Miguel"),
+    Comuna("san-ramon", "San Ramón"),
+    Comuna("santiago", "Santiago"),
+    Comuna("vitacura", "Vitacura"),
+]}
+
+
+def _patron_nombre(nombre):
+    """Patrón del nombre que acepta mayúsculas/minúsculas, tildes omitidas y espacios variables."""
+    partes = []
+    for caracter in nombre:
+        base = unidecode(caracter).lower()
+        if caracter == " ":
+            partes.append(r"\s+")
+        elif base != caracter.lower():
+            partes.append(f"[{base}{caracter.lower()}]")
+        else:
+            partes.append(re.escape(caracter.lower()))
+    return "".join(partes)
+
+
+_CLAVE_POR_NOMBRE = {unidecode(c.nombre).lower(): c.clave for c in COMUNAS.values()}
+# Alternativas más largas primero, para que gane el nombre completo de la comuna
+_ALTERNATIVAS = "|".join(_patron_nombre(c.nombre) for c in sorted(COMUNAS.values(), key=lambda c: -len(c.nombre)))
+
+# Sufijo regional que puede cerrar la dirección: ", Santiago", ", Región Metropolitana", ", RM", ", Chile"
+_SUFIJO_REGIONAL = r"(?:santiago|regi[oó]n\s+metropolitana|r\.?\s?m\.?|chile)"
+
+# La comuna va al final, separada por coma, por "comuna (de)" o justo después del número
+# (así "Avenida Independencia" sin número no se confunde con la comuna Independencia),
+# y puede seguirle el sufijo regional.
+PATRON_COMUNA_FINAL = re.compile(
+    r"(?:\s*,\s*|(?<=\d)\s+|(?P<explicita>(?:\s*,\s*|\s+)comuna\s+(?:de\s+)?))"
+    r"(?P<comuna>" + _ALTERNATIVAS + r")"
+    r"(?:\s*,?\s*" + _SUFIJO_REGIONAL + r")*"
+    r"[\s,.]*$",
+    re.IGNORECASE,
+)
+# Solo el sufijo regional, sin comuna (p. ej. "Tres Oriente 5317, Santiago, Chile")
+PATRON_SUFIJO_FINAL = re.compile(
+    r"(?:\s*,\s*|(?<=\d)\s+)" + _SUFIJO_REGIONAL + r"(?:\s*,?\s*" + _SUFIJO_REGIONAL + r")*[\s,.]*$",
+    re.IGNORECASE,
+)
+
+
+def clave_comuna(nombre):
+    """Clave de la comuna a partir de su nombre escrito (con o sin tildes); None si no es una comuna conocida."""
+    return _CLAVE_POR_NOMBRE.get(re.sub(r"\s+", " ", unidecode(str(nombre)).lower().strip()))
+
+
+def detectar_comuna(direccion, comuna_predeterminada=None):
+    """Separa la comuna escrita al final de la dirección.
+
+    Devuelve (clave_comuna, direccion_sin_comuna). Un "Santiago" final a secas es la
+    ciudad, no la comuna: solo cuenta como comuna Santiago tras "comuna (de)". Si no se
+    reconoce ninguna comuna se devuelve comuna_predeterminada, y la dirección sin el
+    sufijo regional si lo tenía (o sin cambios).
+    """
+    texto = str(direccion)
+    match = PATRON_COMUNA_FINAL.search(texto)
+    if match:
+        clave = clave_comuna(match.group("comuna"))
+        if clave != "santiago" or match.group("explicita"):
+            return clave, texto[:match.start()].strip()
+    sufijo = PATRON_SUFIJO_FINAL.search(texto)
+    if not sufijo:
+        return comuna_predeterminada, direccion
+    return comuna_predeterminada, texto[:sufijo.start()].strip()
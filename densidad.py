@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Agregación de densidad de reportes en una cuadrícula, por tipo de problema.
+
+Los puntos geocodificados se asignan a celdas de una cuadrícula fija en grados
+(la misma para cualquier conjunto de datos) de forma vectorizada con NumPy. Los
+conteos se calculan una sola vez para todas las resoluciones y tipos, de modo
+que cambiar de tipo o de resolución solo filtra una tabla pequeña de celdas.
+"""
+import numpy as np
+import pandas as pd
+
+TODOS_LOS_TIPOS = "TODOS"
+
+# Lado de la celda en grados (0.001° de latitud son unos 110 m)
+RESOLUCIONES_DENSIDAD = {
+    "Fina (~110 m)": 0.001,
+    "Media (~280 m)": 0.0025,
+    "Gruesa (~550 m)": 0.005,
+}
+
+
+def contar_celdas(lat, lon, codigos_tipo, tamano_celda):
+    """Conteo por (tipo, celda). Devuelve arrays (codigo_tipo, fila, columna, conteo); codigo -1 = todos los tipos."""
+    filas = np.floor(lat / tamano_celda).astype(np.int64)
+    columnas = np.floor(lon / tamano_celda).astype(np.int64)
+    por_tipo, conteo_tipo = np.unique(np.stack([codigos_tipo, filas, columnas], axis=1), axis=0, return_counts=True)
+    todas, conteo_todas = np.unique(np.stack([filas, columnas], axis=1), axis=0, return_counts=True)
+    codigos = np.concatenate([por_tipo[:, 0], np.full(len(todas), -1, dtype=np.int64)])
+    return (
+        codigos,
+        np.concatenate([por_tipo[:, 1], todas[:, 0]]),
+        np.concatenate([por_tipo[:, 2], todas[:, 1]]),
+        np.concatenate([conteo_tipo, conteo_todas]),
+    )
+
+
+class AgregadosDensidad:
+    """Conteos por celda para todas las resoluciones y tipos de un conjunto de puntos."""
+
+    def __init__(self, lat, lon, tipos, resoluciones=RESOLUCIONES_DENSIDAD):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        codigos, categorias = pd.factorize(pd.Series(tipos, dtype=object))
+        validos = np.isfinite(lat) & np.isfinite(lon)
+        lat, lon, codigos = lat[validos], lon[validos], codigos[validos].astype(np.int64)
+        self.puntos = int(validos.sum())
+        self.tipos = sorted(str(t) for t in categorias)
+        self.resoluciones = dict(resoluciones)
+        nombres_tipo = np.array([TODOS_LOS_TIPOS] + [str(t) for t in categorias], dtype=object)
+
+        self._celdas = {} # resolución -> DataFrame(tipo, lat, lon, conteo)
+        for nombre, tamano in self.resoluciones.items():
+            if self.puntos == 0:
+                self._celdas[nombre] = pd.DataFrame(columns=["tipo", "lat", "lon", "conteo"])
+                continue
+            cod, filas, columnas, conteo = contar_celdas(lat, lon, codigos, tamano)
+            self._celdas[nombre] = pd.DataFrame({
+                "tipo": pd.Categorical(nombres_tipo[cod + 1]),
+                "lat": (filas + 0.5) * tamano, # Centro de la celda
+                "lon": (columnas + 0.5) * tamano,
+                "conteo": conteo.astype(np.int32),
+            })
+
+    def celdas(self, resolucion, tipo=TODOS_LOS_TIPOS):
+        """Celdas con al menos un reporte del tipo pedido, en la resolución indicada."""
+        tabla = self._celdas[resolucion]
+        return tabla[tabla["tipo"] == tipo].reset_index(drop=True)
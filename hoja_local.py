@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Hoja de cálculo en memoria que imita la parte de gspread.Worksheet que usa la sincronización.
+
+Sirve para probar SincronizadorHoja sin credenciales ni red: guarda las celdas en una
+lista de filas, interpreta rangos A1 ("F2:J40") y cuenta las llamadas a la API y las
+celdas escritas. Puede leerse y guardarse como CSV. Uso:
+
+    hoja = HojaLocal.desde_csv("reportes.csv")
+    SincronizadorHoja(hoja, "estado_sincronizacion.json").sincronizar(data)
+    hoja.guardar_csv("reportes_sincronizados.csv")
+"""
+import csv
+import re
+
+PATRON_A1 = re.compile(r"^(?:.*!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+
+def numero_columna(letras):
+    """Inverso de sincronizacion_hoja.letra_columna ('A' -> 1, 'AA' -> 27)."""
+    numero = 0
+    for letra in letras:
+        numero = numero * 26 + ord(letra) - ord("A") + 1
+    return numero
+
+
+class HojaLocal:
+    """Celdas en memoria (filas de listas) con row_values, col_values, col_count, add_cols y batch_update."""
+
+    def __init__(self, filas=None):
+        self.filas = [list(fila) for fila in (filas or [])]
+        self.col_count = max((len(fila) for fila in self.filas), default=0)
+        self.llamadas = 0
+        self.celdas_escritas = 0
+
+    @classmethod
+    def desde_csv(cls, ruta):
+        with open(ruta, newline="", encoding="utf-8") as f:
+            return cls(list(csv.reader(f)))
+
+    def guardar_csv(self, ruta):
+        with open(ruta, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self.filas)
+
+    def row_values(self, fila):
+        valores = self.filas[fila - 1] if fila <= len(self.filas) else []
+        while valores and valores[-1] == "": # gspread no devuelve las celdas vacías del final
+            valores = valores[:-1]
+        return list(valores)
+
+    def col_values(self, columna):
+        valores = [fila[columna - 1] if columna <= len(fila) else "" for fila in self.filas]
+        while valores and valores[-1] == "": # Igual que row_values: sin las celdas vacías del final
+            valores.pop()
+        return valores
+
+    def add_cols(self, cantidad):
+        self.col_count += cantidad
+
+    def batch_update(self, data, value_input_option=None):
+        self.llamadas += 1
+        escritas = 0
+        for actualizacion in data:
+            match = PATRON_A1.match(actualizacion["range"])
+            if not match:
+                raise ValueError(f"Rango A1 inválido: {actualizacion['range']}")
+            col_inicio, fila_inicio = numero_columna(match.group(1)), int(match.group(2))
+            col_fin = numero_columna(match.group(3)) if match.group(3) else col_inicio
+            fila_fin = int(match.group(4)) if match.group(4) else fila_inicio
+            valores = actualizacion["values"]
+            if len(valores) != fila_fin - fila_inicio + 1 or any(len(v) != col_fin - col_inicio + 1 for v in valores):
+                raise ValueError(f"Los valores no coinciden con el rango {actualizacion['range']}")
+            if col_fin > self.col_count:
+                raise ValueError(f"El rango {actualizacion['range']} excede las {self.col_count} columnas de la hoja")
+            for desplazamiento, fila_valores in enumerate(valores):
+                fila = fila_inicio + desplazamiento
+                while len(self.filas) < fila:
+                    self.filas.append([])
+                celdas = self.filas[fila - 1]
+                if len(celdas) < col_fin:
+                    celdas.extend([""] * (col_fin - len(celdas)))
+                celdas[col_inicio - 1:col_fin] = fila_valores
+                escritas += len(fila_valores)
+        self.celdas_escritas += escritas
+        return {"totalUpdatedCells": escritas}
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Índice de calles oficiales para corrección rápida de direcciones.
+
+Reproduce exactamente el resultado de
+``process.extractOne(entrada_norm, calles_df["normalizado"], scorer=fuzz.token_sort_ratio)``
+pero sin puntuar todas las calles para cada dirección:
+
+1. Camino rápido por coincidencia exacta (diccionario).
+2. Pre-filtro vectorizado de candidatas con una cota superior del puntaje
+   (conteo de caracteres compartidos), que nunca descarta una calle capaz de
+   alcanzar el umbral.
+3. Puntaje difuso completo solo sobre la lista corta de candidatas.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+
+def clave_token_sort(texto):
+    """Clave que usa token_sort_ratio internamente: full_process ASCII + tokens ordenados."""
+    procesado = utils.full_process(str(texto), force_ascii=True)
+    return " ".join(sorted(procesado.split())).strip()
+
+
+class IndiceCalles:
+    """Índice pre-construido sobre la lista de calles oficiales (columnas 'Calle' y 'normalizado')."""
+
+    def __init__(self, calles_df):
+        if calles_df is None or calles_df.empty or "normalizado" not in calles_df.columns:
+            calles_df = pd.DataFrame(columns=["Calle", "normalizado"])
+
+        self.normalizados = [str(n) for n in calles_df["normalizado"].tolist()]
+        calles = calles_df["Calle"].tolist() if "Calle" in calles_df.columns else self.normalizados
+
+        # normalizado -> nombre oficial (primera aparición, igual que la máscara booleana original)
+        self.oficial_por_normalizado = {}
+        for norm, calle in zip(self.normalizados, calles):
+            self.oficial_por_normalizado.setdefault(norm, calle)
+
+        # Versión del contenido: cambia si cambia la lista oficial (para invalidar resultados guardados)
+        self.version = hashlib.sha1(
+            "\n".join(f"{n}\t{c}" for n, c in zip(self.normalizados, calles)).encode("utf-8")
+        ).hexdigest()[:12]
+
+        # Claves tal como las compara token_sort_ratio
+        self.claves = [clave_token_sort(n) for n in self.normalizados]
+        # clave -> posición de la primera calle con esa clave (camino rápido exacto)
+        self.posicion_exacta = {}
+        for pos, clave in enumerate(self.claves):
+            self.posicion_exacta.setdefault(clave, pos)
+
+        # Matriz de conteo de caracteres por calle para el pre-filtro vectorizado
+        alfabeto = sorted({c for clave in self.claves for c in clave})
+        self.alfabeto = {c: i for i, c in enumerate(alfabeto)}
+        self.conteos = np.zeros((len(self.claves), len(alfabeto)), dtype=np.int16)
+        for fila, clave in enumerate(self.claves):
+            for c in clave:
+                self.conteos[fila, self.alfabeto[c]] += 1
+        self.largos = np.array([len(clave) for clave in self.claves], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.claves)
+
+    @property
+    def empty(self):
+        return len(self.claves) == 0
+
+    def candidatas(self, clave_entrada, umbral):
+        """Posiciones (en orden original) de las calles cuyo puntaje máximo posible alcanza el umbral."""
+        if self.empty:
+            return np.array([], dtype=np.intp)
+        vector = np.zeros(len(self.alfabeto), dtype=np.int16)
+        for c in clave_entrada:
+            pos = self.alfabeto.get(c)
+            if pos is not None:
+                vector[pos] += 1
+        # ratio = 2*M/(la+lb) y M nunca supera los caracteres en común
+        comunes = np.minimum(self.conteos, vector).sum(axis=1)
+        cota = 200.0 * comunes / np.maximum(self.largos + len(clave_entrada), 1)
+        # fuzz.ratio redondea, por eso se compara contra umbral - 0.5
+        return np.nonzero(cota >= umbral - 0.5)[0]
+
+    def buscar(self, entrada_norm, umbral=80):
+        """Devuelve (calle_oficial, puntaje) del mejor match con puntaje >= umbral, o None."""
+        if self.empty:
+            return None
+        clave_entrada = clave_token_sort(entrada_norm)
+
+        # Camino rápido: una clave idéntica puntúa 100; para textos cortos ninguna otra
+        # clave puede redondear a 100, así que es también el primer máximo de extractOne.
+        pos = self.posicion_exacta.get(clave_entrada)
+        if pos is not None and len(clave_entrada) < 100:
+            return (self.oficial_por_normalizado[self.normalizados[pos]], 100) if 100 >= umbral else None
+
+        mejor_pos, mejor_puntaje = None, -1
+        for pos in self.candidatas(clave_entrada, umbral):
+            puntaje = fuzz.ratio(clave_entrada, self.claves[pos])
+            if puntaje > mejor_puntaje:  # '>' conserva el primer máximo, como max() en extractOne
+                mejor_pos, mejor_puntaje = pos, puntaje
+        if mejor_pos is None or mejor_puntaje < umbral:
+            return None
+        return self.oficial_por_normalizado[self.normalizados[mejor_pos]], mejor_puntaje
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Índice espacial de reportes geocodificados (cubetas de una cuadrícula en metros).
+
+Los puntos se ordenan por la celda de una cuadrícula de lado fijo en metros (proyección
+equirectangular local, suficiente a escala de una ciudad). Una consulta por radio solo
+revisa las celdas que cubren el círculo, sin recorrer todos los reportes. Con la misma
+idea, agrupar_cercanos() une los reportes del mismo tipo que están a menos de una
+distancia dada (p. ej. varios reportes del mismo bache) comparando solo celdas vecinas.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+RADIO_TIERRA_M = 6371008.8
+METROS_POR_GRADO = RADIO_TIERRA_M * math.pi / 180
+
+
+def distancia_metros(lat1, lon1, lat2, lon2):
+    """Distancia haversine en metros (acepta escalares o arrays de NumPy)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _clave_celda(filas, columnas):
+    """Un entero por celda (fila, columna), para ordenar y buscar con searchsorted."""
+    return np.asarray(filas, dtype=np.int64) * (1 << 32) + (np.asarray(columnas, dtype=np.int64) + (1 << 31))
+
+
+class IndiceEspacial:
+    """Puntos (lat, lon) agrupados por celda; cerca() devuelve los que están dentro de un radio."""
+
+    def __init__(self, lat, lon, tamano_celda_m=100.0):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.tamano_celda_m = float(tamano_celda_m)
+        validos = np.isfinite(self.lat) & np.isfinite(self.lon)
+        latitud_media = float(self.lat[validos].mean()) if validos.any() else 0.0
+        self._metros_lon = METROS_POR_GRADO * math.cos(math.radians(latitud_media))
+        posiciones = np.flatnonzero(validos)
+        claves = _clave_celda(*self._celdas(self.lat[posiciones], self.lon[posiciones]))
+        orden = np.argsort(claves, kind="stable")
+        self._posiciones = posiciones[orden] # Posiciones de los puntos, ordenadas por celda
+        self._claves, self._inicios, self._conteos = np.unique(claves[orden], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def _celdas(self, lat, lon):
+        filas = np.floor(np.asarray(lat) * METROS_POR_GRADO / self.tamano_celda_m).astype(np.int64)
+        columnas = np.floor(np.asarray(lon) * self._metros_lon / self.tamano_celda_m).astype(np.int64)
+        return filas, columnas
+
+    def cerca(self, lat, lon, radio_m):
+        """Posiciones de los puntos a <= radio_m metros de (lat, lon) y sus distancias, de la más cercana a la más lejana."""
+        fila, columna = self._celdas(lat, lon)
+        k = int(math.ceil(radio_m / self.tamano_celda_m))
+        claves = _clave_celda(np.arange(fila - k, fila + k + 1)[:, None], np.arange(columna - k, columna + k + 1)[None, :]).ravel()
+        indices = np.searchsorted(self._claves, claves)
+        existe = indices < len(self._claves)
+        existe[existe] = self._claves[indices[existe]] == claves[existe]
+        candidatos = [self._posiciones[self._inicios[i]:self._inicios[i] + self._conteos[i]] for i in indices[existe]]
+        if not candidatos:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        candidatos = np.concatenate(candidatos)
+        distancias = distancia_metros(lat, lon, self.lat[candidatos], self.lon[candidatos])
+        dentro = distancias <= radio_m
+        orden = np.argsort(distancias[dentro], kind="stable")
+        return candidatos[dentro][orden], distancias[dentro][orden]
+
+
+def agrupar_cercanos(lat, lon, categorias, distancia_m):
+    """Etiqueta de grupo por punto: puntos de la misma categoría a <= distancia_m quedan en el mismo grupo.
+
+    La unión es encadenada (si A está cerca de B y B de C, los tres son un grupo). Los
+    puntos sin coordenadas quedan solos. Las etiquetas son enteros desde 0.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    codigos = pd.factorize(pd.Series(categorias, dtype=object))[0].astype(np.int64)
+    if len(lat) == 0:
+        return np.array([], dtype=np.int64)
+    # Muchos reportes caen exactamente en la misma dirección geocodificada: se unen antes de buscar pares
+    validos = np.isfinite(lat) & np.isfinite(lon)
+    claves_exactas = np.stack([codigos, np.where(validos, np.round(lat * 1e6), 0).astype(np.int64),
+                               np.where(validos, np.round(lon * 1e6), 0).astype(np.int64)], axis=1)
+    claves_exactas[~validos, 0] = -1 - np.flatnonzero(~validos) # Cada punto inválido es su propio grupo
+    unicos, primeros, inverso = np.unique(claves_exactas, axis=0, return_index=True, return_inverse=True)
+    inverso = inverso.ravel()
+    u_lat, u_lon = lat[primeros], lon[primeros]
+    u_validos = unicos[:, 0] >= 0
+
+    # Pares candidatos: cada punto contra su celda y la mitad de sus vecinas. El lado de la celda
+    # es algo mayor que distancia_m para cubrir el error de la proyección local frente a haversine.
+    indice = IndiceEspacial(np.where(u_validos, u_lat, np.nan), np.where(u_validos, u_lon, np.nan), max(distancia_m * 1.01, 1e-3))
+    filas, columnas = indice._celdas(np.where(u_validos, u_lat, 0.0), np.where(u_validos, u_lon, 0.0))
+    base = pd.DataFrame({"i": np.arange(len(unicos)), "categoria": unicos[:, 0], "fila": filas, "columna": columnas})[u_validos]
+    pares = []
+    for d_fila, d_columna in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+        vecinas = base.assign(fila=base["fila"] + d_fila, columna=base["columna"] + d_columna)
+        cruce = base.merge(vecinas, on=["categoria", "fila", "columna"], suffixes=("_a", "_b"))
+        if d_fila == 0 and d_columna == 0:
+            cruce = cruce[cruce["i_a"] < cruce["i_b"]]
+        pares.append(cruce[["i_a", "i_b"]].to_numpy())
+    pares = np.concatenate(pares)
+    a, b = pares[:, 0], pares[:, 1]
+    cerca = distancia_metros(u_lat[a], u_lon[a], u_lat[b], u_lon[b]) <= distancia_m
+    a, b = a[cerca], b[cerca]
+
+    # Componentes conexas: cada punto toma la menor etiqueta de sus vecinos hasta que nada cambia
+    etiquetas = np.arange(len(unicos))
+    while True:
+        minimo = np.minimum(etiquetas[a], etiquetas[b])
+        nuevas = etiquetas.copy()
+        np.minimum.at(nuevas, a, minimo)
+        np.minimum.at(nuevas, b, minimo)
+        nuevas = nuevas[nuevas]
+        if np.array_equal(nuevas, etiquetas):
+            break
+        etiquetas = nuevas
+    return pd.factorize(etiquetas[inverso])[0].astype(np.int64)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Ingesta incremental del CSV publicado de Google Sheets.
+
+Guarda en disco el último resultado procesado (corrección + geocodificación) junto
+con una huella estable por fila. En cada actualización:
+
+1. Descarga el CSV con una solicitud condicional (ETag / Last-Modified); si el
+   servidor responde 304, o el contenido es idéntico al anterior, no hay nada que hacer.
+2. Las filas cuya huella ya estaba procesada reutilizan sus columnas derivadas;
+   solo las filas nuevas o editadas pasan por corrección y geocodificación.
+"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+import requests
+
+
+def huellas_filas(data, columnas):
+    """Huella estable (uint64) por fila, calculada sobre las columnas de origen indicadas."""
+    return pd.util.hash_pandas_object(data[columnas].astype(str), index=False).astype("uint64")
+
+
+class AlmacenIngesta:
+    """Estado persistente de la última ingesta: metadatos HTTP + DataFrame procesado."""
+
+    COLUMNA_HUELLA = "_huella_fila"
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta_metadatos = os.path.join(directorio, "metadatos.json")
+        self.ruta_procesado = os.path.join(directorio, "procesado.pkl")
+        self.metadatos = {}
+        self.procesado = None
+        try:
+            if os.path.exists(self.ruta_metadatos) and os.path.exists(self.ruta_procesado):
+                with open(self.ruta_metadatos, encoding="utf-8") as f:
+                    self.metadatos = json.load(f)
+                self.procesado = pd.read_pickle(self.ruta_procesado)
+        except Exception as e:
+            print(f"No se pudo leer el estado de ingesta en '{directorio}', se procesará todo de nuevo: {e}")
+            self.metadatos, self.procesado = {}, None
+
+    def descargar(self, url, timeout=30):
+        """Descarga condicional. Devuelve (contenido_bytes, metadatos_nuevos); contenido es None si no hubo cambios."""
+        headers = {}
+        condicional = self.procesado is not None and self.metadatos.get("url") == url
+        if condicional:
+            if self.metadatos.get("etag"):
+                headers["If-None-Match"] = self.metadatos["etag"]
+            if self.metadatos.get("last_modified"):
+                headers["If-Modified-Since"] = self.metadatos["last_modified"]
+        response = requests.get(url, headers=headers, timeout=timeout)
+        if condicional and response.status_code == 304:
+            print("<<< CSV sin cambios (HTTP 304).")
+            return None, dict(self.metadatos)
+        response.raise_for_status()
+        contenido = response.content
+        metadatos = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(contenido).hexdigest(),
+        }
+        # Muchos servidores no envían ETag: comparar el contenido también evita reprocesar
+        if condicional and metadatos["sha256"] == self.metadatos.get("sha256"):
+            print("<<< CSV sin cambios (mismo contenido).")
+            return None, {**self.metadatos, **metadatos}
+        return contenido, metadatos
+
+    def datos_origen(self):
+        """Columnas de origen (CSV limpio) del último resultado guardado, para reprocesar sin descargar."""
+        if self.procesado is None:
+            return None
+        return self.procesado[self.metadatos.get("columnas_origen", [])].copy()
+
+    def reutilizar(self, data, columnas_derivadas, version=None):
+        """Agrega la huella (sobre todas las columnas de data) y copia las columnas derivadas de las filas ya procesadas.
+
+        Devuelve (data, pendientes) donde pendientes es una máscara booleana de las filas
+        nuevas o editadas que deben procesarse. Si la versión (p. ej. de la lista de calles)
+        cambió, o el resultado guardado no tiene todas las columnas derivadas, todas las filas
+        quedan pendientes.
+        """
+        data = data.copy()
+        data[self.COLUMNA_HUELLA] = huellas_filas(data, list(data.columns))
+        previo = self.procesado
+        if (previo is None or self.COLUMNA_HUELLA not in previo.columns or self.metadatos.get("version") != version
+                or any(columna not in previo.columns for columna in columnas_derivadas)):
+            for columna in columnas_derivadas:
+                data[columna] = None
+            return data, pd.Series(True, index=data.index)
+
+        previo = previo.drop_duplicates(self.COLUMNA_HUELLA).set_index(self.COLUMNA_HUELLA)
+        for columna in columnas_derivadas:
+            valores = previo[columna].to_dict()
+            data[columna] = pd.Series([valores.get(h) for h in data[self.COLUMNA_HUELLA]], index=data.index, dtype=object)
+        pendientes = ~data[self.COLUMNA_HUELLA].isin(previo.index)
+        return data, pendientes
+
+    def guardar(self, data, metadatos, columnas_derivadas, version=None):
+        """Persiste el resultado procesado completo y los metadatos de la descarga.
+
+        Las columnas de origen (para datos_origen) son las de data menos las derivadas y la huella.
+        """
+        columnas_origen = [c for c in data.columns if c not in columnas_derivadas and c != self.COLUMNA_HUELLA]
+        data.to_pickle(self.ruta_procesado)
+        self.procesado = data
+        self.metadatos = {**metadatos, "version": version, "filas": len(data), "columnas_origen": columnas_origen}
+        with open(self.ruta_metadatos, "w", encoding="utf-8") as f:
+            json.dump(self.metadatos, f, ensure_ascii=False, indent=2)
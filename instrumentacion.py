@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Instrumentación de una ejecución del pipeline.
+
+Registra el tiempo de cada etapa (y filas por segundo), las latencias del
+geocodificador, los aciertos de las cachés y la distribución de puntajes de
+corrección. El resultado se muestra en el panel de diagnóstico de la app y se
+guarda como reporte JSON para comparar ejecuciones en el tiempo.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+# Tramos del histograma de puntaje_match (el umbral de corrección es 80)
+TRAMOS_PUNTAJE = [0, 80, 85, 90, 95, 100, 101]
+
+
+class RegistroEjecucion:
+    """Acumula métricas de una ejecución. No es seguro entre hilos: se usa desde el hilo que ejecuta el pipeline."""
+
+    def __init__(self, nombre="ejecucion"):
+        self.nombre = nombre
+        self.inicio = time.time()
+        self.etapas = [] # dicts con nombre, segundos, filas, filas_por_segundo
+        self.latencias_geocodificador = []
+        self.esperas_geocodificador = [] # Cola del límite de tasa + esperas entre reintentos
+        self.caches = {} # nombre -> contadores acumulados (aciertos, fallos, ...)
+        self.puntajes = []
+
+    @contextmanager
+    def etapa(self, nombre, filas=None):
+        """Mide el tiempo de pared del bloque. Las filas pueden fijarse dentro del bloque con registro["filas"]."""
+        registro = {"nombre": nombre, "segundos": None, "filas": filas, "filas_por_segundo": None}
+        t0 = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro["segundos"] = round(time.perf_counter() - t0, 4)
+            if registro["filas"] and registro["segundos"] > 0:
+                registro["filas_por_segundo"] = round(registro["filas"] / registro["segundos"], 1)
+            self.etapas.append(registro)
+
+    def resumen_etapas(self):
+        """Totales por nombre de etapa (una etapa puede repetirse, p. ej. una vez por bloque)."""
+        resumen = {}
+        for etapa in self.etapas:
+            total = resumen.setdefault(etapa["nombre"], {"veces": 0, "segundos": 0.0, "filas": 0})
+            total["veces"] += 1
+            total["segundos"] += etapa["segundos"] or 0
+            total["filas"] += etapa["filas"] or 0
+        for total in resumen.values():
+            total["segundos"] = round(total["segundos"], 4)
+            total["filas_por_segundo"] = round(total["filas"] / total["segundos"], 1) if total["filas"] and total["segundos"] > 0 else None
+        return resumen
+
+    def registrar_latencias(self, latencias, esperas=()):
+        """Latencias de las llamadas al proveedor y, aparte, el tiempo que cada consulta esperó su turno."""
+        self.latencias_geocodificador.extend(float(x) for x in latencias)
+        self.esperas_geocodificador.extend(float(x) for x in esperas)
+
+    def registrar_cache(self, nombre, **contadores):
+        """Suma contadores de una caché (se puede llamar una vez por bloque)."""
+        acumulado = self.caches.setdefault(nombre, {})
+        for clave, valor in contadores.items():
+            acumulado[clave] = acumulado.get(clave, 0) + valor
+
+    def registrar_puntajes(self, puntajes):
+        """Agrega puntajes de corrección (NaN = sin match sobre el umbral)."""
+        self.puntajes.append(np.asarray(puntajes, dtype=float))
+
+    def distribucion_puntajes(self):
+        if not self.puntajes:
+            return {}
+        valores = np.concatenate(self.puntajes)
+        con_match = valores[~np.isnan(valores)]
+        conteos, _ = np.histogram(con_match, bins=TRAMOS_PUNTAJE)
+        etiquetas = [f"{a}-{b - 1}" if b - 1 > a else str(a) for a, b in zip(TRAMOS_PUNTAJE[:-1], TRAMOS_PUNTAJE[1:])]
+        return {
+            "sin_match": int(np.isnan(valores).sum()),
+            "histograma": dict(zip(etiquetas, (int(c) for c in conteos))),
+            "media": round(float(con_match.mean()), 2) if con_match.size else None,
+        }
+
+    def tasas_caches(self):
+        """Contadores de cada caché con su tasa de aciertos (aciertos / (aciertos + fallos))."""
+        tasas = {}
+        for nombre, contadores in self.caches.items():
+            consultas = contadores.get("aciertos", 0) + contadores.get("fallos", 0)
+            tasas[nombre] = {**contadores, "tasa_aciertos": round(contadores.get("aciertos", 0) / consultas, 4) if consultas else None}
+        return tasas
+
+    def percentiles_latencia(self, valores=None):
+        valores = self.latencias_geocodificador if valores is None else valores
+        if not valores:
+            return {}
+        p50, p90, p99 = np.percentile(valores, [50, 90, 99])
+        return {
+            "n": len(valores),
+            "p50_ms": round(p50 * 1000, 1),
+            "p90_ms": round(p90 * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "max_ms": round(max(valores) * 1000, 1),
+        }
+
+    def reporte(self):
+        return {
+            "nombre": self.nombre,
+            "inicio": datetime.fromtimestamp(self.inicio).isoformat(timespec="seconds"),
+            "segundos_etapas": round(sum(e["segundos"] or 0 for e in self.etapas), 4),
+            "resumen_etapas": self.resumen_etapas(),
+            "etapas": self.etapas,
+            "latencia_geocodificador": self.percentiles_latencia(),
+            "espera_geocodificador": self.percentiles_latencia(self.esperas_geocodificador),
+            "caches": self.tasas_caches(),
+            "puntajes_correccion": self.distribucion_puntajes(),
+        }
+
+    def guardar_json(self, directorio):
+        """Escribe el reporte en directorio/<nombre>_<fecha>.json y devuelve la ruta."""
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f"{self.nombre}_{datetime.fromtimestamp(self.inicio).strftime('%Y%m%d_%H%M%S')}.json")
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.reporte(), f, ensure_ascii=False, indent=2)
+        return ruta
+
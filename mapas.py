@@ -1,219 +1,176 @@
 # -*- coding: utf-8 -*- # Añadir encoding por si acaso
 import streamlit as st
 import pandas as pd
-import requests
-import re
-from bs4 import BeautifulSoup
-from unidecode import unidecode
-from fuzzywuzzy import process, fuzz
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderUnavailable
-import folium
-from streamlit_folium import st_folium
-import time
+import os
 import traceback
+from procesamiento import (
+    COLUMNA_DIRECCION_NUEVA, COLUMNA_TIPO_ORIGINAL, URL_CSV_PREDETERMINADO,
+    COMUNA_PREDETERMINADA, MAX_COMUNAS_EN_MEMORIA, configurar_avisos, obtener_snapshot_calles, obtener_snapshot_comuna,
+    obtener_calles_conchali, obtener_indice_calles, obtener_indice_comuna, corregir_direccion,
+    obtener_coords, obtener_gestor_trabajos, iniciar_procesamiento_hoja,
+    cargar_resultado_precalculado, generar_mapa_colores, construir_mapa_csv,
+    compactar_resultado, compartir_resultado, mapa_csv_html, obtener_agregados_densidad, mapa_densidad_html,
+    RADIOS_CERCANOS_M, RADIO_CERCANOS_M, MAX_CERCANOS_EN_MAPA, DISTANCIAS_DUPLICADOS_M, DISTANCIA_DUPLICADOS_M,
+    COLORES_CSS_MARCADOR, DEFAULT_ASSIGN_COLOR, tipos_reporte, reportes_cercanos, agrupar_duplicados,
+)
+from comunas import COMUNAS, detectar_comuna
+from compartido import huella_contenido
+from densidad import RESOLUCIONES_DENSIDAD, TODOS_LOS_TIPOS
+from instrumentacion import RegistroEjecucion
+from trabajos import ESTADO_ERROR
+from arranque import iniciar_precalentamiento, registrar_primer_render, estado_arranque
 
 # --- Configuración de Página ---
 st.set_page_config(page_title="Mapa de Direcciones Corregidas", layout="wide")
 st.title("🗺️ Geo gestión Conchalí")
 print("--- Script Iniciado ---")
 
-# --- Constantes de Nombres de Columnas (Definidos SIN espacios extra) ---
-COLUMNA_DIRECCION_ORIGINAL = u'¿Dónde ocurre este problema? (Por favor indica la dirección lo más exacta posible, Calle, Numero y Comuna)'
-COLUMNA_TIPO_ORIGINAL = u'¿Qué tipo de problema estás reportando?' # SIN espacios extra
-COLUMNA_DIRECCION_NUEVA = 'Direccion'
+# Índices y cachés se cargan en segundo plano (una vez por proceso; ya listos si el servidor se inició con arranque.py).
+# folium y streamlit_folium se importan solo en los caminos que dibujan mapas.
+iniciar_precalentamiento()
 
-# --- Paleta de Colores Base ---
-BASE_COLOR_PALETTE = [
-    'blue', 'green', 'purple', 'orange', 'darkred', 'cadetblue',
-    'darkgreen', 'pink', 'red', 'lightblue', 'darkpurple', 'beige'
-]
-COLOR_DESCONOCIDO = 'lightgray'
-DEFAULT_ASSIGN_COLOR = 'black'
+# Los avisos de las etapas de procesamiento se muestran en la página
+configurar_avisos(error=st.error, warning=st.warning, info=st.info)
 
-# --- Funciones ---
-@st.cache_data
-def obtener_calles_conchali():
-    """Obtiene la lista de calles oficiales de Conchalí desde una fuente web."""
-    print(">>> Ejecutando obtener_calles_conchali (o usando caché)...")
-    url = "https://codigo-postal.co/chile/santiago/calles-de-conchali/"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        ul_cities = soup.find("ul", class_="cities")
-        if not ul_cities:
-            st.error("No se pudo encontrar la lista de calles en la URL.")
-            return pd.DataFrame(columns=["Calle", "normalizado"])
-        li_items = ul_cities.find_all("li")
-        calles = [li.find("a").text.strip() for li in li_items if li.find("a")]
-        if not calles:
-            st.error("No se extrajeron calles de la lista encontrada.")
-            return pd.DataFrame(columns=["Calle", "normalizado"])
-        df_calles_conchali = pd.DataFrame(calles, columns=["Calle"])
-        df_calles_conchali["normalizado"] = df_calles_conchali["Calle"].apply(normalizar)
-        print(f"<<< Calles oficiales cargadas/cacheadas: {len(df_calles_conchali)}")
-        return df_calles_conchali
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error de red al obtener las calles: {e}")
-        return pd.DataFrame(columns=["Calle", "normalizado"])
-    except Exception as e:
-        st.error(f"Error inesperado al procesar las calles: {e}")
-        return pd.DataFrame(columns=["Calle", "normalizado"])
-
-def normalizar(texto):
-    """Normaliza el texto: quita acentos, convierte a mayúsculas, elimina no alfanuméricos (excepto espacios) y espacios extra."""
-    try:
-        texto = unidecode(str(texto)).upper()
-        texto = re.sub(r'[^\w\s0-9]', '', texto)
-        texto = re.sub(r'\s+', ' ', texto).strip()
-        return texto
-    except Exception as e:
-        return str(texto).upper().strip()
-
-def corregir_direccion(direccion_input, calles_df, umbral=80):
-    """Intenta corregir el nombre de la calle usando fuzzy matching contra la lista oficial."""
-    # Asegurar que la entrada sea string y quitar espacios extra
-    original_completa = str(direccion_input).strip()
-    if not original_completa: # Si está vacío después de strip, devolver vacío
-        return ""
-
-    match = re.match(r"(.*?)(\s*\d+)$", original_completa)
-    if match:
-        direccion_texto = match.group(1).strip()
-        numero_direccion = match.group(2).strip()
+# --- Estado de la lista oficial de calles (snapshot local, refrescado en segundo plano) ---
+# Mientras el precalentamiento no termina no se abre el snapshot aquí: en un arranque sin
+# snapshot eso esperaría la descarga de calles antes de dibujar la primera página.
+arranque = estado_arranque()
+with st.sidebar.expander("Calles oficiales"):
+    if not arranque["terminado"]:
+        st.caption("Cargando la lista de calles...")
     else:
-        direccion_texto = original_completa # Si no hay número, tomar todo como texto
-        numero_direccion = ""
-
-    # Si no hay texto de dirección (ej. solo era un número), devolver original
-    if not direccion_texto:
-        return original_completa
-
-    entrada_norm = normalizar(direccion_texto)
-    mejor_match = None
-    direccion_corregida_texto = direccion_texto # Empezar con el texto original
-
-    # Proceder solo si hay calles oficiales y la columna normalizada existe
-    if calles_df is not None and not calles_df.empty and "normalizado" in calles_df.columns:
-        try:
-            # Usar process.extractOne para simplificar
-            mejor_match_result = process.extractOne(entrada_norm, calles_df["normalizado"], scorer=fuzz.token_sort_ratio)
-            if mejor_match_result and mejor_match_result[1] >= umbral:
-                # Si hay buen match, obtener el nombre oficial de la calle
-                calle_oficial_norm = mejor_match_result[0]
-                # Buscar el nombre original correspondiente en calles_df
-                idx = calles_df["normalizado"] == calle_oficial_norm
-                if idx.any():
-                    direccion_corregida_texto = calles_df.loc[idx, "Calle"].values[0]
-                # else: (si no se encuentra el índice, algo raro pasó, mantener texto original)
-        except Exception as e:
-            print(f"Error durante fuzzy matching para '{entrada_norm}': {e}")
-            # Mantener el texto original si falla el matching
-
-    # Recomponer la dirección final con el texto (corregido o no) y el número
-    direccion_final = direccion_corregida_texto + (" " + numero_direccion if numero_direccion else "")
-    return direccion_final.strip()
-
-# --- VERSIÓN ACTUALIZADA de safe_corregir ---
-def safe_corregir(x, df_calles):
-    """Wrapper seguro para corregir_direccion, maneja NaNs y errores."""
-    # Si la entrada no es un string, está vacía o es NaN/None, devolverla tal cual.
-    if pd.isna(x) or not isinstance(x, str) or not x.strip():
-        # print(f"Skipping correction for input: {x}") # Debug opcional
-        return x # Devuelve NaN, None, '', etc. sin intentar corregir
-
-    try:
-        # Proceder con la corrección solo si es un string válido
-        corrected = corregir_direccion(x, df_calles)
-        # Debug opcional para ver qué se corrigió
-        # if x.strip().upper() != corrected.strip().upper():
-        #      print(f"CORRECCIÓN: '{x}' -> '{corrected}'")
-        return corrected
-    except Exception as e_corr:
-        print(f"ERROR durante safe_corregir para '{x}': {e_corr}")
-        return x # Devolver original si falla la corrección
-# --- FIN safe_corregir ---
-
-@st.cache_data(ttl=3600)
-def obtener_coords(direccion_corregida_completa):
-    """Obtiene coordenadas (lat, lon) para una dirección en Conchalí usando Nominatim."""
-    # Validar entrada antes de consultar
-    if pd.isna(direccion_corregida_completa) or not isinstance(direccion_corregida_completa, str) or not direccion_corregida_completa.strip():
-        return None
-
-    direccion_query = f"{direccion_corregida_completa}, Conchalí, Región Metropolitana, Chile"
-    geolocator = Nominatim(user_agent=f"mapa_conchali_app_v10_{int(time.time())}", timeout=10) # Incrementar versión
-    try:
-        location = geolocator.geocode(direccion_query, addressdetails=True)
-        if location: return location.latitude, location.longitude
-        else:
-            # print(f"Geocoding no encontró resultado para: {direccion_query}") # Debug opcional
-            return None
-    except GeocoderUnavailable:
-        st.warning("Servicio de geocodificación no disponible temporalmente.")
-        return None
-    except Exception as e:
-        st.error(f"Error geocodificación para '{direccion_query}': {e}")
-        return None
-
-def cargar_csv_predeterminado():
-    """Carga datos, LIMPIA nombres de columna, renombra DIRECCIÓN y procesa TIPO."""
-    print(">>> Cargando CSV...")
-    url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vSAitwliDu4GoT-HU2zXh4eFUDnky9o3M-B9PHHp7RbLWktH7vuHu1BMT3P5zqfVIHAkTptZ8VaZ-F7/pub?gid=1694829461&single=true&output=csv"
-    try:
-        data = pd.read_csv(url)
-        print("--- Columnas Originales Detectadas (Pre-Limpieza) ---")
-        print([f"'{col}'" for col in data.columns])
-
-        data.columns = data.columns.str.strip()
-        print("--- Columnas Después de Limpiar Espacios (str.strip) ---")
-        print([f"'{col}'" for col in data.columns])
-
-        # Verificar y procesar columna Dirección (usando nombre limpio)
-        if COLUMNA_DIRECCION_ORIGINAL in data.columns:
-            data[COLUMNA_DIRECCION_ORIGINAL] = data[COLUMNA_DIRECCION_ORIGINAL].astype(str)
-            data.rename(columns={COLUMNA_DIRECCION_ORIGINAL: COLUMNA_DIRECCION_NUEVA}, inplace=True)
-            print(f"Columna dirección renombrada a '{COLUMNA_DIRECCION_NUEVA}'")
-            data[COLUMNA_DIRECCION_NUEVA] = data[COLUMNA_DIRECCION_NUEVA].str.strip()
-        else:
-            st.error(f"Error crítico: No se encontró la columna de dirección '{COLUMNA_DIRECCION_ORIGINAL}' DESPUÉS de limpiar nombres.")
-            st.info(f"Columnas disponibles: {list(data.columns)}")
-            return None
-
-        # Verificar y procesar columna Tipo (usando nombre limpio)
-        if COLUMNA_TIPO_ORIGINAL in data.columns:
-            data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].astype(str)
-            print(f"Procesando columna de tipo: '{COLUMNA_TIPO_ORIGINAL}'...")
-            data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].fillna("DESCONOCIDO")
-            data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].str.strip().str.upper()
-            data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].replace(r'^\s*$', 'DESCONOCIDO', regex=True)
+        snapshot_calles = obtener_snapshot_calles()
+        if snapshot_calles.actual is None:
+            st.warning("Sin lista de calles disponible todavía.")
         else:
-            st.warning(f"Advertencia: No se encontró la columna de tipo '{COLUMNA_TIPO_ORIGINAL}' DESPUÉS de limpiar nombres. Se creará con valor 'DESCONOCIDO'.")
-            st.info(f"Columnas disponibles: {list(data.columns)}")
-            data[COLUMNA_TIPO_ORIGINAL] = "DESCONOCIDO"
-
-        print("--- Columnas Finales en DataFrame ---")
-        print(data.columns)
-        print(f"<<< CSV Cargado y Procesado: {len(data)} filas.")
-        return data
-
-    except Exception as e:
-        st.error(f"Error general al cargar o procesar el CSV: {e}")
-        st.error(traceback.format_exc())
-        return None
+            st.write(f"Versión **{snapshot_calles.version}**: {len(snapshot_calles.actual['calles'])} calles.")
+            st.caption(f"Actualizada: {pd.Timestamp(snapshot_calles.actual['creado'], unit='s').strftime('%Y-%m-%d %H:%M')}")
+        if snapshot_calles.ultimo_error:
+            st.caption(f"Último refresco falló: {snapshot_calles.ultimo_error}")
+        for cambio in snapshot_calles.ultimas_diferencias():
+            st.caption(f"Último cambio ({cambio['fecha']}): +{len(cambio['agregadas'])} / -{len(cambio['eliminadas'])} calles")
+            if cambio["agregadas"]: st.write("Agregadas: " + ", ".join(cambio["agregadas"][:20]))
+            if cambio["eliminadas"]: st.write("Eliminadas: " + ", ".join(cambio["eliminadas"][:20]))
+    st.caption(f"Comuna predeterminada: {COMUNAS[COMUNA_PREDETERMINADA].nombre}. "
+               f"Índices de comunas en memoria: {obtener_snapshot_comuna.cache_info().currsize}/{MAX_COMUNAS_EN_MEMORIA}.")
+
+with st.sidebar.expander("Arranque del servidor"):
+    if arranque["primer_render"] is not None:
+        st.caption(f"Primera página dibujada a los {arranque['primer_render']:.2f} s del inicio del proceso.")
+    if arranque["fases"]:
+        st.dataframe(pd.DataFrame(arranque["fases"]).T[["segundos", "filas"]])
+    elif not arranque["terminado"]:
+        st.caption("Precalentando índices y cachés...")
+    if arranque["error"]:
+        st.caption(f"Precalentamiento incompleto: {arranque['error']}")
+
+# Resultado generado por procesar_csv.py (opcional): si existe, la app solo lo lee
+RUTA_RESULTADO_PRECALCULADO = os.environ.get("RUTA_RESULTADO_PRECALCULADO")
+INTERVALO_SEGUIMIENTO = 2 # Segundos entre actualizaciones del avance de un trabajo en segundo plano
 
 # --- Inicialización del Estado de Sesión ---
 if "data" not in st.session_state: st.session_state.data = None
-if "mapa_csv" not in st.session_state: st.session_state.mapa_csv = None
+if "mapa_csv" not in st.session_state: st.session_state.mapa_csv = None # HTML ya renderizado del mapa CSV
 if "mapa_manual" not in st.session_state: st.session_state.mapa_manual = None
 if "mostrar_mapa" not in st.session_state: st.session_state.mostrar_mapa = None
+if "reporte_ejecucion" not in st.session_state: st.session_state.reporte_ejecucion = None
+if "agregados_densidad" not in st.session_state: st.session_state.agregados_densidad = None # Se calculan al pedir la vista de densidad
+if "huella_densidad" not in st.session_state: st.session_state.huella_densidad = None # Datos a los que corresponden los agregados
+if "trabajo" not in st.session_state: st.session_state.trabajo = None # Trabajo en segundo plano que sigue esta sesión
+if "mapa_parcial" not in st.session_state: st.session_state.mapa_parcial = None # (versión, html, puntos) del resultado parcial
+if "reportes_csv" not in st.session_state: st.session_state.reportes_csv = None # Último resultado del CSV (para reportes cercanos)
+if "colores_csv" not in st.session_state: st.session_state.colores_csv = None # Mapa de colores del último resultado del CSV
 
 # --- Widgets de Entrada ---
 direccion_input = st.text_input("Ingresa una dirección (ej: Tres Ote. 5317):", key="direccion_manual_key")
 usar_csv_button = st.button("Usar csv predeterminado")
 print("--- Widgets Definidos ---")
 
+# --- Resultado del CSV (trabajo en segundo plano o resultado precalculado) ---
+ETIQUETAS_ETAPA = {
+    "inicio": "Iniciando", "carga_csv": "Cargando CSV", "correccion": "Corrigiendo direcciones",
+    "geocodificacion": "Geocodificando", "guardado": "Guardando ingesta",
+    "sincronizacion_hoja": "Escribiendo en la hoja", "mapa": "Generando mapa",
+}
+
+def mostrar_resultado_csv(resultado):
+    """Muestra el resumen de un resultado procesado y lo deja en la sesión para dibujar el mapa."""
+    st.session_state.reporte_ejecucion = resultado["reporte"]
+    data = resultado["data"]
+    if data is None:
+        st.error("No se cargaron datos válidos del CSV.")
+        return
+    st.caption(f"Filas nuevas o editadas desde la última carga: {resultado['filas_pendientes']}.")
+    st.markdown("### Datos cargados y corregidos (CSV):")
+    display_cols = [c for c in [COLUMNA_DIRECCION_NUEVA, "direccion_corregida", COLUMNA_TIPO_ORIGINAL] if c in data.columns]
+    if display_cols and not data.empty:
+        st.dataframe(data[display_cols].head(20))
+        if len(data) > 20: st.caption(f"... y {len(data) - 20} más.")
+    if resultado["intentos"] > 0:
+        st.success(f"Se encontraron coordenadas para {len(data)} de {resultado['intentos']} direcciones corregidas válidas.")
+        # Contadores de esta ejecución (los de CacheGeocodificacion suman todas las sesiones del proceso)
+        cache_ejecucion = (resultado["reporte"] or {}).get("caches", {}).get("geocodificacion")
+        if cache_ejecucion:
+            st.caption(f"Caché de geocodificación en esta carga: {cache_ejecucion.get('aciertos', 0)} aciertos, "
+                       f"{cache_ejecucion.get('fallos', 0)} consultas nuevas, {cache_ejecucion.get('errores_remotos', 0)} errores del servicio.")
+        if "fuente_geocodificacion" in data.columns:
+            st.caption(f"Coordenadas por fuente: {data['fuente_geocodificacion'].value_counts().to_dict()}")
+    else:
+        st.warning("No quedaron direcciones corregidas válidas para geocodificar.")
+    # Un resultado distinto (p. ej. un trabajo nuevo) invalida la densidad calculada para el anterior
+    huella_densidad = huella_contenido(data, ["lat", "lon", COLUMNA_TIPO_ORIGINAL])
+    if huella_densidad != st.session_state.huella_densidad:
+        st.session_state.agregados_densidad = None
+        st.session_state.huella_densidad = huella_densidad
+    st.session_state.data = data
+    st.session_state.reportes_csv = data # Se conserva aunque luego se consulte una dirección manual
+    st.session_state.colores_csv = resultado["color_map"]
+    if resultado["mapa_html"] is not None:
+        st.session_state.mapa_csv = resultado["mapa_html"]
+        st.session_state.mostrar_mapa = 'csv'
+        print("--- Mapa CSV Generado y Guardado en Sesión ---")
+    else:
+        st.warning("No se pudo generar el mapa (sin coordenadas válidas después del filtrado).")
+
+def recoger_trabajo(trabajo):
+    """Pasa a la sesión el resultado de un trabajo terminado (con sus avisos)."""
+    st.session_state.trabajo = None
+    st.session_state.mapa_parcial = None
+    for nivel, mensaje in trabajo.mensajes:
+        getattr(st, nivel)(mensaje)
+    if trabajo.estado == ESTADO_ERROR:
+        st.error(f"Error inesperado durante el procesamiento del CSV: {trabajo.error}")
+        return
+    st.info(f"CSV procesado en {trabajo.fin - trabajo.inicio:.1f} s.")
+    mostrar_resultado_csv(trabajo.resultado)
+
+@st.fragment(run_every=INTERVALO_SEGUIMIENTO)
+def seguimiento_trabajo():
+    """Avance del trabajo y mapa con los puntos ya geocodificados; se refresca solo, sin rerun de la página."""
+    trabajo = st.session_state.trabajo
+    if trabajo is None:
+        return
+    if not trabajo.activo:
+        st.rerun() # La página completa recoge el resultado final
+    texto = (f"{ETIQUETAS_ETAPA.get(trabajo.etapa, trabajo.etapa)}: {trabajo.filas_corregidas}/{trabajo.filas_por_corregir} filas corregidas, "
+             f"{trabajo.filas_geocodificadas}/{trabajo.filas_por_geocodificar} geocodificadas")
+    eta = trabajo.eta()
+    if eta is not None:
+        texto += f" · tiempo restante estimado: {eta:.0f} s"
+    st.progress(trabajo.fraccion(), text=texto)
+    parcial = trabajo.parcial
+    if parcial is None or parcial.empty:
+        return
+    # El mapa parcial se vuelve a dibujar solo cuando el trabajo publica un resultado nuevo
+    version = (trabajo.clave, trabajo.version_parcial)
+    if st.session_state.mapa_parcial is None or st.session_state.mapa_parcial[0] != version:
+        mapa_obj, puntos = construir_mapa_csv(parcial, trabajo.color_map)
+        st.session_state.mapa_parcial = (version, mapa_obj.get_root().render(), puntos)
+    _version, html_parcial, puntos = st.session_state.mapa_parcial
+    st.caption(f"Mapa parcial: {puntos} puntos de {trabajo.filas_total} filas.")
+    st.iframe(html_parcial, height=600)
+
 # --- Lógica Principal ---
 if usar_csv_button:
     print("--- Botón CSV Presionado ---")
@@ -221,201 +178,46 @@ if usar_csv_button:
     st.session_state.mostrar_mapa = None
     st.session_state.data = None
     st.session_state.mapa_csv = None
-    st.info("Procesando CSV predeterminado...")
-
-    print("--- Cargando Calles (CSV)... ---")
-    calles_df = obtener_calles_conchali()
-    if calles_df is None or calles_df.empty:
-        st.error("Fallo al cargar calles oficiales. No se puede continuar.")
-        st.stop()
-
-    try:
-        data_cargada = cargar_csv_predeterminado()
-
-        if data_cargada is not None and not data_cargada.empty:
-            st.session_state.data = data_cargada
-
-            # --- Generación Dinámica de Mapa de Colores ---
-            print("--- Generando Mapa de Colores Dinámico... ---")
-            dynamic_color_map = {}
-            if COLUMNA_TIPO_ORIGINAL in st.session_state.data.columns:
-                unique_types = sorted(list(st.session_state.data[COLUMNA_TIPO_ORIGINAL].unique()))
-                print(f"Tipos únicos encontrados para mapa de colores: {unique_types}")
-                palette_len = len(BASE_COLOR_PALETTE)
-                color_index = 0
-                if "DESCONOCIDO" in unique_types:
-                    dynamic_color_map["DESCONOCIDO"] = COLOR_DESCONOCIDO
-                for utype in unique_types:
-                    if utype not in dynamic_color_map:
-                        dynamic_color_map[utype] = BASE_COLOR_PALETTE[color_index % palette_len]
-                        color_index += 1
-                print("--- Mapa de Colores Generado ---")
-                print(dynamic_color_map)
-            else:
-                st.warning(f"Columna '{COLUMNA_TIPO_ORIGINAL}' no encontrada para generar mapa de colores.")
-                dynamic_color_map["DESCONOCIDO"] = COLOR_DESCONOCIDO
-
-            # --- Corregir direcciones (LÓGICA SIMPLIFICADA) ---
-            print("--- Corrigiendo Direcciones (CSV)... ---")
-            if COLUMNA_DIRECCION_NUEVA in st.session_state.data.columns:
-                print(f"Aplicando corrección a la columna '{COLUMNA_DIRECCION_NUEVA}'...")
-                # Aplicar directamente a la columna usando el safe_corregir actualizado
-                st.session_state.data["direccion_corregida"] = st.session_state.data[COLUMNA_DIRECCION_NUEVA].apply(
-                    safe_corregir,
-                    args=(calles_df,) # Pasar calles_df como argumento extra
-                )
-                # --- DEBUG ---
-                print("--- Primeras 10 filas de 'direccion_corregida' ---")
-                print(st.session_state.data[[COLUMNA_DIRECCION_NUEVA, "direccion_corregida"]].head(10))
-                # Contar cuántas no son NaN y diferentes de la original (estimación)
-                valid_original = st.session_state.data[COLUMNA_DIRECCION_NUEVA].notna() & (st.session_state.data[COLUMNA_DIRECCION_NUEVA].astype(str).str.strip() != '')
-                valid_corrected = st.session_state.data["direccion_corregida"].notna() & (st.session_state.data["direccion_corregida"].astype(str).str.strip() != '')
-                corrections_made = (valid_original & valid_corrected & (st.session_state.data[COLUMNA_DIRECCION_NUEVA] != st.session_state.data["direccion_corregida"])).sum()
-                print(f"Filas con dirección corregida válida (no NaN/vacía): {valid_corrected.sum()}")
-                print(f"Número estimado de correcciones realizadas (diferentes al original): {corrections_made}")
-                # --- END DEBUG ---
-            else:
-                 st.error(f"Falta la columna '{COLUMNA_DIRECCION_NUEVA}' para la corrección.")
-                 st.stop()
-            # --- FIN CORRECCIÓN SIMPLIFICADA ---
-
-            # --- Mostrar tabla ---
-            st.markdown("### Datos cargados y corregidos (CSV):")
-            display_cols = []
-            if COLUMNA_DIRECCION_NUEVA in st.session_state.data.columns: display_cols.append(COLUMNA_DIRECCION_NUEVA)
-            if "direccion_corregida" in st.session_state.data.columns: display_cols.append("direccion_corregida")
-            if COLUMNA_TIPO_ORIGINAL in st.session_state.data.columns: display_cols.append(COLUMNA_TIPO_ORIGINAL)
+    st.session_state.agregados_densidad = None
 
-            if display_cols and not st.session_state.data.empty:
-                 df_display = st.session_state.data
-                 st.dataframe(df_display[display_cols].head(20))
-                 if len(df_display) > 20: st.caption(f"... y {len(df_display) - 20} más.")
-            else:
-                 st.warning("No hay datos o columnas relevantes para mostrar en la tabla.")
-
-            # --- Obtener coordenadas ---
-            print("--- Obteniendo Coordenadas (CSV)... ---")
-            # Aplicar sobre la columna 'direccion_corregida' que ya existe
-            if "direccion_corregida" in st.session_state.data.columns:
-                 # Filtrar NaNs/None/vacíos en direccion_corregida ANTES de geocodificar
-                 # Usar pd.NA para comparación segura con posibles None/NaN
-                 mask_valid_corrected = st.session_state.data["direccion_corregida"].notna() & (st.session_state.data["direccion_corregida"].astype(str).str.strip() != '')
-                 data_to_geocode = st.session_state.data[mask_valid_corrected]
-
-                 if not data_to_geocode.empty:
-                     with st.spinner(f"Obteniendo coordenadas para {len(data_to_geocode)} direcciones..."):
-                         def safe_coords(x):
-                             try: return obtener_coords(x)
-                             except Exception as e_coords:
-                                 print(f"Error en geocoding para '{x}': {e_coords}")
-                                 return None
-                         # Aplicar al subset
-                         coords_series = data_to_geocode["direccion_corregida"].apply(safe_coords)
-                         # Asignar de vuelta al DataFrame principal usando el índice
-                         st.session_state.data["coords"] = coords_series
-
-                     # Filtrar el DataFrame principal para mantener solo filas con coordenadas válidas
-                     original_rows = len(data_to_geocode) # Número de intentos
-                     st.session_state.data = st.session_state.data.dropna(subset=["coords"])
-                     found_rows = len(st.session_state.data)
-
-                     if original_rows > 0:
-                         st.success(f"Se encontraron coordenadas para {found_rows} de {original_rows} direcciones corregidas válidas.")
-                     else:
-                         st.info("No había direcciones corregidas válidas para intentar geocodificar.")
-                     print(f"Coordenadas encontradas: {found_rows}/{original_rows}")
-
-                 else:
-                      st.warning("No quedaron direcciones corregidas válidas para geocodificar.")
-                      st.session_state.data["coords"] = None # Asegurar columna existe vacía
-            else:
-                 st.warning("No se pudo proceder a la geocodificación (falta 'direccion_corregida').")
-                 st.session_state.data["coords"] = None # Asegurar columna existe vacía
-
-
-            # --- Crear el mapa ---
-            if "coords" in st.session_state.data.columns and not st.session_state.data.empty:
-                print("--- Creando Mapa Folium (CSV)... ---")
-                # st.session_state.data ahora solo tiene filas con coordenadas
-                coords_list = st.session_state.data['coords'].tolist()
-                map_center = [-33.38, -70.65]
-                # No es necesario re-chequear coords_list, ya filtramos
-                valid_coords = [c for c in coords_list if isinstance(c, tuple) and len(c) == 2]
-                if valid_coords:
-                    avg_lat = sum(c[0] for c in valid_coords) / len(valid_coords)
-                    avg_lon = sum(c[1] for c in valid_coords) / len(valid_coords)
-                    map_center = [avg_lat, avg_lon]
-
-                mapa_obj = folium.Map(location=map_center, zoom_start=13)
-                coords_agregadas = 0
-                tipos_en_mapa = set()
-
-                print("--- Añadiendo Marcadores al Mapa ---")
-                for i, row in st.session_state.data.iterrows():
-                    try:
-                        tipo = str(row.get(COLUMNA_TIPO_ORIGINAL, "DESCONOCIDO")).strip().upper()
-                        if tipo == '': tipo = "DESCONOCIDO"
-
-                        marker_color = dynamic_color_map.get(tipo, DEFAULT_ASSIGN_COLOR)
-                        tipos_en_mapa.add(tipo)
-
-                        # Debug
-                        # if i < 5 or i % 50 == 0:
-                        #      print(f"Row Index {i}: Tipo='{tipo}', Color='{marker_color}' (In Map? {tipo in dynamic_color_map})")
-
-                        popup_text = f"<b>Tipo:</b> {tipo.capitalize()}<br>"
-                        if "direccion_corregida" in row and pd.notna(row['direccion_corregida']):
-                             popup_text += f"<b>Corregida:</b> {row['direccion_corregida']}<br>"
-                        if COLUMNA_DIRECCION_NUEVA in row and pd.notna(row[COLUMNA_DIRECCION_NUEVA]):
-                             popup_text += f"<b>Original:</b> {row[COLUMNA_DIRECCION_NUEVA]}"
-
-                        tooltip_text = row.get('direccion_corregida', 'Ubicación') + f" ({tipo.capitalize()})"
-
-                        folium.Marker(
-                            location=row["coords"], # Sabemos que no es NaN
-                            popup=folium.Popup(popup_text, max_width=300),
-                            tooltip=tooltip_text,
-                            icon=folium.Icon(color=marker_color, icon='info-sign')
-                        ).add_to(mapa_obj)
-                        coords_agregadas += 1
-                    except Exception as marker_err:
-                        st.warning(f"No se pudo añadir marcador para fila con índice {i}: {marker_err}")
-
-
-                if coords_agregadas > 0:
-                    # Leyenda
-                    legend_html = """
-                        <div style="position: fixed; bottom: 50px; left: 10px; width: 180px; height: auto; max-height: 250px; border:2px solid grey; z-index:9999; font-size:12px; background-color:rgba(255, 255, 255, 0.9); overflow-y: auto; padding: 10px; border-radius: 5px;">
-                        <b style="font-size: 14px;">Leyenda de Tipos</b><br> """
-                    tipos_relevantes_leyenda = sorted([t for t in dynamic_color_map.keys() if t in tipos_en_mapa])
-                    print(f"--- Tipos para la leyenda: {tipos_relevantes_leyenda} ---")
-                    for tipo_leg in tipos_relevantes_leyenda:
-                         color_leg = dynamic_color_map.get(tipo_leg, DEFAULT_ASSIGN_COLOR)
-                         legend_html += f'<i style="background:{color_leg}; border-radius:50%; width: 12px; height: 12px; display: inline-block; margin-right: 6px; border: 1px solid #CCC;"></i>{tipo_leg.capitalize()}<br>'
-                    legend_html += "</div>"
-                    mapa_obj.get_root().html.add_child(folium.Element(legend_html))
-
-                    st.session_state.mapa_csv = mapa_obj
-                    st.session_state.mostrar_mapa = 'csv'
-                    print("--- Mapa CSV Generado y Guardado en Sesión ---")
-                else:
-                    st.warning("No se agregaron puntos al mapa del CSV (post-filtrado de coordenadas).")
-                    st.session_state.mapa_csv = None
-                    if st.session_state.mostrar_mapa == 'csv': st.session_state.mostrar_mapa = None
-            else:
-                 st.warning("No se pudo generar el mapa (sin coordenadas válidas después del filtrado).")
-                 st.session_state.mapa_csv = None
-
-        else:
-            st.error("No se cargaron datos válidos del CSV.")
+    if bool(RUTA_RESULTADO_PRECALCULADO) and os.path.exists(RUTA_RESULTADO_PRECALCULADO):
+        # --- Resultado ya procesado por procesar_csv.py: solo se lee ---
+        print(f"--- Leyendo resultado precalculado: {RUTA_RESULTADO_PRECALCULADO} ---")
+        registro = RegistroEjecucion("app_csv")
+        try:
+            with registro.etapa("carga_csv") as etapa_carga:
+                data_cargada = cargar_resultado_precalculado(RUTA_RESULTADO_PRECALCULADO)
+                etapa_carga["filas"] = len(data_cargada)
+            st.caption(f"Resultado precalculado: {RUTA_RESULTADO_PRECALCULADO}")
+            compacto = compartir_resultado(compactar_resultado(data_cargada))
+            colores = generar_mapa_colores(data_cargada)
+            mapa_html = None
+            if not compacto.empty:
+                with registro.etapa("mapa", filas=len(compacto)):
+                    mapa_html, _puntos = mapa_csv_html(compacto, colores, registro=registro)
+            mostrar_resultado_csv({
+                "data": compacto, "color_map": colores, "mapa_html": mapa_html, "filas_pendientes": 0, "reporte": registro.reporte(),
+                "intentos": int(data_cargada["direccion_corregida"].notna().sum()),
+            })
+        except Exception as e:
+            st.error(f"Error inesperado durante el procesamiento del CSV: {str(e)}")
+            st.error(traceback.format_exc())
             st.session_state.data = None
             st.session_state.mapa_csv = None
-
-    except Exception as e:
-        st.error(f"Error inesperado durante el procesamiento del CSV: {str(e)}")
-        st.error(traceback.format_exc())
-        st.session_state.data = None
-        st.session_state.mapa_csv = None
+    else:
+        print("--- Cargando Calles (CSV)... ---")
+        calles_df = obtener_calles_conchali()
+        if calles_df is None or calles_df.empty:
+            st.error("Fallo al cargar calles oficiales. No se puede continuar.")
+            st.stop()
+        # El procesamiento corre en segundo plano: sobrevive a reruns y se comparte con otras sesiones
+        try:
+            st.session_state.trabajo = iniciar_procesamiento_hoja(URL_CSV_PREDETERMINADO)
+            st.session_state.mapa_parcial = None
+            print(f"--- Trabajo CSV {st.session_state.trabajo.estado}: {st.session_state.trabajo.clave[1]} ---")
+        except Exception as e:
+            st.error(f"Error inesperado al iniciar el procesamiento del CSV: {str(e)}")
+            st.error(traceback.format_exc())
     print("--- Fin Procesamiento Botón CSV ---")
 
 # --- Lógica Dirección Manual ---
@@ -431,19 +233,49 @@ elif direccion_input:
     calles_df = obtener_calles_conchali()
     if calles_df is None or calles_df.empty:
         st.error("Fallo al cargar calles oficiales. La corrección puede no funcionar.")
-
-    direccion_corregida = corregir_direccion(direccion_input, calles_df)
-    print(f"Dirección manual corregida a: {direccion_corregida}")
+    indice_calles = obtener_indice_calles()
+
+    # Si la dirección nombra otra comuna, se corrige y geocodifica con los datos de esa comuna
+    comuna_manual, direccion_sin_comuna = detectar_comuna(direccion_input, COMUNA_PREDETERMINADA)
+    if comuna_manual != COMUNA_PREDETERMINADA:
+        indice_calles = obtener_indice_comuna(comuna_manual)
+    direccion_corregida = corregir_direccion(direccion_sin_comuna, indice_calles)
+    print(f"Dirección manual corregida a: {direccion_corregida} ({comuna_manual})")
     with st.spinner("Obteniendo coordenadas..."):
-        coords = obtener_coords(direccion_corregida)
+        coords = obtener_coords(direccion_corregida, comuna_manual)
     st.markdown("---")
     st.markdown("### ✅ Resultado Dirección Manual:")
     st.write(f"**Dirección original:** {direccion_input}")
     st.write(f"**Dirección corregida:** {direccion_corregida}")
+    st.write(f"**Comuna:** {COMUNAS[comuna_manual].nombre}")
     if coords:
         st.write(f"**Ubicación aproximada:** {coords[0]:.5f}, {coords[1]:.5f}")
+        # Reportes del último CSV cargados cerca de la dirección (consulta al índice espacial)
+        cercanos = None
+        if st.session_state.reportes_csv is not None and not st.session_state.reportes_csv.empty:
+            radio_cercanos = st.select_slider("Reportes cercanos en un radio de", options=RADIOS_CERCANOS_M, value=RADIO_CERCANOS_M,
+                                              format_func=lambda m: f"{m} m", key="radio_cercanos")
+            cercanos = reportes_cercanos(st.session_state.reportes_csv, coords[0], coords[1], radio_cercanos)
+            st.write(f"**Reportes a menos de {radio_cercanos} m:** {len(cercanos)}")
+            if not cercanos.empty:
+                columnas_cercanos = [c for c in [COLUMNA_DIRECCION_NUEVA, "direccion_corregida", COLUMNA_TIPO_ORIGINAL, "distancia_m"] if c in cercanos.columns]
+                st.dataframe(cercanos[columnas_cercanos].head(50), hide_index=True)
+        else:
+            st.caption("Carga el CSV para ver los reportes cercanos a esta dirección.")
         try:
+            import folium
             mapa_manual_obj = folium.Map(location=coords, zoom_start=16)
+            if cercanos is not None:
+                folium.Circle(location=coords, radius=radio_cercanos, color="#3186cc", weight=1, fill=True, fill_opacity=0.05).add_to(mapa_manual_obj)
+                colores = st.session_state.colores_csv or {}
+                en_mapa = cercanos.head(MAX_CERCANOS_EN_MAPA) # Los más cercanos
+                for tipo, lat, lon, distancia in zip(tipos_reporte(en_mapa), en_mapa["lat"], en_mapa["lon"], en_mapa["distancia_m"]):
+                    color = colores.get(tipo, DEFAULT_ASSIGN_COLOR)
+                    folium.CircleMarker(
+                        location=[float(lat), float(lon)], radius=6, color="#333", weight=1,
+                        fill=True, fill_color=COLORES_CSS_MARCADOR.get(color, color), fill_opacity=0.9,
+                        tooltip=f"{tipo.capitalize()} · {distancia:.0f} m",
+                    ).add_to(mapa_manual_obj)
             folium.Marker(
                 location=coords,
                 popup=folium.Popup(f"Corregida: {direccion_corregida}<br>Original: {direccion_input}", max_width=300),
@@ -463,6 +295,17 @@ elif direccion_input:
     print("--- Fin Procesamiento Manual ---")
 
 
+# --- Seguimiento del trabajo en segundo plano ---
+if st.session_state.trabajo is None and st.session_state.mostrar_mapa is None and not direccion_input:
+    # Una sesión nueva (p. ej. tras recargar la página) se une al trabajo que siga en curso
+    st.session_state.trabajo = obtener_gestor_trabajos().activo((URL_CSV_PREDETERMINADO,))
+if st.session_state.trabajo is not None:
+    if st.session_state.trabajo.activo:
+        st.markdown("### ⏳ Procesando CSV en segundo plano")
+        seguimiento_trabajo()
+    else:
+        recoger_trabajo(st.session_state.trabajo)
+
 # --- Mostrar el mapa correspondiente ---
 st.markdown("---")
 map_to_show = st.session_state.get("mostrar_mapa")
@@ -473,14 +316,63 @@ print(f"--- Decidiendo qué Mapa Mostrar: {map_to_show} ---")
 
 if map_to_show == 'csv' and csv_map_obj:
     st.markdown("### 🗺️ Mapa CSV")
-    st_folium(csv_map_obj, key="folium_map_csv_v6", width='100%', height=600, returned_objects=[]) # Nueva key
+    vista = st.radio("Vista", ["Puntos", "Mapa de calor", "Cuadrícula de densidad"], horizontal=True, key="vista_mapa_csv")
+    if vista == "Puntos":
+        col_agrupar, col_distancia = st.columns(2)
+        if col_agrupar.checkbox("Agrupar reportes duplicados (mismo tipo y cercanos)", key="agrupar_duplicados"):
+            distancia = col_distancia.select_slider("Distancia máxima entre duplicados", options=DISTANCIAS_DUPLICADOS_M,
+                                                    value=DISTANCIA_DUPLICADOS_M, format_func=lambda m: f"{m} m", key="distancia_duplicados")
+            with st.spinner("Agrupando reportes duplicados..."):
+                agrupados = agrupar_duplicados(st.session_state.data, distancia)
+                mapa_agrupado, _puntos = mapa_csv_html(agrupados, st.session_state.colores_csv or generar_mapa_colores(st.session_state.data))
+            st.caption(f"{len(st.session_state.data)} reportes en {len(agrupados)} puntos; "
+                       f"{int((agrupados['conteo'] > 1).sum())} puntos agrupan reportes duplicados.")
+            st.iframe(mapa_agrupado, height=600)
+        else:
+            # HTML pre-renderizado: los reruns no vuelven a serializar el mapa folium
+            st.iframe(csv_map_obj, height=600)
+    else:
+        # Los conteos por celda se calculan una vez por conjunto de datos; cambiar tipo o resolución solo filtra
+        if st.session_state.agregados_densidad is None:
+            with st.spinner("Calculando densidad de reportes..."):
+                st.session_state.agregados_densidad = obtener_agregados_densidad(st.session_state.data)
+        agregados = st.session_state.agregados_densidad
+        col_tipo, col_resolucion = st.columns(2)
+        tipo_densidad = col_tipo.selectbox("Tipo de problema", [TODOS_LOS_TIPOS] + agregados.tipos, key="tipo_densidad")
+        resolucion = col_resolucion.select_slider("Resolución", options=list(RESOLUCIONES_DENSIDAD), value=list(RESOLUCIONES_DENSIDAD)[1], key="resolucion_densidad")
+        celdas = agregados.celdas(resolucion, tipo_densidad)
+        st.caption(f"{int(celdas['conteo'].sum())} reportes en {len(celdas)} celdas (máximo {int(celdas['conteo'].max()) if not celdas.empty else 0} por celda).")
+        # HTML desde la caché de mapas: los reruns no vuelven a construir el mapa folium
+        st.iframe(mapa_densidad_html(celdas, RESOLUCIONES_DENSIDAD[resolucion], "calor" if vista == "Mapa de calor" else "cuadricula"), height=600)
 elif map_to_show == 'manual' and manual_map_obj:
     st.markdown("### 🗺️ Mapa Dirección Manual")
+    from streamlit_folium import st_folium
     st_folium(manual_map_obj, key="folium_map_manual_v6", width='100%', height=500, returned_objects=[]) # Nueva key
 else:
-    if not usar_csv_button and not direccion_input:
+    if st.session_state.trabajo is not None:
+        pass # El avance y el mapa parcial se muestran arriba
+    elif not usar_csv_button and not direccion_input:
         st.info("Ingresa una dirección o carga el CSV para ver el mapa aquí.")
     elif (usar_csv_button or direccion_input) and map_to_show is None:
          st.warning("No se pudo generar el mapa. Revisa los mensajes anteriores.")
 
+# --- Panel de diagnóstico (opcional) ---
+reporte = st.session_state.get("reporte_ejecucion")
+if reporte and st.sidebar.checkbox("Mostrar diagnóstico de la última carga"):
+    with st.expander("Diagnóstico de la ejecución", expanded=True):
+        st.write(f"Inicio: {reporte['inicio']} · Tiempo en etapas: {reporte['segundos_etapas']:.2f} s")
+        st.dataframe(pd.DataFrame(reporte["resumen_etapas"]).T)
+        if reporte["latencia_geocodificador"]:
+            st.write("Latencia del geocodificador remoto (ms):", reporte["latencia_geocodificador"])
+        if reporte.get("espera_geocodificador"):
+            st.write("Espera de turno por el límite de tasa y reintentos (ms):", reporte["espera_geocodificador"])
+        if reporte["caches"]:
+            st.write("Aciertos de caché:")
+            st.dataframe(pd.DataFrame(reporte["caches"]).T)
+        if reporte["puntajes_correccion"]:
+            st.write(f"Puntajes de corrección (sin match: {reporte['puntajes_correccion']['sin_match']}):")
+            st.bar_chart(pd.Series(reporte["puntajes_correccion"]["histograma"]))
+        st.json(reporte, expanded=False)
+
+registrar_primer_render()
 print("--- Script Finalizado ---")
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Motor de geocodificación concurrente con límite de tasa y reintentos.
+
+Reutiliza un único cliente Nominatim, ejecuta las consultas en un pool acotado de
+hilos y respeta la política de solicitudes por segundo del proveedor con un
+token bucket compartido. Los errores transitorios se reintentan con espera
+exponencial. Puede apuntarse a un servidor local (ver servidor_geocodificador_falso.py)
+con los parámetros dominio/esquema.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+
+from cache_geocodificacion import ESTADO_OK, ESTADO_NO_ENCONTRADO
+
+ESTADO_ERROR = "ERROR"
+
+# Errores que vale la pena reintentar
+ERRORES_TRANSITORIOS = (GeocoderUnavailable, GeocoderTimedOut, GeocoderRateLimited)
+
+# latencia: duración de la llamada al proveedor del último intento; espera: tiempo en la cola
+# del límite de tasa más las esperas entre reintentos (no es tiempo del proveedor)
+ResultadoGeocodificacion = namedtuple(
+    "ResultadoGeocodificacion", ["consulta", "coords", "estado", "intentos", "latencia", "espera", "error"]
+)
+
+
+class LimitadorTasa:
+    """Token bucket seguro entre hilos: como máximo `tasa` adquisiciones por segundo (ráfagas hasta `capacidad`)."""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+class MotorGeocodificacion:
+    """Geocodificador reutilizable con pool de hilos, límite de tasa y reintentos con backoff."""
+
+    def __init__(self, user_agent="mapa_conchali_app_v11", solicitudes_por_segundo=1.0, max_trabajadores=4,
+                 timeout=10, reintentos=3, espera_base=1.0, dominio="nominatim.openstreetmap.org", esquema=None,
+                 geolocator=None):
+        self.geolocator = geolocator or Nominatim(user_agent=user_agent, timeout=timeout, domain=dominio, scheme=esquema)
+        self.timeout = timeout
+        self.max_trabajadores = max(1, int(max_trabajadores))
+        self.reintentos = max(0, int(reintentos))
+        self.espera_base = espera_base
+        self.limitador = LimitadorTasa(solicitudes_por_segundo)
+
+    def geocodificar(self, consulta):
+        """Geocodifica una consulta de texto. Nunca lanza excepciones: el estado queda en el resultado."""
+        inicio = time.perf_counter()
+        error = None
+        latencia = 0.0
+        for intento in range(1, self.reintentos + 2):
+            self.limitador.adquirir()
+            t0 = time.perf_counter()
+            try:
+                location = self.geolocator.geocode(consulta, addressdetails=True, timeout=self.timeout)
+                latencia = time.perf_counter() - t0
+                espera = time.perf_counter() - inicio - latencia
+                if location:
+                    return ResultadoGeocodificacion(consulta, (location.latitude, location.longitude), ESTADO_OK, intento, latencia, espera, None)
+                return ResultadoGeocodificacion(consulta, None, ESTADO_NO_ENCONTRADO, intento, latencia, espera, None)
+            except ERRORES_TRANSITORIOS as e:
+                latencia = time.perf_counter() - t0
+                error = e
+                if intento > self.reintentos:
+                    break
+                espera = self.espera_base * (2 ** (intento - 1))
+                if isinstance(e, GeocoderRateLimited) and e.retry_after:
+                    espera = max(espera, e.retry_after)
+                time.sleep(espera * (1 + random.random() * 0.1)) # Pequeño jitter para no sincronizar hilos
+            except Exception as e:
+                latencia = time.perf_counter() - t0
+                error = e
+                break
+        return ResultadoGeocodificacion(consulta, None, ESTADO_ERROR, intento, latencia, time.perf_counter() - inicio - latencia, error)
+
+    def geocodificar_lote(self, consultas, progreso=None):
+        """Geocodifica consultas distintas en paralelo. Devuelve dict consulta -> ResultadoGeocodificacion.
+
+        progreso, si se entrega, se llama como progreso(completadas, total) tras cada consulta.
+        """
+        unicas = list(dict.fromkeys(consultas))
+        resultados = {}
+        if not unicas:
+            return resultados
+        with ThreadPoolExecutor(max_workers=min(self.max_trabajadores, len(unicas))) as pool:
+            futuros = {pool.submit(self.geocodificar, consulta): consulta for consulta in unicas}
+            for completadas, futuro in enumerate(as_completed(futuros), start=1):
+                resultados[futuros[futuro]] = futuro.result()
+                if progreso is not None:
+                    progreso(completadas, len(unicas))
+        return resultados
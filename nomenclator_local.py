@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Geocodificador local (sin red) basado en un nomenclátor de tramos de calle.
+
+El archivo CSV tiene una fila por tramo con las columnas:
+
+    calle, numero_desde, numero_hasta, lat_desde, lon_desde, lat_hasta, lon_hasta
+
+La posición de un número se interpola linealmente entre los extremos del tramo
+que lo contiene. Si la calle o el número no están cubiertos, se devuelve None y
+el llamador debe recurrir al geocodificador remoto.
+"""
+import bisect
+import os
+
+import pandas as pd
+
+COLUMNAS_NOMENCLATOR = ["calle", "numero_desde", "numero_hasta", "lat_desde", "lon_desde", "lat_hasta", "lon_hasta"]
+
+
+class NomenclatorLocal:
+    """Tramos de calle indexados por nombre normalizado, con interpolación por número."""
+
+    def __init__(self, tramos_df, normalizador):
+        self.normalizador = normalizador
+        self.tramos = {} # calle normalizada -> lista de (minimo, maximo, desde, hasta, lat_d, lon_d, lat_h, lon_h) ordenada
+        faltantes = [c for c in COLUMNAS_NOMENCLATOR if c not in tramos_df.columns]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el nomenclátor: {faltantes}")
+        for fila in tramos_df[COLUMNAS_NOMENCLATOR].dropna().itertuples(index=False):
+            desde, hasta = int(fila.numero_desde), int(fila.numero_hasta)
+            self.tramos.setdefault(normalizador(fila.calle), []).append(
+                (min(desde, hasta), max(desde, hasta), desde, hasta,
+                 float(fila.lat_desde), float(fila.lon_desde), float(fila.lat_hasta), float(fila.lon_hasta))
+            )
+        for lista in self.tramos.values():
+            lista.sort()
+        self._minimos = {calle: [t[0] for t in lista] for calle, lista in self.tramos.items()}
+
+    @classmethod
+    def desde_csv(cls, ruta, normalizador):
+        """Carga el nomenclátor desde un CSV. Devuelve None si el archivo no existe."""
+        if not ruta or not os.path.exists(ruta):
+            return None
+        return cls(pd.read_csv(ruta), normalizador)
+
+    def __len__(self):
+        return sum(len(lista) for lista in self.tramos.values())
+
+    def cubre_calle(self, calle):
+        return self.normalizador(calle) in self.tramos
+
+    def geocodificar(self, calle, numero):
+        """Devuelve (lat, lon) interpolado para calle + número, o None si no está cubierto."""
+        if numero is None or str(numero).strip() == "":
+            return None
+        try:
+            numero = int(str(numero).strip())
+        except ValueError:
+            return None
+        clave = self.normalizador(calle)
+        lista = self.tramos.get(clave)
+        if not lista:
+            return None
+        # Último tramo cuyo mínimo es <= número; retroceder mientras haya tramos solapados
+        pos = bisect.bisect_right(self._minimos[clave], numero) - 1
+        while pos >= 0:
+            minimo, maximo, desde, hasta, lat_d, lon_d, lat_h, lon_h = lista[pos]
+            if minimo <= numero <= maximo:
+                fraccion = 0.0 if hasta == desde else (numero - desde) / (hasta - desde)
+                return lat_d + (lat_h - lat_d) * fraccion, lon_d + (lon_h - lon_d) * fraccion
+            pos -= 1
+        return None
@@ -0,0 +1,1142 @@
+# -*- coding: utf-8 -*-
+"""Etapas del procesamiento de reportes, sin dependencia de Streamlit.
+
+carga del CSV -> corrección de direcciones -> geocodificación -> mapa folium.
+La app (mapas.py) y la línea de comandos (procesar_csv.py) usan estas funciones.
+Los mensajes para el usuario pasan por avisar(); por defecto se imprimen en consola
+y la app los redirige a st.error / st.warning / st.info con configurar_avisos().
+"""
+import io
+import os
+import re
+import threading
+import time
+import traceback
+from functools import lru_cache, wraps
+
+import numpy as np
+import pandas as pd
+import requests
+from unidecode import unidecode
+
+from cache_geocodificacion import CacheGeocodificacion, ESTADO_OK, ESTADO_NO_ENCONTRADO
+from cache_mapas import CacheMapas, huella_mapa
+from compartido import CacheCompartida, huella_contenido
+from comunas import COMUNAS, detectar_comuna
+from densidad import AgregadosDensidad
+from indice_calles import IndiceCalles
+from indice_espacial import IndiceEspacial, agrupar_cercanos
+from ingesta_incremental import AlmacenIngesta
+from instrumentacion import RegistroEjecucion
+from nomenclator_local import NomenclatorLocal
+from sincronizacion_hoja import COLUMNAS_SINCRONIZADAS, SincronizadorHoja
+from snapshot_calles import SnapshotCalles
+from trabajos import GestorTrabajos
+# folium/branca (mapas), bs4 (lista de calles) y geopy (motor de geocodificación) se importan
+# dentro de las funciones que los usan: cargar este módulo no los trae y la app arranca antes.
+
+# --- Constantes de Nombres de Columnas (Definidos SIN espacios extra) ---
+COLUMNA_DIRECCION_ORIGINAL = u'¿Dónde ocurre este problema? (Por favor indica la dirección lo más exacta posible, Calle, Numero y Comuna)'
+COLUMNA_TIPO_ORIGINAL = u'¿Qué tipo de problema estás reportando?' # SIN espacios extra
+COLUMNA_DIRECCION_NUEVA = 'Direccion'
+
+# Columnas calculadas por el procesamiento (corrección + geocodificación)
+# (version_calles: versión del índice de calles de la comuna con que se corrigió la fila; None si estaba vacío)
+COLUMNAS_PROCESADAS = ["direccion_corregida", "puntaje_match", "calle_oficial", "comuna", "version_calles", "coords", "fuente_geocodificacion"]
+COLUMNAS_CORRECCION = ["direccion_corregida", "puntaje_match", "calle_oficial", "comuna", "version_calles"]
+
+# Resultado compacto para mapas y vistas (ver compactar_resultado): solo filas con coordenadas
+COLUMNAS_CATEGORICAS_COMPACTAS = ["direccion_corregida", "comuna", "fuente_geocodificacion"]
+MAX_RESULTADOS_COMPARTIDOS = 4 # Versiones distintas del resultado compartidas entre sesiones
+
+# --- Comunas (ver comunas.py) ---
+COMUNA_PREDETERMINADA = os.environ.get("COMUNA_PREDETERMINADA", "conchali") # Si la dirección no nombra su comuna
+MAX_COMUNAS_EN_MEMORIA = int(os.environ.get("MAX_COMUNAS_EN_MEMORIA", "8")) # Índices de calles cargados a la vez
+URL_CALLES_COMUNA = "https://codigo-postal.co/chile/santiago/calles-de-{clave}/"
+
+# --- Fuente de datos ---
+URL_CSV_PREDETERMINADO = "https://docs.google.com/spreadsheets/d/e/2PACX-1vSAitwliDu4GoT-HU2zXh4eFUDnky9o3M-B9PHHp7RbLWktH7vuHu1BMT3P5zqfVIHAkTptZ8VaZ-F7/pub?gid=1694829461&single=true&output=csv"
+DIRECTORIO_INGESTA = os.environ.get("DIRECTORIO_INGESTA", "estado_ingesta") # Resultado procesado de la última ingesta
+DIRECTORIO_REPORTES = os.environ.get("DIRECTORIO_REPORTES", "reportes_ejecucion") # Reportes JSON de cada ejecución
+# Escritura de resultados de vuelta en la hoja (desactivada si no hay ID_HOJA_GOOGLE)
+ID_HOJA_GOOGLE = os.environ.get("ID_HOJA_GOOGLE") # Clave de la URL de edición de la hoja (no la del CSV publicado)
+GID_HOJA_GOOGLE = int(os.environ.get("GID_HOJA_GOOGLE", "1694829461")) # Pestaña de las respuestas
+CREDENCIALES_GOOGLE = os.environ.get("CREDENCIALES_GOOGLE") # JSON de una cuenta de servicio con permiso de edición
+RUTA_ESTADO_SINCRONIZACION = os.environ.get("RUTA_ESTADO_SINCRONIZACION", os.path.join(DIRECTORIO_INGESTA, "sincronizacion_hoja.json"))
+
+# Dirección = texto de la calle + número final (ej: "Tres Ote. 5317")
+PATRON_CALLE_NUMERO = r"(.*?)(\s*\d+)$"
+
+# --- Paleta de Colores Base ---
+BASE_COLOR_PALETTE = [
+    'blue', 'green', 'purple', 'orange', 'darkred', 'cadetblue',
+    'darkgreen', 'pink', 'red', 'lightblue', 'darkpurple', 'beige'
+]
+COLOR_DESCONOCIDO = 'lightgray'
+DEFAULT_ASSIGN_COLOR = 'black'
+
+# --- Renderizado de mapas grandes ---
+MAX_MARCADORES_INDIVIDUALES = int(os.environ.get("MAX_MARCADORES_INDIVIDUALES", "500")) # Por encima: capa agrupada
+# Colores de folium.Icon que no son colores CSS válidos (para los puntos de la capa agrupada)
+COLORES_CSS_MARCADOR = {
+    'darkred': '#a23336', 'cadetblue': '#436978', 'darkgreen': '#728224', 'lightblue': '#8adaff',
+    'darkpurple': '#5b396b', 'beige': '#ffcb92', 'lightgray': '#a3a3a3', 'pink': '#ff91ea',
+}
+# Cada punto llega como [lat, lon, color, popup, tooltip]
+CALLBACK_PUNTO_AGRUPADO = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 7, color: '#333', weight: 1, fillColor: row[2], fillOpacity: 0.9
+    });
+    marker.bindPopup(row[3], {maxWidth: 300});
+    marker.bindTooltip(row[4]);
+    return marker;
+};
+"""
+# HTML ya renderizado, por huella de puntos + colores + opciones (memoria y disco)
+DIRECTORIO_CACHE_MAPAS = os.environ.get("DIRECTORIO_CACHE_MAPAS", "cache_mapas")
+MAX_MAPAS_EN_CACHE = 20
+COLUMNAS_MAPA = [COLUMNA_DIRECCION_NUEVA, "direccion_corregida", COLUMNA_TIPO_ORIGINAL, "lat", "lon"]
+# Conteos por celda ya calculados, por versión (huella) de los puntos
+MAX_AGREGADOS_DENSIDAD = 4
+# --- Índice espacial de reportes (reportes cercanos a una dirección, duplicados cercanos) ---
+TAMANO_CELDA_INDICE_M = 100
+RADIOS_CERCANOS_M = [50, 100, 200, 500, 1000]
+RADIO_CERCANOS_M = 200
+MAX_CERCANOS_EN_MAPA = 300
+DISTANCIAS_DUPLICADOS_M = [10, 20, 30, 50, 100]
+DISTANCIA_DUPLICADOS_M = 30 # Reportes del mismo tipo a menos de esta distancia se consideran el mismo problema
+MAX_INDICES_ESPACIALES = 4
+# --- Trabajos de procesamiento en segundo plano ---
+MAX_TRABAJOS_TERMINADOS = 4 # Trabajos recientes cuyo resultado puede recoger una sesión nueva
+PUBLICACIONES_PARCIALES = 20 # Veces (aprox.) que se publica el resultado parcial durante la geocodificación
+MIN_FILAS_BLOQUE_TRABAJO = 200
+
+# --- Snapshot local de calles oficiales ---
+DIRECTORIO_SNAPSHOT_CALLES = os.environ.get("DIRECTORIO_SNAPSHOT_CALLES", "snapshot_calles")
+INTERVALO_REFRESCO_CALLES = 24 * 3600 # Refresco en segundo plano: una vez al día
+REINTENTO_CALLES_SIN_VERSION = 60 # Sin ninguna versión buena: reintento tras 1 min (la espera se duplica hasta 1 día)
+MAX_VERSIONES_CALLES = 5
+
+# --- Caché persistente de geocodificación ---
+RUTA_CACHE_GEOCODIFICACION = "cache_geocodificacion.sqlite"
+TTL_CACHE_GEOCODIFICACION = 30 * 24 * 3600 # Resultados encontrados: 30 días
+TTL_CACHE_NO_ENCONTRADO = 7 * 24 * 3600 # Direcciones no encontradas: 7 días
+MAX_ENTRADAS_CACHE_GEOCODIFICACION = 100000
+
+# --- Geocodificación local (nomenclátor de tramos con rangos de numeración) ---
+RUTA_NOMENCLATOR = os.environ.get("RUTA_NOMENCLATOR", "nomenclator_conchali.csv")
+FUENTE_LOCAL = "local"
+FUENTE_CACHE = "cache"
+FUENTE_NOMINATIM = "nominatim"
+
+# --- Motor de geocodificación (Nominatim: máximo 1 solicitud por segundo) ---
+GEOCODIFICADOR_DOMINIO = os.environ.get("GEOCODIFICADOR_DOMINIO", "nominatim.openstreetmap.org")
+GEOCODIFICADOR_ESQUEMA = os.environ.get("GEOCODIFICADOR_ESQUEMA") # 'http' para un servidor local de pruebas
+GEOCODIFICADOR_SOLICITUDES_POR_SEGUNDO = float(os.environ.get("GEOCODIFICADOR_SOLICITUDES_POR_SEGUNDO", "1"))
+GEOCODIFICADOR_TRABAJADORES = int(os.environ.get("GEOCODIFICADOR_TRABAJADORES", "4"))
+GEOCODIFICADOR_TIMEOUT = 10
+GEOCODIFICADOR_REINTENTOS = 3
+
+# --- Avisos al usuario ---
+_AVISOS = {}
+_AVISOS_HILO = threading.local() # Receptor propio de un hilo (p. ej. un trabajo en segundo plano), tiene prioridad
+
+def configurar_avisos(error=None, warning=None, info=None):
+    """Redirige los avisos de las etapas (p. ej. a st.error/st.warning/st.info)."""
+    _AVISOS.update({nivel: f for nivel, f in (("error", error), ("warning", warning), ("info", info)) if f is not None})
+
+def avisar(nivel, mensaje):
+    """Muestra un aviso de nivel 'error', 'warning' o 'info'."""
+    receptor = getattr(_AVISOS_HILO, "receptor", None)
+    if receptor is not None:
+        receptor(nivel, mensaje)
+        return
+    funcion = _AVISOS.get(nivel)
+    if funcion is None:
+        print(f"[{nivel.upper()}] {mensaje}")
+    else:
+        funcion(mensaje)
+
+# --- Recursos de proceso ---
+def recurso_de_proceso(funcion):
+    """Como lru_cache(maxsize=1) para una función sin argumentos, pero el recurso se crea una sola vez
+    aunque lo pidan a la vez varios hilos (p. ej. el precalentamiento del arranque y la primera sesión)."""
+    cacheada = lru_cache(maxsize=1)(funcion)
+    lock = threading.Lock()
+
+    @wraps(funcion)
+    def obtener():
+        if cacheada.cache_info().currsize:
+            return cacheada()
+        with lock:
+            return cacheada()
+    obtener.cache_info = cacheada.cache_info
+    obtener.cache_clear = cacheada.cache_clear
+    return obtener
+
+# --- Funciones ---
+def descargar_calles_comuna(comuna=COMUNA_PREDETERMINADA, aviso=None):
+    """Descarga la lista de calles oficiales de una comuna (clave de comunas.COMUNAS) desde una fuente web."""
+    aviso = aviso or avisar
+    print(f">>> Descargando calles oficiales de {COMUNAS[comuna].nombre}...")
+    url = URL_CALLES_COMUNA.format(clave=comuna)
+    try:
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(response.text, "html.parser")
+        ul_cities = soup.find("ul", class_="cities")
+        if not ul_cities:
+            aviso("error", "No se pudo encontrar la lista de calles en la URL.")
+            return pd.DataFrame(columns=["Calle", "normalizado"])
+        li_items = ul_cities.find_all("li")
+        calles = [li.find("a").text.strip() for li in li_items if li.find("a")]
+        if not calles:
+            aviso("error", "No se extrajeron calles de la lista encontrada.")
+            return pd.DataFrame(columns=["Calle", "normalizado"])
+        df_calles_comuna = pd.DataFrame(calles, columns=["Calle"])
+        df_calles_comuna["normalizado"] = df_calles_comuna["Calle"].apply(normalizar)
+        print(f"<<< Calles oficiales descargadas ({COMUNAS[comuna].nombre}): {len(df_calles_comuna)}")
+        return df_calles_comuna
+    except requests.exceptions.RequestException as e:
+        aviso("error", f"Error de red al obtener las calles: {e}")
+        return pd.DataFrame(columns=["Calle", "normalizado"])
+    except Exception as e:
+        aviso("error", f"Error inesperado al procesar las calles: {e}")
+        return pd.DataFrame(columns=["Calle", "normalizado"])
+
+def descargar_calles_conchali(aviso=None):
+    """Descarga la lista de calles oficiales de Conchalí desde una fuente web."""
+    return descargar_calles_comuna("conchali", aviso=aviso)
+
+def _aviso_en_consola(nivel, mensaje):
+    # Los hilos de fondo no pueden escribir en la página de Streamlit
+    print(f"[{nivel.upper()}] {mensaje}")
+
+@recurso_de_proceso
+def obtener_snapshot_calles():
+    """Abre (una vez por proceso) el snapshot local de calles y arranca su refresco en segundo plano.
+
+    Si todavía no existe ninguna versión, la primera descarga se hace de forma síncrona.
+    """
+    snapshot = SnapshotCalles(DIRECTORIO_SNAPSHOT_CALLES, max_versiones=MAX_VERSIONES_CALLES)
+    espera_inicial = 0 # Ya hay una versión buena: refrescar de inmediato, pero sin bloquear
+    if snapshot.actual is None:
+        snapshot.refrescar(lambda: descargar_calles_comuna(COMUNA_PREDETERMINADA))
+        # Si esa descarga falló, no esperar un día sin calles: reintentar pronto
+        espera_inicial = INTERVALO_REFRESCO_CALLES if snapshot.actual is not None else REINTENTO_CALLES_SIN_VERSION
+    snapshot.refrescar_en_segundo_plano(
+        lambda: descargar_calles_comuna(COMUNA_PREDETERMINADA, aviso=_aviso_en_consola), INTERVALO_REFRESCO_CALLES, espera_inicial,
+        reintento_sin_version=REINTENTO_CALLES_SIN_VERSION,
+    )
+    return snapshot
+
+class _SinCallesComuna(Exception):
+    """La primera descarga de calles de una comuna falló (lru_cache no guarda las excepciones)."""
+
+    def __init__(self, snapshot):
+        super().__init__(snapshot.ultimo_error)
+        self.snapshot = snapshot
+
+_FALLOS_COMUNA = {} # comuna -> (momento, snapshot vacío) de su última descarga fallida
+
+@lru_cache(maxsize=MAX_COMUNAS_EN_MEMORIA)
+def _cargar_snapshot_comuna(comuna):
+    snapshot = SnapshotCalles(os.path.join(DIRECTORIO_SNAPSHOT_CALLES, comuna), max_versiones=MAX_VERSIONES_CALLES)
+    if snapshot.actual is None:
+        snapshot.refrescar(lambda: descargar_calles_comuna(comuna))
+        if snapshot.actual is None:
+            raise _SinCallesComuna(snapshot)
+    elif time.time() - snapshot.actual["creado"] > INTERVALO_REFRESCO_CALLES:
+        threading.Thread(
+            target=snapshot.refrescar, args=(lambda: descargar_calles_comuna(comuna, aviso=_aviso_en_consola),),
+            name=f"refresco_calles_{comuna}", daemon=True,
+        ).start()
+    return snapshot
+
+def obtener_snapshot_comuna(comuna):
+    """Snapshot de calles de una comuna, cargado al primer uso (como máximo MAX_COMUNAS_EN_MEMORIA a la vez).
+
+    La comuna predeterminada usa el snapshot principal (con refresco periódico). Las demás
+    viven en un subdirectorio propio y, si su versión es antigua, se refrescan una vez en
+    segundo plano al cargarse, sin hilos permanentes que las retengan en memoria. Si la
+    primera descarga de una comuna falla, el snapshot vacío no queda en memoria: se vuelve
+    a intentar pasados REINTENTO_CALLES_SIN_VERSION segundos.
+    """
+    if comuna == COMUNA_PREDETERMINADA:
+        return obtener_snapshot_calles()
+    fallo = _FALLOS_COMUNA.get(comuna)
+    if fallo is not None and time.time() - fallo[0] < REINTENTO_CALLES_SIN_VERSION:
+        return fallo[1]
+    try:
+        snapshot = _cargar_snapshot_comuna(comuna)
+    except _SinCallesComuna as e:
+        _FALLOS_COMUNA[comuna] = (time.time(), e.snapshot)
+        return e.snapshot
+    _FALLOS_COMUNA.pop(comuna, None)
+    return snapshot
+
+obtener_snapshot_comuna.cache_info = _cargar_snapshot_comuna.cache_info
+
+def obtener_indice_comuna(comuna):
+    """Índice de calles de la comuna indicada (vacío si su lista no está disponible)."""
+    snapshot = obtener_snapshot_comuna(comuna if comuna in COMUNAS else COMUNA_PREDETERMINADA)
+    if snapshot.actual is None:
+        return IndiceCalles(None)
+    return snapshot.actual["indice"]
+
+def obtener_calles_conchali():
+    """Lista de calles oficiales (versión actual del snapshot local)."""
+    snapshot = obtener_snapshot_calles()
+    if snapshot.actual is None:
+        return pd.DataFrame(columns=["Calle", "normalizado"])
+    return snapshot.actual["calles"]
+
+def obtener_indice_calles():
+    """Índice de búsqueda ya construido de la versión actual de calles."""
+    snapshot = obtener_snapshot_calles()
+    if snapshot.actual is None:
+        return IndiceCalles(None)
+    return snapshot.actual["indice"]
+
+def normalizar(texto):
+    """Normaliza el texto: quita acentos, convierte a mayúsculas, elimina no alfanuméricos (excepto espacios) y espacios extra."""
+    try:
+        texto = unidecode(str(texto)).upper()
+        texto = re.sub(r'[^\w\s0-9]', '', texto)
+        texto = re.sub(r'\s+', ' ', texto).strip()
+        return texto
+    except Exception as e:
+        return str(texto).upper().strip()
+
+def separar_calle_numero(direccion):
+    """Separa 'Calle 1234' en ('Calle', '1234'). Si no termina en número devuelve (direccion, '')."""
+    match = re.match(PATRON_CALLE_NUMERO, direccion)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    return direccion, "" # Si no hay número, tomar todo como texto
+
+def corregir_direccion(direccion_input, calles_df, umbral=80):
+    """Intenta corregir el nombre de la calle usando fuzzy matching contra la lista oficial.
+
+    calles_df puede ser el DataFrame de calles o un IndiceCalles ya construido (recomendado).
+    """
+    # Asegurar que la entrada sea string y quitar espacios extra
+    original_completa = str(direccion_input).strip()
+    if not original_completa: # Si está vacío después de strip, devolver vacío
+        return ""
+
+    direccion_texto, numero_direccion = separar_calle_numero(original_completa)
+
+    # Si no hay texto de dirección (ej. solo era un número), devolver original
+    if not direccion_texto:
+        return original_completa
+
+    entrada_norm = normalizar(direccion_texto)
+    direccion_corregida_texto = direccion_texto # Empezar con el texto original
+
+    # Proceder solo si hay calles oficiales (índice pre-construido o DataFrame con 'normalizado')
+    indice = calles_df if isinstance(calles_df, IndiceCalles) else None
+    if indice is None and calles_df is not None and not calles_df.empty and "normalizado" in calles_df.columns:
+        indice = IndiceCalles(calles_df) # Más lento: idealmente pasar el índice ya construido
+    if indice is not None and not indice.empty:
+        try:
+            # Mismo resultado que process.extractOne(..., scorer=fuzz.token_sort_ratio), sin escanear todas las calles
+            mejor_match_result = indice.buscar(entrada_norm, umbral)
+            if mejor_match_result:
+                direccion_corregida_texto = mejor_match_result[0]
+        except Exception as e:
+            print(f"Error durante fuzzy matching para '{entrada_norm}': {e}")
+            # Mantener el texto original si falla el matching
+
+    # Recomponer la dirección final con el texto (corregido o no) y el número
+    direccion_final = direccion_corregida_texto + (" " + numero_direccion if numero_direccion else "")
+    return direccion_final.strip()
+
+# --- VERSIÓN ACTUALIZADA de safe_corregir ---
+def safe_corregir(x, df_calles):
+    """Wrapper seguro para corregir_direccion, maneja NaNs y errores."""
+    # Si la entrada no es un string, está vacía o es NaN/None, devolverla tal cual.
+    if pd.isna(x) or not isinstance(x, str) or not x.strip():
+        # print(f"Skipping correction for input: {x}") # Debug opcional
+        return x # Devuelve NaN, None, '', etc. sin intentar corregir
+
+    try:
+        # Proceder con la corrección solo si es un string válido
+        corrected = corregir_direccion(x, df_calles)
+        # Debug opcional para ver qué se corrigió
+        # if x.strip().upper() != corrected.strip().upper():
+        #      print(f"CORRECCIÓN: '{x}' -> '{corrected}'")
+        return corrected
+    except Exception as e_corr:
+        print(f"ERROR durante safe_corregir para '{x}': {e_corr}")
+        return x # Devolver original si falla la corrección
+# --- FIN safe_corregir ---
+
+def corregir_direcciones(direcciones, calles_df, umbral=80, registro=None):
+    """Corrige una columna completa de direcciones procesando cada calle distinta una sola vez.
+
+    Devuelve un DataFrame con el mismo índice y las columnas 'direccion_corregida',
+    'puntaje_match' y 'calle_oficial'. El resultado de 'direccion_corregida' es el mismo
+    que aplicar safe_corregir fila por fila. Si se entrega un RegistroEjecucion, se anotan
+    los aciertos de la memoización por calle y la distribución de puntajes.
+    """
+    indice = calles_df if isinstance(calles_df, IndiceCalles) else IndiceCalles(calles_df)
+    resultado = pd.DataFrame({
+        "direccion_corregida": direcciones,
+        "puntaje_match": float("nan"),
+        "calle_oficial": None,
+    }, index=direcciones.index)
+
+    # Solo strings no vacíos se corrigen; NaN, None, '' etc. se devuelven tal cual (igual que safe_corregir)
+    # (sin ningún string, .str fallaría sobre una columna object de solo NaN: se devuelve tal cual)
+    es_texto = direcciones.map(lambda x: isinstance(x, str)).astype(bool)
+    if not es_texto.any():
+        return resultado
+    completas = direcciones[es_texto].astype(str).str.strip()
+    validas = completas[completas != ""]
+    if validas.empty:
+        return resultado
+
+    # Separar calle y número de forma vectorizada (mismo patrón que corregir_direccion)
+    partes = validas.str.extract("^" + PATRON_CALLE_NUMERO).astype(object)
+    sin_numero = partes[0].isna()
+    texto_calle = partes[0].where(~sin_numero, validas).astype(str).str.strip()
+    numero = partes[1].fillna("").astype(str).str.strip()
+
+    # Normalizar y corregir cada texto de calle distinto una sola vez
+    oficial_por_texto, puntaje_por_texto = {}, {}
+    textos_distintos = texto_calle.unique()
+    for texto in textos_distintos:
+        if not texto or indice.empty:
+            continue
+        entrada_norm = normalizar(texto)
+        try:
+            mejor_match_result = indice.buscar(entrada_norm, umbral)
+        except Exception as e:
+            print(f"Error durante fuzzy matching para '{entrada_norm}': {e}")
+            mejor_match_result = None
+        if mejor_match_result:
+            oficial_por_texto[texto], puntaje_por_texto[texto] = mejor_match_result
+
+    calle_oficial = texto_calle.map(oficial_por_texto)
+    texto_corregido = calle_oficial.where(calle_oficial.notna(), texto_calle)
+    corregidas = (texto_corregido + numero.map(lambda n: " " + n if n else "")).str.strip()
+    # Si solo había número (sin texto de calle) se devuelve la dirección original
+    corregidas = corregidas.where(texto_calle != "", validas)
+
+    resultado.loc[validas.index, "direccion_corregida"] = corregidas
+    resultado.loc[validas.index, "puntaje_match"] = texto_calle.map(puntaje_por_texto).astype(float)
+    resultado.loc[validas.index, "calle_oficial"] = calle_oficial.astype(object).where(calle_oficial.notna(), None)
+    if registro is not None:
+        # Cada calle distinta se busca en el índice una vez; las filas repetidas son aciertos
+        registro.registrar_cache("calles", aciertos=len(validas) - len(textos_distintos), fallos=len(textos_distintos),
+                                 coincidencias=len(oficial_por_texto))
+        registro.registrar_puntajes(resultado.loc[validas.index, "puntaje_match"])
+    return resultado
+
+def corregir_direcciones_por_comuna(direcciones, comuna_predeterminada=COMUNA_PREDETERMINADA, umbral=80, registro=None):
+    """Como corregir_direcciones, pero detecta la comuna escrita en cada dirección y usa el índice de esa comuna.
+
+    Devuelve además las columnas 'comuna' (clave de comunas.COMUNAS) y 'version_calles'
+    (versión del índice usado; None si el de esa comuna estaba vacío). La comuna se quita del
+    texto antes de corregir; las direcciones sin comuna reconocible usan comuna_predeterminada.
+    """
+    es_texto = direcciones.map(lambda x: isinstance(x, str))
+    detectadas = {d: detectar_comuna(d, comuna_predeterminada) for d in direcciones[es_texto].unique()}
+    comuna = direcciones.map(lambda d: detectadas[d][0] if isinstance(d, str) else comuna_predeterminada)
+    sin_comuna = direcciones.map(lambda d: detectadas[d][1] if isinstance(d, str) else d)
+
+    partes = []
+    for clave, filas in comuna.groupby(comuna).groups.items():
+        indice = obtener_indice_comuna(clave)
+        parte = corregir_direcciones(sin_comuna[filas], indice, umbral=umbral, registro=registro)
+        parte["version_calles"] = None if indice.empty else indice.version
+        partes.append(parte)
+    if partes:
+        resultado = pd.concat(partes).reindex(direcciones.index)
+    else:
+        resultado = corregir_direcciones(direcciones, IndiceCalles(None)).assign(version_calles=None)
+    resultado["comuna"] = comuna
+    return resultado
+
+def versiones_indices_comunas(comunas):
+    """Versión vigente del índice de calles de cada comuna (None si su índice está vacío)."""
+    versiones = {}
+    for comuna in comunas:
+        indice = obtener_indice_comuna(comuna)
+        versiones[comuna] = None if indice.empty else indice.version
+    return versiones
+
+def filas_con_indice_desactualizado(data):
+    """Filas cuya corrección usó un índice de calles vacío o distinto del vigente para su comuna."""
+    if "comuna" not in data.columns or "version_calles" not in data.columns:
+        return pd.Series(True, index=data.index)
+    vigentes = versiones_indices_comunas(data["comuna"].dropna().unique())
+    actuales = data["comuna"].map(vigentes)
+    return data["version_calles"].isna() | actuales.isna() | (data["version_calles"] != actuales)
+
+@recurso_de_proceso
+def obtener_cache_geocodificacion():
+    """Abre (una vez por proceso) la caché persistente de geocodificación en disco."""
+    return CacheGeocodificacion(
+        RUTA_CACHE_GEOCODIFICACION,
+        ttl=TTL_CACHE_GEOCODIFICACION,
+        ttl_no_encontrado=TTL_CACHE_NO_ENCONTRADO,
+        max_entradas=MAX_ENTRADAS_CACHE_GEOCODIFICACION,
+    )
+
+@recurso_de_proceso
+def obtener_nomenclator_local():
+    """Carga (una vez por proceso) el nomenclátor local; None si no hay archivo."""
+    nomenclator = NomenclatorLocal.desde_csv(RUTA_NOMENCLATOR, normalizar)
+    if nomenclator is None:
+        print(f"Nomenclátor local no encontrado en '{RUTA_NOMENCLATOR}': se usará solo el geocodificador remoto.")
+    else:
+        print(f"<<< Nomenclátor local cargado: {len(nomenclator)} tramos.")
+    return nomenclator
+
+@recurso_de_proceso
+def obtener_motor_geocodificacion():
+    """Crea (una vez por proceso) el motor de geocodificación con un único cliente reutilizado."""
+    from motor_geocodificacion import MotorGeocodificacion # geopy
+    return MotorGeocodificacion(
+        solicitudes_por_segundo=GEOCODIFICADOR_SOLICITUDES_POR_SEGUNDO,
+        max_trabajadores=GEOCODIFICADOR_TRABAJADORES,
+        timeout=GEOCODIFICADOR_TIMEOUT,
+        reintentos=GEOCODIFICADOR_REINTENTOS,
+        dominio=GEOCODIFICADOR_DOMINIO,
+        esquema=GEOCODIFICADOR_ESQUEMA,
+    )
+
+def consulta_geocodificacion(direccion_corregida_completa, comuna=COMUNA_PREDETERMINADA):
+    """Texto de consulta enviado al geocodificador para una dirección de la comuna indicada."""
+    nombre_comuna = COMUNAS.get(comuna, COMUNAS[COMUNA_PREDETERMINADA]).nombre
+    return f"{direccion_corregida_completa}, {nombre_comuna}, Región Metropolitana, Chile"
+
+def obtener_coords_lote(direcciones, progreso=None, registro=None, comuna=COMUNA_PREDETERMINADA):
+    """Geocodifica un conjunto de direcciones corregidas.
+
+    Devuelve dict direccion -> (coords, fuente), donde coords es (lat, lon) o None y fuente
+    indica qué backend produjo el resultado (FUENTE_LOCAL, FUENTE_CACHE o FUENTE_NOMINATIM).
+    Primero se interpola con el nomenclátor local, luego se consulta la caché persistente;
+    solo las claves distintas que faltan se envían al motor remoto (en paralelo y con límite de tasa).
+    Si se entrega un RegistroEjecucion, se anotan los aciertos por backend y las latencias remotas.
+    Todas las direcciones se geocodifican en el contexto de la misma comuna.
+    """
+    # El nomenclátor local solo cubre la comuna predeterminada
+    nomenclator = obtener_nomenclator_local() if comuna == COMUNA_PREDETERMINADA else None
+    cache = obtener_cache_geocodificacion()
+    resultados = {}
+    por_clave = {} # clave normalizada -> direcciones que la comparten
+    aciertos_locales = aciertos_cache = 0
+    for direccion in dict.fromkeys(direcciones):
+        if pd.isna(direccion) or not isinstance(direccion, str) or not direccion.strip():
+            continue
+        if nomenclator is not None:
+            coords_locales = nomenclator.geocodificar(*separar_calle_numero(direccion.strip()))
+            if coords_locales is not None:
+                resultados[direccion] = (coords_locales, FUENTE_LOCAL)
+                aciertos_locales += 1
+                continue
+        clave_cache = normalizar(direccion) if comuna == COMUNA_PREDETERMINADA else f"{normalizar(direccion)}|{comuna}"
+        por_clave.setdefault(clave_cache, []).append(direccion)
+
+    # Una sola consulta (y una transacción) a la caché persistente para todo el lote
+    entradas = cache.obtener_lote(por_clave) if por_clave else {}
+    pendientes = {}
+    for clave_cache, dirs in por_clave.items():
+        entrada = entradas.get(clave_cache)
+        if entrada is None:
+            pendientes[clave_cache] = dirs
+            continue
+        aciertos_cache += 1
+        for direccion in dirs:
+            resultados[direccion] = ((entrada.lat, entrada.lon) if entrada.estado == ESTADO_OK else None, FUENTE_CACHE)
+
+    if pendientes:
+        consultas = {clave: consulta_geocodificacion(dirs[0], comuna) for clave, dirs in pendientes.items()}
+        por_consulta = obtener_motor_geocodificacion().geocodificar_lote(list(consultas.values()), progreso=progreso)
+        if registro is not None:
+            registro.registrar_latencias((r.latencia for r in por_consulta.values()), (r.espera for r in por_consulta.values()))
+        errores = []
+        nuevos = []
+        for clave, consulta in consultas.items():
+            r = por_consulta[consulta]
+            if r.estado == ESTADO_OK:
+                nuevos.append((clave, r.coords[0], r.coords[1], ESTADO_OK))
+            elif r.estado == ESTADO_NO_ENCONTRADO:
+                nuevos.append((clave, None, None, ESTADO_NO_ENCONTRADO))
+            else:
+                # Error (ya reintentado): no se guarda en caché para reintentar en la próxima ejecución
+                errores.append(r)
+            for direccion in pendientes[clave]:
+                resultados[direccion] = (r.coords, FUENTE_NOMINATIM)
+        cache.guardar_lote(nuevos)
+        if registro is not None:
+            registro.registrar_cache("geocodificacion", errores_remotos=len(errores))
+        if errores:
+            print(f"Errores de geocodificación ({len(errores)}): {[(r.consulta, str(r.error)) for r in errores[:5]]}")
+            avisar("warning", f"Servicio de geocodificación no disponible para {len(errores)} direcciones (tras {GEOCODIFICADOR_REINTENTOS} reintentos).")
+    if registro is not None:
+        if nomenclator is not None:
+            registro.registrar_cache("nomenclator_local", aciertos=aciertos_locales, fallos=len(resultados) - aciertos_locales)
+        registro.registrar_cache("geocodificacion", aciertos=aciertos_cache, fallos=len(pendientes))
+    return resultados
+
+def obtener_coords(direccion_corregida_completa, comuna=COMUNA_PREDETERMINADA):
+    """Obtiene coordenadas (lat, lon) para una dirección de la comuna indicada (caché persistente + Nominatim).
+
+    Sin memoización propia: las repeticiones las responde la caché persistente, que no guarda
+    los errores transitorios del proveedor (esas direcciones se vuelven a consultar).
+    """
+    # Validar entrada antes de consultar
+    if pd.isna(direccion_corregida_completa) or not isinstance(direccion_corregida_completa, str) or not direccion_corregida_completa.strip():
+        return None
+    coords, _fuente = obtener_coords_lote([direccion_corregida_completa], comuna=comuna).get(direccion_corregida_completa, (None, None))
+    return coords
+
+@recurso_de_proceso
+def obtener_cache_mapas():
+    """Abre (una vez por proceso) la caché de mapas renderizados, compartida entre sesiones."""
+    return CacheMapas(DIRECTORIO_CACHE_MAPAS, max_entradas=MAX_MAPAS_EN_CACHE)
+
+@recurso_de_proceso
+def obtener_almacen_ingesta():
+    """Abre (una vez por proceso) el estado persistente de la ingesta incremental."""
+    return AlmacenIngesta(DIRECTORIO_INGESTA)
+
+def abrir_hoja_google(id_hoja=ID_HOJA_GOOGLE, gid=GID_HOJA_GOOGLE, credenciales=CREDENCIALES_GOOGLE):
+    """Abre con gspread la pestaña de respuestas de la hoja (cuenta de servicio)."""
+    import gspread # Solo se necesita para sincronizar con la hoja
+    cliente = gspread.service_account(filename=credenciales) if credenciales else gspread.service_account()
+    return cliente.open_by_key(id_hoja).get_worksheet_by_id(gid)
+
+def crear_sincronizador(hoja=None, ruta_estado=RUTA_ESTADO_SINCRONIZACION):
+    """SincronizadorHoja sobre hoja (por defecto la hoja de Google de ID_HOJA_GOOGLE)."""
+    return SincronizadorHoja(hoja if hoja is not None else abrir_hoja_google(), ruta_estado)
+
+@recurso_de_proceso
+def obtener_gestor_trabajos():
+    """Registro (uno por proceso) de los trabajos en segundo plano, compartido entre sesiones."""
+    return GestorTrabajos(max_terminados=MAX_TRABAJOS_TERMINADOS)
+
+def limpiar_csv(data):
+    """LIMPIA nombres de columna, renombra DIRECCIÓN y procesa TIPO. Devuelve None si falta la columna de dirección."""
+    data.columns = data.columns.str.strip()
+    print("--- Columnas Después de Limpiar Espacios (str.strip) ---")
+    print([f"'{col}'" for col in data.columns])
+
+    # Verificar y procesar columna Dirección (usando nombre limpio)
+    if COLUMNA_DIRECCION_ORIGINAL in data.columns:
+        data[COLUMNA_DIRECCION_ORIGINAL] = data[COLUMNA_DIRECCION_ORIGINAL].astype(str)
+        data.rename(columns={COLUMNA_DIRECCION_ORIGINAL: COLUMNA_DIRECCION_NUEVA}, inplace=True)
+        print(f"Columna dirección renombrada a '{COLUMNA_DIRECCION_NUEVA}'")
+        data[COLUMNA_DIRECCION_NUEVA] = data[COLUMNA_DIRECCION_NUEVA].str.strip()
+    else:
+        avisar("error", f"Error crítico: No se encontró la columna de dirección '{COLUMNA_DIRECCION_ORIGINAL}' DESPUÉS de limpiar nombres.")
+        avisar("info", f"Columnas disponibles: {list(data.columns)}")
+        return None
+
+    # Verificar y procesar columna Tipo (usando nombre limpio)
+    if COLUMNA_TIPO_ORIGINAL in data.columns:
+        data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].astype(str)
+        print(f"Procesando columna de tipo: '{COLUMNA_TIPO_ORIGINAL}'...")
+        data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].fillna("DESCONOCIDO")
+        data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].str.strip().str.upper()
+        data[COLUMNA_TIPO_ORIGINAL] = data[COLUMNA_TIPO_ORIGINAL].replace(r'^\s*$', 'DESCONOCIDO', regex=True)
+    else:
+        avisar("warning", f"Advertencia: No se encontró la columna de tipo '{COLUMNA_TIPO_ORIGINAL}' DESPUÉS de limpiar nombres. Se creará con valor 'DESCONOCIDO'.")
+        avisar("info", f"Columnas disponibles: {list(data.columns)}")
+        data[COLUMNA_TIPO_ORIGINAL] = "DESCONOCIDO"
+
+    # Columnas que la sincronización escribe en la misma hoja: son resultado, no origen. Si se
+    # quedaran, cambiarían la huella de cada fila recién escrita y se reprocesaría todo.
+    escritas = [columna for columna in COLUMNAS_SINCRONIZADAS if columna in data.columns]
+    if escritas:
+        data.drop(columns=escritas, inplace=True)
+        print(f"Columnas escritas por la sincronización descartadas: {escritas}")
+    return data
+
+def cargar_csv_predeterminado(origen=URL_CSV_PREDETERMINADO):
+    """Carga datos (URL, ruta o buffer), LIMPIA nombres de columna, renombra DIRECCIÓN y procesa TIPO."""
+    print(">>> Cargando CSV...")
+    try:
+        data = pd.read_csv(origen)
+        print("--- Columnas Originales Detectadas (Pre-Limpieza) ---")
+        print([f"'{col}'" for col in data.columns])
+
+        data = limpiar_csv(data)
+        if data is None:
+            return None
+
+        print("--- Columnas Finales en DataFrame ---")
+        print(data.columns)
+        print(f"<<< CSV Cargado y Procesado: {len(data)} filas.")
+        return data
+
+    except Exception as e:
+        avisar("error", f"Error general al cargar o procesar el CSV: {e}")
+        avisar("error", traceback.format_exc())
+        return None
+
+def generar_mapa_colores(data):
+    """Asigna un color de la paleta a cada tipo de problema (DESCONOCIDO siempre en gris)."""
+    dynamic_color_map = {}
+    if COLUMNA_TIPO_ORIGINAL in data.columns:
+        unique_types = sorted(list(data[COLUMNA_TIPO_ORIGINAL].unique()))
+        print(f"Tipos únicos encontrados para mapa de colores: {unique_types}")
+        palette_len = len(BASE_COLOR_PALETTE)
+        color_index = 0
+        if "DESCONOCIDO" in unique_types:
+            dynamic_color_map["DESCONOCIDO"] = COLOR_DESCONOCIDO
+        for utype in unique_types:
+            if utype not in dynamic_color_map:
+                dynamic_color_map[utype] = BASE_COLOR_PALETTE[color_index % palette_len]
+                color_index += 1
+        print("--- Mapa de Colores Generado ---")
+        print(dynamic_color_map)
+    else:
+        avisar("warning", f"Columna '{COLUMNA_TIPO_ORIGINAL}' no encontrada para generar mapa de colores.")
+        dynamic_color_map["DESCONOCIDO"] = COLOR_DESCONOCIDO
+    return dynamic_color_map
+
+def geocodificar_datos(data, progreso=None, registro=None):
+    """Completa 'coords' y 'fuente_geocodificacion' de las filas con dirección corregida válida y sin coordenadas.
+
+    Modifica data en el lugar y devuelve el número de filas con dirección corregida válida.
+    """
+    for columna in ["coords", "fuente_geocodificacion"]:
+        if columna not in data.columns:
+            data[columna] = None
+    # Filas sin comuna (p. ej. procesadas antes de detectar comunas) se geocodifican en la predeterminada
+    comunas = data["comuna"].fillna(COMUNA_PREDETERMINADA) if "comuna" in data.columns else pd.Series(COMUNA_PREDETERMINADA, index=data.index)
+    mask_valid_corrected = data["direccion_corregida"].notna() & (data["direccion_corregida"].astype(str).str.strip() != '')
+    # Solo se geocodifican las filas sin coordenadas (nuevas, editadas o no encontradas antes)
+    data_to_geocode = data[mask_valid_corrected & data["coords"].isna()]
+    if not data_to_geocode.empty:
+        coords_series = data["coords"].astype(object)
+        fuentes_series = data["fuente_geocodificacion"].astype(object)
+        # Cada dirección distinta de cada comuna se geocodifica una sola vez (nomenclátor + caché + motor concurrente)
+        for comuna, filas in comunas[data_to_geocode.index].groupby(comunas[data_to_geocode.index]).groups.items():
+            direcciones = data_to_geocode.loc[filas, "direccion_corregida"]
+            coords_por_direccion = obtener_coords_lote(direcciones, progreso=progreso, registro=registro, comuna=comuna)
+            for idx_fila, direccion in direcciones.items():
+                coords_series.at[idx_fila], fuentes_series.at[idx_fila] = coords_por_direccion.get(direccion, (None, None))
+        data["coords"] = coords_series
+        data["fuente_geocodificacion"] = fuentes_series
+    return int(mask_valid_corrected.sum())
+
+def procesar_bloque(data, progreso=None, registro=None):
+    """Corrige (con el índice de la comuna de cada dirección) y geocodifica un bloque de filas ya limpias.
+
+    Devuelve el bloque con COLUMNAS_PROCESADAS.
+    """
+    data = data.copy()
+    registro = registro or RegistroEjecucion()
+    with registro.etapa("correccion", filas=len(data)):
+        correccion = corregir_direcciones_por_comuna(data[COLUMNA_DIRECCION_NUEVA], registro=registro)
+    for columna in COLUMNAS_CORRECCION:
+        data[columna] = correccion[columna]
+    data["coords"] = None
+    data["fuente_geocodificacion"] = None
+    with registro.etapa("geocodificacion", filas=len(data)):
+        geocodificar_datos(data, progreso=progreso, registro=registro)
+    return data
+
+def compactar_resultado(data):
+    """Modelo compacto del resultado procesado, para mapas y vistas.
+
+    Conserva solo las filas con coordenadas y las columnas que se usan después: la dirección
+    original (popups), el tipo normalizado y las columnas de COLUMNAS_CATEGORICAS_COMPACTAS
+    como categóricas, y lat/lon como float32 en lugar de tuplas.
+    """
+    es_valida = data["coords"].map(lambda c: isinstance(c, tuple) and len(c) == 2)
+    validas = data[es_valida]
+    compacto = pd.DataFrame(index=pd.RangeIndex(len(validas)))
+    if COLUMNA_DIRECCION_NUEVA in validas.columns:
+        compacto[COLUMNA_DIRECCION_NUEVA] = validas[COLUMNA_DIRECCION_NUEVA].to_numpy(dtype=object)
+    compacto[COLUMNA_TIPO_ORIGINAL] = pd.Categorical(tipos_reporte(validas).to_numpy())
+    for columna in COLUMNAS_CATEGORICAS_COMPACTAS:
+        if columna in validas.columns:
+            compacto[columna] = pd.Categorical(validas[columna].to_numpy())
+    compacto["lat"] = np.fromiter((c[0] for c in validas["coords"]), dtype=np.float32, count=len(validas))
+    compacto["lon"] = np.fromiter((c[1] for c in validas["coords"]), dtype=np.float32, count=len(validas))
+    return compacto
+
+_RESULTADOS_COMPARTIDOS = CacheCompartida(MAX_RESULTADOS_COMPARTIDOS) # huella -> resultado compacto
+
+def compartir_resultado(compacto):
+    """Devuelve la instancia compartida entre sesiones de un resultado compacto con el mismo contenido.
+
+    El DataFrame devuelto es de solo lectura: las sesiones lo referencian, no lo copian.
+    """
+    return _RESULTADOS_COMPARTIDOS.compartir(huella_contenido(compacto), compacto)
+
+def coords_a_columnas(data):
+    """Reemplaza la columna de tuplas 'coords' por columnas 'lat' y 'lon' (formato de exportación)."""
+    data = data.copy()
+    coords = data["coords"].map(lambda c: c if isinstance(c, tuple) and len(c) == 2 else (None, None))
+    data["lat"] = pd.to_numeric(coords.str[0], errors="coerce")
+    data["lon"] = pd.to_numeric(coords.str[1], errors="coerce")
+    return data.drop(columns=["coords"])
+
+def columnas_a_coords(data):
+    """Inverso de coords_a_columnas: reconstruye 'coords' como tuplas (lat, lon) o None."""
+    data = data.copy()
+    validas = data["lat"].notna() & data["lon"].notna()
+    data["coords"] = pd.Series(
+        [(float(la), float(lo)) if v else None for la, lo, v in zip(data["lat"], data["lon"], validas)],
+        index=data.index, dtype=object,
+    )
+    return data.drop(columns=["lat", "lon"])
+
+def cargar_resultado_precalculado(ruta):
+    """Lee el resultado exportado por procesar_csv.py (CSV o Parquet) listo para dibujar el mapa."""
+    if str(ruta).lower().endswith(".parquet"):
+        data = pd.read_parquet(ruta)
+    else:
+        data = pd.read_csv(ruta)
+    return columnas_a_coords(data)
+
+def leyenda_html(dynamic_color_map, tipos_en_mapa):
+    """HTML de la leyenda de tipos (solo los tipos presentes en el mapa)."""
+    legend_html = """
+        <div style="position: fixed; bottom: 50px; left: 10px; width: 180px; height: auto; max-height: 250px; border:2px solid grey; z-index:9999; font-size:12px; background-color:rgba(255, 255, 255, 0.9); overflow-y: auto; padding: 10px; border-radius: 5px;">
+        <b style="font-size: 14px;">Leyenda de Tipos</b><br> """
+    tipos_relevantes_leyenda = sorted([t for t in dynamic_color_map.keys() if t in tipos_en_mapa])
+    print(f"--- Tipos para la leyenda: {tipos_relevantes_leyenda} ---")
+    for tipo_leg in tipos_relevantes_leyenda:
+         color_leg = dynamic_color_map.get(tipo_leg, DEFAULT_ASSIGN_COLOR)
+         legend_html += f'<i style="background:{color_leg}; border-radius:50%; width: 12px; height: 12px; display: inline-block; margin-right: 6px; border: 1px solid #CCC;"></i>{tipo_leg.capitalize()}<br>'
+    legend_html += "</div>"
+    return legend_html
+
+def tipos_reporte(data):
+    """Tipo de problema de cada fila tal como lo usa el mapa de colores (mayúsculas, 'DESCONOCIDO' si falta)."""
+    if COLUMNA_TIPO_ORIGINAL in data.columns:
+        tipos = data[COLUMNA_TIPO_ORIGINAL].astype(str).str.strip().str.upper()
+    else:
+        tipos = pd.Series("DESCONOCIDO", index=data.index)
+    return tipos.where(tipos != "", "DESCONOCIDO")
+
+def textos_marcadores(data):
+    """Calcula de forma vectorizada tipo, popup y tooltip de cada fila (mismo contenido que los marcadores individuales)."""
+    tipos = tipos_reporte(data)
+    tipos_cap = tipos.str.capitalize()
+
+    popups = "<b>Tipo:</b> " + tipos_cap + "<br>"
+    if "direccion_corregida" in data.columns:
+        corregidas = data["direccion_corregida"].astype(object) # Puede ser categórica (resultado compacto)
+        popups += ("<b>Corregida:</b> " + corregidas.astype(str) + "<br>").where(corregidas.notna(), "")
+        tooltips = corregidas.where(corregidas.notna(), "Ubicación").astype(str) + " (" + tipos_cap + ")"
+    else:
+        tooltips = "Ubicación (" + tipos_cap + ")"
+    if COLUMNA_DIRECCION_NUEVA in data.columns:
+        originales = data[COLUMNA_DIRECCION_NUEVA].astype(object)
+        popups += ("<b>Original:</b> " + originales.astype(str)).where(originales.notna(), "")
+    if "conteo" in data.columns: # Puntos que agrupan reportes duplicados (agrupar_duplicados)
+        varios = data["conteo"] > 1
+        popups = ("<b>Reportes:</b> " + data["conteo"].astype(str) + "<br>").where(varios, "") + popups
+        tooltips = tooltips + (" · " + data["conteo"].astype(str) + " reportes").where(varios, "")
+    return tipos, popups, tooltips
+
+def construir_mapa_csv(data, dynamic_color_map, max_marcadores=MAX_MARCADORES_INDIVIDUALES):
+    """Crea el mapa folium con un punto por fila de un resultado compacto (columnas lat/lon). Devuelve (mapa, puntos_agregados).
+
+    Hasta max_marcadores se usa un folium.Marker por fila; por encima, una sola capa
+    agrupada (FastMarkerCluster) que envía los puntos como un arreglo compacto.
+    """
+    import folium
+    from folium.plugins import FastMarkerCluster
+    map_center = [-33.38, -70.65]
+    es_valida = data["lat"].notna() & data["lon"].notna()
+    n_validas = int(es_valida.sum())
+    if n_validas:
+        # Promedio en float64 para no acumular error de redondeo de float32
+        map_center = [float(data.loc[es_valida, "lat"].astype("float64").mean()),
+                      float(data.loc[es_valida, "lon"].astype("float64").mean())]
+
+    mapa_obj = folium.Map(location=map_center, zoom_start=13)
+    coords_agregadas = 0
+    tipos_en_mapa = set()
+
+    if n_validas > max_marcadores:
+        print(f"--- Añadiendo {n_validas} puntos como capa agrupada (FastMarkerCluster) ---")
+        tipos, popups, tooltips = textos_marcadores(data[es_valida])
+        colores = tipos.map(lambda t: dynamic_color_map.get(t, DEFAULT_ASSIGN_COLOR))
+        colores_css = colores.map(lambda c: COLORES_CSS_MARCADOR.get(c, c))
+        lat = data.loc[es_valida, "lat"].astype("float64").round(6)
+        lon = data.loc[es_valida, "lon"].astype("float64").round(6)
+        puntos = [list(fila) for fila in zip(lat, lon, colores_css.astype(str), popups, tooltips)]
+        FastMarkerCluster(puntos, callback=CALLBACK_PUNTO_AGRUPADO, options={"maxClusterRadius": 40}).add_to(mapa_obj)
+        coords_agregadas = len(puntos)
+        tipos_en_mapa.update(tipos.unique())
+    else:
+        print("--- Añadiendo Marcadores al Mapa ---")
+        data = data[es_valida]
+        tipos, popups, tooltips = textos_marcadores(data)
+        for i, lat, lon in zip(data.index, data["lat"], data["lon"]):
+            try:
+                tipo = tipos.at[i]
+                marker_color = dynamic_color_map.get(tipo, DEFAULT_ASSIGN_COLOR)
+                tipos_en_mapa.add(tipo)
+                folium.Marker(
+                    location=(round(float(lat), 6), round(float(lon), 6)),
+                    popup=folium.Popup(popups.at[i], max_width=300),
+                    tooltip=tooltips.at[i],
+                    icon=folium.Icon(color=marker_color, icon='info-sign')
+                ).add_to(mapa_obj)
+                coords_agregadas += 1
+            except Exception as marker_err:
+                avisar("warning", f"No se pudo añadir marcador para fila con índice {i}: {marker_err}")
+
+    if coords_agregadas > 0:
+        mapa_obj.get_root().html.add_child(folium.Element(leyenda_html(dynamic_color_map, tipos_en_mapa)))
+    return mapa_obj, coords_agregadas
+
+def mapa_csv_html(data, dynamic_color_map, max_marcadores=MAX_MARCADORES_INDIVIDUALES, registro=None):
+    """HTML del mapa de construir_mapa_csv, reutilizado desde caché si los puntos, colores y opciones no cambiaron.
+
+    Devuelve (html, puntos_agregados); html es None si no se agregó ningún punto.
+    """
+    cache = obtener_cache_mapas()
+    clave = huella_mapa(data, COLUMNAS_MAPA + ["conteo"], dynamic_color_map, {"max_marcadores": max_marcadores})
+    guardado = cache.obtener(clave)
+    if registro is not None:
+        registro.registrar_cache("mapas", aciertos=int(guardado is not None), fallos=int(guardado is None))
+    if guardado is not None:
+        print(f"--- Mapa reutilizado desde caché ({clave[:12]}) ---")
+        return guardado
+    mapa_obj, coords_agregadas = construir_mapa_csv(data, dynamic_color_map, max_marcadores)
+    if coords_agregadas == 0:
+        return None, 0
+    html = mapa_obj.get_root().render()
+    cache.guardar(clave, html, coords_agregadas)
+    return html, coords_agregadas
+
+_AGREGADOS_DENSIDAD = CacheCompartida(MAX_AGREGADOS_DENSIDAD) # huella de los puntos -> AgregadosDensidad
+
+def obtener_agregados_densidad(data):
+    """Conteos por celda (todas las resoluciones y tipos) de un resultado compacto, calculados una vez por versión de los datos."""
+    clave = huella_contenido(data, ["lat", "lon", COLUMNA_TIPO_ORIGINAL])
+    agregados = _AGREGADOS_DENSIDAD.obtener(clave)
+    if agregados is None:
+        agregados = AgregadosDensidad(data["lat"].to_numpy(), data["lon"].to_numpy(), tipos_reporte(data).to_numpy())
+        print(f"--- Densidad calculada: {agregados.puntos} puntos, {len(agregados.tipos)} tipos ---")
+        agregados = _AGREGADOS_DENSIDAD.compartir(clave, agregados)
+    return agregados
+
+_INDICES_ESPACIALES = CacheCompartida(MAX_INDICES_ESPACIALES) # huella de los puntos -> IndiceEspacial
+_GRUPOS_DUPLICADOS = CacheCompartida(MAX_INDICES_ESPACIALES) # (huella, distancia) -> puntos agrupados
+
+def obtener_indice_espacial(data):
+    """Índice espacial de un resultado compacto (columnas lat/lon), construido una vez por versión de los puntos."""
+    clave = huella_contenido(data, ["lat", "lon"])
+    indice = _INDICES_ESPACIALES.obtener(clave)
+    if indice is None:
+        indice = _INDICES_ESPACIALES.compartir(clave, IndiceEspacial(data["lat"].to_numpy(), data["lon"].to_numpy(), TAMANO_CELDA_INDICE_M))
+    return indice
+
+def reportes_cercanos(data, lat, lon, radio_m=RADIO_CERCANOS_M):
+    """Filas de un resultado compacto a <= radio_m metros de (lat, lon), de la más cercana a la más lejana, con 'distancia_m'."""
+    posiciones, distancias = obtener_indice_espacial(data).cerca(lat, lon, radio_m)
+    cercanos = data.iloc[posiciones].copy()
+    cercanos["distancia_m"] = distancias.round(1)
+    return cercanos
+
+def agrupar_duplicados(data, distancia_m=DISTANCIA_DUPLICADOS_M):
+    """Colapsa los reportes del mismo tipo a <= distancia_m metros (encadenados) en un solo punto.
+
+    Devuelve un resultado compacto con un punto por grupo (centro del grupo, textos del
+    primer reporte) y la columna 'conteo' con el número de reportes agrupados.
+    """
+    clave = (huella_contenido(data, COLUMNAS_MAPA), distancia_m)
+    grupos = _GRUPOS_DUPLICADOS.obtener(clave)
+    if grupos is None:
+        etiquetas = agrupar_cercanos(data["lat"].to_numpy(), data["lon"].to_numpy(), tipos_reporte(data).to_numpy(), distancia_m)
+        columnas = {c: (c, "first") for c in [COLUMNA_DIRECCION_NUEVA, "direccion_corregida", COLUMNA_TIPO_ORIGINAL] if c in data.columns}
+        grupos = data.assign(grupo=etiquetas).groupby("grupo", sort=True).agg(
+            **columnas, lat=("lat", "mean"), lon=("lon", "mean"), conteo=("lat", "size"),
+        ).reset_index(drop=True)
+        grupos["lat"] = grupos["lat"].astype(np.float32)
+        grupos["lon"] = grupos["lon"].astype(np.float32)
+        print(f"--- Duplicados agrupados: {len(data)} reportes en {len(grupos)} puntos (<= {distancia_m} m) ---")
+        grupos = _GRUPOS_DUPLICADOS.compartir(clave, grupos)
+    return grupos
+
+def construir_mapa_densidad(celdas, tamano_celda, modo="calor"):
+    """Mapa folium de densidad a partir de las celdas (lat, lon, conteo) de AgregadosDensidad.
+
+    modo 'calor' dibuja un mapa de calor ponderado por conteo; 'cuadricula' dibuja cada
+    celda como un rectángulo coloreado según su conteo, con el conteo en el tooltip.
+    """
+    import folium
+    from branca.colormap import linear
+    from folium.plugins import HeatMap
+    map_center = [-33.38, -70.65]
+    if not celdas.empty:
+        map_center = [float((celdas["lat"] * celdas["conteo"]).sum() / celdas["conteo"].sum()),
+                      float((celdas["lon"] * celdas["conteo"]).sum() / celdas["conteo"].sum())]
+    mapa_obj = folium.Map(location=map_center, zoom_start=13)
+    if celdas.empty:
+        return mapa_obj
+
+    maximo = int(celdas["conteo"].max())
+    if modo == "calor":
+        pesos = celdas["conteo"] / maximo
+        HeatMap(list(zip(celdas["lat"], celdas["lon"], pesos)), radius=18, blur=15, min_opacity=0.3).add_to(mapa_obj)
+    else:
+        escala = linear.YlOrRd_09.scale(1, max(maximo, 2))
+        escala.caption = "Reportes por celda"
+        mitad = tamano_celda / 2
+        features = [{
+            "type": "Feature",
+            "properties": {"conteo": int(conteo), "color": escala(conteo)},
+            "geometry": {"type": "Polygon", "coordinates": [[
+                [lon - mitad, lat - mitad], [lon + mitad, lat - mitad], [lon + mitad, lat + mitad],
+                [lon - mitad, lat + mitad], [lon - mitad, lat - mitad],
+            ]]},
+        } for lat, lon, conteo in zip(celdas["lat"], celdas["lon"], celdas["conteo"])]
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            style_function=lambda f: {"fillColor": f["properties"]["color"], "color": "#555", "weight": 0.5, "fillOpacity": 0.7},
+            tooltip=folium.GeoJsonTooltip(fields=["conteo"], aliases=["Reportes:"]),
+        ).add_to(mapa_obj)
+        escala.add_to(mapa_obj)
+    return mapa_obj
+
+def mapa_densidad_html(celdas, tamano_celda, modo="calor"):
+    """HTML de construir_mapa_densidad, reutilizado desde la caché de mapas si las celdas y el modo no cambiaron."""
+    cache = obtener_cache_mapas()
+    clave = huella_mapa(celdas, ["lat", "lon", "conteo"], {}, {"densidad": modo, "tamano_celda": tamano_celda})
+    guardado = cache.obtener(clave)
+    if guardado is not None:
+        return guardado[0]
+    html = construir_mapa_densidad(celdas, tamano_celda, modo).get_root().render()
+    cache.guardar(clave, html, len(celdas))
+    return html
+
+def iniciar_procesamiento_hoja(url=URL_CSV_PREDETERMINADO):
+    """Inicia en segundo plano el procesamiento de la hoja, o se une al que ya está en curso.
+
+    La clave del trabajo es (url, sha256 del contenido, versiones de los índices de calles de
+    la comuna predeterminada y de las comunas ya guardadas): una segunda sesión que pide la
+    misma versión recibe el mismo trabajo, corriendo o terminado. Si cambia (o se recupera)
+    el índice de cualquiera de esas comunas, la clave cambia y se inicia un trabajo nuevo.
+    Si ya hay un trabajo corriendo para la url no se vuelve a descargar la hoja.
+    """
+    gestor = obtener_gestor_trabajos()
+    activo = gestor.activo((url,))
+    if activo is not None:
+        print(f"--- Uniéndose al trabajo en curso {activo.clave[1][:12]} ---")
+        return activo
+    almacen = obtener_almacen_ingesta()
+    comunas = {COMUNA_PREDETERMINADA}
+    if almacen.procesado is not None and "comuna" in almacen.procesado.columns:
+        comunas.update(c for c in almacen.procesado["comuna"].dropna().unique() if c in COMUNAS)
+    versiones = tuple(sorted(versiones_indices_comunas(comunas).items()))
+    contenido_csv, metadatos_csv = almacen.descargar(url)
+    clave = (url, metadatos_csv.get("sha256"), versiones)
+    return gestor.obtener_o_iniciar(clave, lambda trabajo: procesar_hoja(trabajo, contenido_csv, metadatos_csv))
+
+def procesar_hoja(trabajo, contenido_csv, metadatos_csv):
+    """Cuerpo de un trabajo de iniciar_procesamiento_hoja (corre en su hilo, sin Streamlit).
+
+    Ingesta incremental -> corrección de las filas nuevas o editadas -> geocodificación por
+    bloques, publicando en trabajo.parcial el resultado compacto tras cada bloque -> guardado
+    de la ingesta -> resultado compacto compartido y HTML del mapa. Avanza los contadores de
+    trabajo y devuelve un dict con el resultado final.
+    """
+    _AVISOS_HILO.receptor = trabajo.avisar
+    registro = RegistroEjecucion("app_csv")
+    almacen = obtener_almacen_ingesta()
+    resultado = {"data": None, "color_map": {}, "mapa_html": None, "puntos": 0, "intentos": 0, "filas_pendientes": 0, "reporte": None}
+    try:
+        trabajo.fijar_etapa("carga_csv")
+        with registro.etapa("carga_csv") as etapa_carga:
+            data = almacen.datos_origen() if contenido_csv is None else cargar_csv_predeterminado(io.BytesIO(contenido_csv))
+            etapa_carga["filas"] = len(data) if data is not None else 0
+        if data is None or data.empty:
+            avisar("error", "No se cargaron datos válidos del CSV.")
+            return resultado
+        if COLUMNA_DIRECCION_NUEVA not in data.columns:
+            avisar("error", f"Falta la columna '{COLUMNA_DIRECCION_NUEVA}' para la corrección.")
+            return resultado
+        data, filas_pendientes = almacen.reutilizar(data, COLUMNAS_PROCESADAS)
+        # También las filas corregidas con un índice de su comuna que cambió o estaba vacío (descarga fallida)
+        desactualizadas = filas_con_indice_desactualizado(data) & ~filas_pendientes
+        filas_pendientes = filas_pendientes | desactualizadas
+        print(f"Ingesta incremental: {int(filas_pendientes.sum())} filas nuevas, editadas o con calles desactualizadas de {len(data)} "
+              f"({int(desactualizadas.sum())} por calles).")
+        registro.registrar_cache("ingesta", aciertos=int((~filas_pendientes).sum()), fallos=int(filas_pendientes.sum()))
+        trabajo.filas_total = len(data)
+        resultado["filas_pendientes"] = int(filas_pendientes.sum())
+        color_map = generar_mapa_colores(data)
+        trabajo.color_map = resultado["color_map"] = color_map
+        trabajo.publicar_parcial(compactar_resultado(data)) # Filas reutilizadas: ya se pueden dibujar
+
+        # Corregir solo las filas nuevas o editadas, con el índice de calles de su comuna
+        trabajo.fijar_etapa("correccion")
+        trabajo.filas_por_corregir = int(filas_pendientes.sum())
+        if filas_pendientes.any():
+            with registro.etapa("correccion", filas=int(filas_pendientes.sum())):
+                correccion = corregir_direcciones_por_comuna(data.loc[filas_pendientes, COLUMNA_DIRECCION_NUEVA], registro=registro)
+            for columna in COLUMNAS_CORRECCION:
+                data.loc[filas_pendientes, columna] = correccion[columna]
+            # Las filas re-corregidas deben volver a geocodificarse
+            data.loc[filas_pendientes, ["coords", "fuente_geocodificacion"]] = None
+        trabajo.filas_corregidas = trabajo.filas_por_corregir
+
+        # Geocodificar por bloques: tras cada uno se publica el resultado parcial para el mapa
+        trabajo.fijar_etapa("geocodificacion")
+        validas = data["direccion_corregida"].notna() & (data["direccion_corregida"].astype(str).str.strip() != '')
+        faltantes = data.index[validas & data["coords"].isna()]
+        trabajo.filas_por_geocodificar = len(faltantes)
+        tamano_bloque = max(MIN_FILAS_BLOQUE_TRABAJO, -(-len(faltantes) // PUBLICACIONES_PARCIALES))
+        with registro.etapa("geocodificacion", filas=len(faltantes)):
+            for inicio in range(0, len(faltantes), tamano_bloque):
+                filas = faltantes[inicio:inicio + tamano_bloque]
+                bloque = data.loc[filas].copy()
+                def progreso_bloque(completadas, total, base=inicio, n=len(filas)):
+                    trabajo.filas_geocodificadas = base + int(n * completadas / max(total, 1))
+                geocodificar_datos(bloque, progreso=progreso_bloque, registro=registro)
+                data.loc[filas, "coords"] = bloque["coords"]
+                data.loc[filas, "fuente_geocodificacion"] = bloque["fuente_geocodificacion"]
+                trabajo.filas_geocodificadas = inicio + len(filas)
+                trabajo.publicar_parcial(compactar_resultado(data))
+        resultado["intentos"] = int(validas.sum())
+
+        trabajo.fijar_etapa("guardado")
+        try:
+            with registro.etapa("guardado_ingesta", filas=len(data)):
+                almacen.guardar(data, metadatos_csv, COLUMNAS_PROCESADAS)
+        except Exception as e_guardar:
+            print(f"No se pudo guardar el estado de ingesta: {e_guardar}")
+
+        # Escribir en la hoja las filas cuyo resultado cambió, para que otros clientes lo reutilicen
+        if ID_HOJA_GOOGLE:
+            trabajo.fijar_etapa("sincronizacion_hoja")
+            try:
+                with registro.etapa("sincronizacion_hoja", filas=len(data)) as etapa_sincronizacion:
+                    etapa_sincronizacion["filas"] = crear_sincronizador().sincronizar(data)["filas_escritas"]
+            except Exception as e_sincronizar:
+                avisar("warning", f"No se pudo escribir el resultado en la hoja de Google: {e_sincronizar}")
+
+        # Resultado compacto compartido entre sesiones + HTML del mapa (desde caché si ya existe)
+        trabajo.fijar_etapa("mapa")
+        compacto = compartir_resultado(compactar_resultado(data))
+        resultado["data"] = compacto
+        print(f"Coordenadas encontradas: {len(compacto)}/{resultado['intentos']}")
+        if not compacto.empty:
+            with registro.etapa("mapa", filas=len(compacto)):
+                resultado["mapa_html"], resultado["puntos"] = mapa_csv_html(compacto, color_map, registro=registro)
+        return resultado
+    finally:
+        _AVISOS_HILO.receptor = None
+        resultado["reporte"] = registro.reporte()
+        try:
+            print(f"Reporte de ejecución guardado en '{registro.guardar_json(DIRECTORIO_REPORTES)}'.")
+        except OSError as e_reporte:
+            print(f"No se pudo guardar el reporte de ejecución: {e_reporte}")
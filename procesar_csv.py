@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Procesamiento por lotes sin Streamlit: carga -> corrección -> geocodificación -> exportación.
+
+Lee el CSV (archivo o URL) por bloques y los va corrigiendo, geocodificando y
+escribiendo, sin mantener la hoja completa en memoria. Ejemplos:
+
+    python procesar_csv.py --salida resultado.parquet --mapa mapa.html
+    python procesar_csv.py --entrada reportes.csv --salida resultado.csv --tamano-bloque 2000
+    ID_HOJA_GOOGLE=... python procesar_csv.py --salida resultado.parquet --sincronizar-hoja
+    python procesar_csv.py --entrada reportes.csv --salida resultado.csv --hoja-local reportes.csv
+
+La app puede luego mostrar el resultado sin reprocesar:
+
+    RUTA_RESULTADO_PRECALCULADO=resultado.parquet streamlit run mapas.py
+"""
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from procesamiento import (
+    COLUMNAS_MAPA, URL_CSV_PREDETERMINADO, DIRECTORIO_REPORTES, ID_HOJA_GOOGLE,
+    obtener_indice_calles, limpiar_csv, procesar_bloque, coords_a_columnas, compactar_resultado,
+    generar_mapa_colores, mapa_csv_html, crear_sincronizador,
+)
+from hoja_local import HojaLocal
+from instrumentacion import RegistroEjecucion
+
+COLUMNAS_NUMERICAS_SALIDA = ["puntaje_match", "lat", "lon"]
+
+
+class EscritorResultado:
+    """Escribe bloques sucesivos en un CSV o Parquet (según la extensión de la ruta; Parquet requiere pyarrow)."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.parquet = ruta.lower().endswith(".parquet")
+        self.filas = 0
+        self._escritor_parquet = None
+        self._esquema = None
+
+    def escribir(self, bloque):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # Columnas de texto como string para que todos los bloques tengan el mismo esquema
+            for columna in bloque.columns:
+                if columna not in COLUMNAS_NUMERICAS_SALIDA:
+                    bloque[columna] = bloque[columna].astype("string")
+            if self._escritor_parquet is None:
+                tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+                self._esquema = tabla.schema
+                self._escritor_parquet = pq.ParquetWriter(self.ruta, self._esquema)
+            else:
+                tabla = pa.Table.from_pandas(bloque, schema=self._esquema, preserve_index=False)
+            self._escritor_parquet.write_table(tabla)
+        else:
+            bloque.to_csv(self.ruta, mode="w" if self.filas == 0 else "a", header=self.filas == 0, index=False)
+        self.filas += len(bloque)
+
+    def cerrar(self):
+        if self._escritor_parquet is not None:
+            self._escritor_parquet.close()
+
+
+def procesar(entrada, salida, ruta_mapa=None, tamano_bloque=5000, registro=None, sincronizador=None):
+    """Ejecuta el pipeline completo. Devuelve el número de filas escritas.
+
+    Los tiempos por etapa y los aciertos de caché se acumulan en registro (RegistroEjecucion).
+    Con sincronizador (SincronizadorHoja), cada bloque se escribe también en la hoja
+    (solo las filas que cambiaron desde la última sincronización).
+    """
+    registro = registro or RegistroEjecucion("cli")
+    indice_calles = obtener_indice_calles()
+    if indice_calles.empty:
+        print("Fallo al cargar calles oficiales. No se puede continuar.", file=sys.stderr)
+        return 0
+
+    escritor = EscritorResultado(salida)
+    puntos_mapa = []
+    inicio = time.perf_counter()
+    try:
+        for numero_bloque, bloque in enumerate(pd.read_csv(entrada, chunksize=tamano_bloque), start=1):
+            t_bloque = time.perf_counter()
+            bloque = limpiar_csv(bloque)
+            if bloque is None:
+                return escritor.filas
+            bloque = procesar_bloque(bloque, registro=registro)
+            if ruta_mapa:
+                puntos_mapa.append(compactar_resultado(bloque)[COLUMNAS_MAPA])
+            if sincronizador is not None:
+                # Cada fila se ubica en la hoja por su "Marca temporal", no por su posición en el CSV
+                with registro.etapa("sincronizacion_hoja") as etapa_sincronizacion:
+                    etapa_sincronizacion["filas"] = sincronizador.sincronizar(bloque)["filas_escritas"]
+            with registro.etapa("escritura", filas=len(bloque)):
+                escritor.escribir(coords_a_columnas(bloque))
+            duracion = time.perf_counter() - t_bloque
+            print(f"Bloque {numero_bloque}: {len(bloque)} filas en {duracion:.1f} s ({len(bloque) / max(duracion, 1e-9):.0f} filas/s)")
+    finally:
+        escritor.cerrar()
+    print(f"<<< {escritor.filas} filas escritas en '{salida}' ({time.perf_counter() - inicio:.1f} s).")
+
+    if ruta_mapa:
+        data_mapa = pd.concat(puntos_mapa, ignore_index=True) if puntos_mapa else pd.DataFrame(columns=COLUMNAS_MAPA)
+        if data_mapa.empty:
+            print("No hay puntos con coordenadas: no se genera el mapa.")
+        else:
+            with registro.etapa("mapa", filas=len(data_mapa)):
+                html, coords_agregadas = mapa_csv_html(data_mapa, generar_mapa_colores(data_mapa), registro=registro)
+                with open(ruta_mapa, "w", encoding="utf-8") as f:
+                    f.write(html)
+            print(f"<<< Mapa con {coords_agregadas} puntos guardado en '{ruta_mapa}'.")
+    return escritor.filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Corrige y geocodifica los reportes sin Streamlit.")
+    parser.add_argument("--entrada", default=URL_CSV_PREDETERMINADO, help="Ruta o URL del CSV (por defecto, la hoja publicada).")
+    parser.add_argument("--salida", required=True, help="Archivo de salida .csv o .parquet.")
+    parser.add_argument("--mapa", help="Ruta opcional del HTML del mapa.")
+    parser.add_argument("--tamano-bloque", type=int, default=5000, help="Filas por bloque (por defecto 5000).")
+    parser.add_argument("--reportes", default=DIRECTORIO_REPORTES, help=f"Directorio del reporte JSON de la ejecución (por defecto '{DIRECTORIO_REPORTES}').")
+    parser.add_argument("--sincronizar-hoja", action="store_true", help="Escribe el resultado en la hoja de Google de ID_HOJA_GOOGLE (solo filas con cambios).")
+    parser.add_argument("--hoja-local", help="Como --sincronizar-hoja, pero sobre un CSV local que imita la hoja (para pruebas).")
+    args = parser.parse_args(argv)
+    registro = RegistroEjecucion("cli")
+    hoja_local = HojaLocal.desde_csv(args.hoja_local) if args.hoja_local else None
+    sincronizador = None
+    if hoja_local is not None:
+        sincronizador = crear_sincronizador(hoja_local, ruta_estado=args.hoja_local + ".sincronizacion.json")
+    elif args.sincronizar_hoja:
+        if not ID_HOJA_GOOGLE:
+            parser.error("--sincronizar-hoja requiere la variable de entorno ID_HOJA_GOOGLE.")
+        sincronizador = crear_sincronizador()
+    filas = procesar(args.entrada, args.salida, args.mapa, args.tamano_bloque, registro=registro, sincronizador=sincronizador)
+    if hoja_local is not None:
+        hoja_local.guardar_csv(args.hoja_local)
+        print(f"<<< Hoja local actualizada: '{args.hoja_local}' ({hoja_local.llamadas} llamadas, {hoja_local.celdas_escritas} celdas).")
+    print(f"<<< Reporte de ejecución: {registro.guardar_json(args.reportes)}")
+    return 0 if filas > 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
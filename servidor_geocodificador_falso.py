@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Servidor HTTP local que imita la API /search de Nominatim.
+
+Sirve para probar el motor de geocodificación (rendimiento, límite de tasa y
+reintentos) sin acceso a red. Uso:
+
+    python servidor_geocodificador_falso.py --puerto 8089 --latencia 0.05 --tasa-fallos 0.1
+
+y luego MotorGeocodificacion(dominio="127.0.0.1:8089", esquema="http").
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Centro aproximado de Conchalí
+LAT_BASE, LON_BASE = -33.38, -70.65
+
+
+def coords_deterministas(consulta):
+    """Coordenadas estables (dentro de la comuna) derivadas de un hash de la consulta."""
+    h = hashlib.sha1(consulta.encode("utf-8")).digest()
+    return LAT_BASE + (h[0] - 128) / 128 * 0.02, LON_BASE + (h[1] - 128) / 128 * 0.02
+
+
+class ServidorGeocodificadorFalso:
+    """Servidor en un hilo de fondo con latencia, tasa de fallos (503) y direcciones no encontradas configurables."""
+
+    def __init__(self, puerto=0, latencia=0.0, tasa_fallos=0.0, no_encontradas=None, semilla=None):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self.no_encontradas = no_encontradas or (lambda consulta: "NO EXISTE" in consulta.upper())
+        self.solicitudes = 0
+        self.fallos_inyectados = 0
+        self._random = random.Random(semilla)
+        self._lock = threading.Lock()
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                consulta = parse_qs(url.query).get("q", [""])[0]
+                with servidor._lock:
+                    servidor.solicitudes += 1
+                    fallar = servidor._random.random() < servidor.tasa_fallos
+                    if fallar:
+                        servidor.fallos_inyectados += 1
+                if servidor.latencia:
+                    time.sleep(servidor.latencia)
+                if fallar:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if url.path.rstrip("/") != "/search" or servidor.no_encontradas(consulta):
+                    cuerpo = []
+                else:
+                    lat, lon = coords_deterministas(consulta)
+                    cuerpo = [{"lat": str(lat), "lon": str(lon), "display_name": consulta, "address": {}}]
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass # Silenciar el log por solicitud
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+        self._hilo = None
+
+    @property
+    def dominio(self):
+        return f"127.0.0.1:{self._httpd.server_address[1]}"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geocodificador falso compatible con Nominatim /search.")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de espera por solicitud.")
+    parser.add_argument("--tasa-fallos", type=float, default=0.0, help="Fracción de solicitudes que responden 503.")
+    args = parser.parse_args()
+    servidor = ServidorGeocodificadorFalso(args.puerto, args.latencia, args.tasa_fallos)
+    print(f"Geocodificador falso escuchando en http://{servidor.dominio}/search")
+    servidor._httpd.serve_forever()
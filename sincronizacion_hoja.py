@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Escritura de los resultados procesados de vuelta en la hoja de Google.
+
+Agrega a la hoja (a la derecha de las respuestas) las columnas de
+COLUMNAS_SINCRONIZADAS, para que cualquier cliente de la hoja reutilice la corrección
+y la geocodificación ya hechas. Solo se escriben las filas cuyos valores cambiaron
+desde la última sincronización (se guarda una huella por fila en disco), agrupadas
+en rangos contiguos que se envían juntos en llamadas batch_update, no celda a celda.
+
+El CSV publicado va atrasado respecto de la hoja, y en la hoja se pueden borrar,
+insertar u ordenar filas: la posición de una fila en el CSV no dice en qué fila de la
+hoja está. Por eso cada fila se identifica por COLUMNA_CLAVE (la "Marca temporal" que
+Google Forms pone a cada respuesta) y, justo antes de escribir, se lee esa columna de
+la hoja para ubicar la fila real. Las filas cuya clave falta o se repite no se escriben.
+
+La hoja es cualquier objeto con la interfaz de gspread.Worksheet que se usa aquí
+(row_values, col_values, col_count, add_cols, batch_update): una hoja real abierta con
+gspread o, en pruebas, hoja_local.HojaLocal.
+"""
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS_SINCRONIZADAS = ["direccion_corregida", "lat", "lon", "puntaje_match", "fuente_geocodificacion"]
+COLUMNA_CLAVE = "Marca temporal" # Identifica cada respuesta del formulario en la hoja y en el CSV
+MAX_CELDAS_POR_LLAMADA = 50000 # Las llamadas grandes se parten para no exceder el tamaño de la solicitud
+
+
+def letra_columna(numero):
+    """Letra A1 de la columna (1 -> 'A', 27 -> 'AA')."""
+    letras = ""
+    while numero > 0:
+        numero, resto = divmod(numero - 1, 26)
+        letras = chr(ord("A") + resto) + letras
+    return letras
+
+
+def rangos_contiguos(numeros):
+    """Agrupa números ordenados en tramos contiguos [(inicio, fin), ...]."""
+    numeros = np.asarray(numeros, dtype=np.int64)
+    if len(numeros) == 0:
+        return []
+    cortes = np.flatnonzero(np.diff(numeros) != 1) + 1
+    return [(int(tramo[0]), int(tramo[-1])) for tramo in np.split(numeros, cortes)]
+
+
+def valores_sincronizados(data):
+    """Valores de COLUMNAS_SINCRONIZADAS por fila, listos para escribir (números como números, vacíos como '')."""
+    valores = pd.DataFrame(index=data.index)
+    coords = data["coords"] if "coords" in data.columns else pd.Series(None, index=data.index, dtype=object)
+    coords = coords.map(lambda c: c if isinstance(c, tuple) and len(c) == 2 else (None, None))
+    for columna in COLUMNAS_SINCRONIZADAS:
+        if columna in ("lat", "lon"):
+            serie = pd.to_numeric(coords.str[0 if columna == "lat" else 1], errors="coerce").round(6)
+        elif columna == "puntaje_match" and columna in data.columns:
+            serie = pd.to_numeric(data[columna], errors="coerce").round(0)
+        elif columna in data.columns:
+            serie = data[columna]
+        else:
+            serie = pd.Series(None, index=data.index, dtype=object)
+        serie = serie.astype(object)
+        valores[columna] = serie.where(serie.notna(), "")
+    if "puntaje_match" in valores.columns:
+        valores["puntaje_match"] = valores["puntaje_match"].map(lambda v: int(v) if isinstance(v, float) else v)
+    return valores
+
+
+def clave_texto(valor):
+    """Clave de fila como texto ('' si falta), igual en el CSV y en los valores leídos de la hoja."""
+    return "" if pd.isna(valor) else str(valor).strip()
+
+
+class SincronizadorHoja:
+    """Escribe en la hoja solo las filas que cambiaron desde la última sincronización."""
+
+    def __init__(self, hoja, ruta_estado, max_celdas_por_llamada=MAX_CELDAS_POR_LLAMADA, columna_clave=COLUMNA_CLAVE):
+        self.hoja = hoja
+        self.ruta_estado = ruta_estado
+        self.max_celdas_por_llamada = max_celdas_por_llamada
+        self.columna_clave = columna_clave
+        self.estado = {"clave": columna_clave, "columnas": {}, "huellas": {}}
+        try:
+            with open(ruta_estado, encoding="utf-8") as f:
+                self.estado = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"Estado de sincronización ilegible en '{ruta_estado}', se reescribirán todas las filas: {e}")
+
+    def _columnas_destino(self, encabezado, actualizaciones):
+        """Número de columna de cada columna sincronizada; las que faltan se agregan al final del encabezado."""
+        encabezado = list(encabezado)
+        columnas = {}
+        for nombre in COLUMNAS_SINCRONIZADAS:
+            if nombre in encabezado:
+                columnas[nombre] = encabezado.index(nombre) + 1
+            else:
+                encabezado.append(nombre)
+                columnas[nombre] = len(encabezado)
+                actualizaciones.append({"range": f"{letra_columna(columnas[nombre])}1", "values": [[nombre]]})
+        if len(encabezado) > self.hoja.col_count:
+            self.hoja.add_cols(len(encabezado) - self.hoja.col_count)
+        return columnas
+
+    def _filas_hoja(self, encabezado):
+        """Fila actual de la hoja de cada clave que aparece una sola vez (se lee la columna clave de la hoja)."""
+        claves = [clave_texto(v) for v in self.hoja.col_values(encabezado.index(self.columna_clave) + 1)[1:]]
+        repetidas = Counter(claves)
+        return {clave: fila for fila, clave in enumerate(claves, start=2) if clave and repetidas[clave] == 1}
+
+    def sincronizar(self, data):
+        """Escribe las filas de data que cambiaron, cada una en la fila de la hoja que tiene su misma clave.
+
+        Devuelve un resumen con las filas escritas, las que no se pudieron ubicar en la hoja,
+        los rangos y las llamadas a la API. Falla (ValueError) si la columna clave no está en
+        data o en la hoja: sin ella no hay forma segura de saber a qué reporte va cada resultado.
+        """
+        encabezado = self.hoja.row_values(1)
+        if self.columna_clave not in data.columns or self.columna_clave not in encabezado:
+            raise ValueError(f"Falta la columna '{self.columna_clave}' en los datos o en la hoja: no se puede ubicar cada fila.")
+        actualizaciones = []
+        columnas = self._columnas_destino(encabezado, actualizaciones)
+        fila_por_clave = self._filas_hoja(encabezado)
+
+        valores = valores_sincronizados(data)
+        claves = data[self.columna_clave].map(clave_texto).to_numpy(dtype=object)
+        filas = np.array([fila_por_clave.get(c, 0) for c in claves], dtype=np.int64)
+        ubicadas = (filas > 0) & ~pd.Series(claves).duplicated(keep=False).to_numpy()
+        huellas = pd.util.hash_pandas_object(valores.astype(str), index=False).to_numpy()
+        # Si cambió la clave o las columnas destino se movieron, lo escrito antes ya no sirve: se reescribe todo
+        vigente = self.estado.get("clave") == self.columna_clave and self.estado.get("columnas") == columnas
+        previas = self.estado.get("huellas", {}) if vigente else {}
+        cambiadas = ubicadas & np.array([previas.get(c) != int(h) for c, h in zip(claves, huellas)], dtype=bool)
+
+        # Filas a escribir en el orden de la hoja, agrupadas en tramos contiguos de filas y columnas
+        posiciones = np.flatnonzero(cambiadas)
+        posiciones = posiciones[np.argsort(filas[posiciones], kind="stable")]
+        filas_destino = filas[posiciones]
+        orden = sorted(COLUMNAS_SINCRONIZADAS, key=columnas.get)
+        tramos_columnas = rangos_contiguos([columnas[c] for c in orden])
+        indice_fila = {fila: i for i, fila in enumerate(filas_destino)}
+        matriz = valores[orden].to_numpy(dtype=object)[posiciones]
+        max_filas = max(self.max_celdas_por_llamada // len(orden), 1)
+        for inicio_tramo, fin_tramo in rangos_contiguos(filas_destino):
+            for inicio in range(inicio_tramo, fin_tramo + 1, max_filas):
+                fin = min(inicio + max_filas - 1, fin_tramo)
+                bloque = matriz[indice_fila[inicio]:indice_fila[fin] + 1]
+                desplazamiento = 0
+                for col_inicio, col_fin in tramos_columnas:
+                    ancho = col_fin - col_inicio + 1
+                    actualizaciones.append({
+                        "range": f"{letra_columna(col_inicio)}{inicio}:{letra_columna(col_fin)}{fin}",
+                        "values": bloque[:, desplazamiento:desplazamiento + ancho].tolist(),
+                    })
+                    desplazamiento += ancho
+
+        llamadas = 0
+        for lote in self._lotes(actualizaciones):
+            self.hoja.batch_update(lote, value_input_option="RAW")
+            llamadas += 1
+        # El estado se guarda solo después de escribir: si una llamada falla, esas filas se reintentan
+        previas.update({claves[i]: int(huellas[i]) for i in posiciones})
+        self.estado = {"clave": self.columna_clave, "columnas": columnas, "huellas": previas}
+        self._guardar_estado()
+        resumen = {"filas": len(valores), "filas_escritas": len(posiciones), "filas_sin_ubicar": int((~ubicadas).sum()),
+                   "rangos": len(actualizaciones), "llamadas": llamadas}
+        print(f"Sincronización de hoja: {resumen}")
+        if resumen["filas_sin_ubicar"]:
+            print(f"{resumen['filas_sin_ubicar']} filas no se escribieron: su '{self.columna_clave}' falta o se repite en la hoja o en los datos.")
+        return resumen
+
+    def _lotes(self, actualizaciones):
+        lote, celdas = [], 0
+        for actualizacion in actualizaciones:
+            n = sum(len(fila) for fila in actualizacion["values"])
+            if lote and celdas + n > self.max_celdas_por_llamada:
+                yield lote
+                lote, celdas = [], 0
+            lote.append(actualizacion)
+            celdas += n
+        if lote:
+            yield lote
+
+    def _guardar_estado(self):
+        directorio = os.path.dirname(self.ruta_estado)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        ruta_temporal = self.ruta_estado + ".tmp"
+        with open(ruta_temporal, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f)
+        os.replace(ruta_temporal, self.ruta_estado)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Snapshot local y versionado de la lista oficial de calles.
+
+Cada versión guarda el DataFrame de calles (con su columna 'normalizado') y el
+IndiceCalles ya construido, de modo que el arranque solo lee un pickle. La lista
+se refresca desde la web en un hilo de fondo; si el refresco falla se sigue
+usando la última versión buena. Cada cambio de versión registra qué calles se
+agregaron y cuáles se eliminaron.
+"""
+import json
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+
+from indice_calles import IndiceCalles
+
+# Subir si cambia la estructura de IndiceCalles: los snapshots antiguos reconstruyen su índice
+FORMATO_INDICE = 1
+
+
+def diferencias_calles(calles_antes, calles_despues):
+    """Calles agregadas y eliminadas entre dos listas (por nombre oficial)."""
+    antes, despues = set(calles_antes), set(calles_despues)
+    return {"agregadas": sorted(despues - antes), "eliminadas": sorted(antes - despues)}
+
+
+class SnapshotCalles:
+    """Versiones en disco de la lista de calles, con la versión actual en memoria."""
+
+    def __init__(self, directorio, max_versiones=5):
+        self.directorio = directorio
+        self.max_versiones = max_versiones
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta_actual = os.path.join(directorio, "actual.json")
+        self.ruta_diferencias = os.path.join(directorio, "diferencias.jsonl")
+        self.actual = None # dict con version, creado, calles (DataFrame) e indice (IndiceCalles)
+        self.ultimo_error = None
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._cargar_actual()
+
+    def _cargar_actual(self):
+        try:
+            with open(self.ruta_actual, encoding="utf-8") as f:
+                archivo = json.load(f)["archivo"]
+            with open(os.path.join(self.directorio, archivo), "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("formato_indice") != FORMATO_INDICE:
+                snapshot["indice"] = IndiceCalles(snapshot["calles"])
+            self.actual = snapshot
+            print(f"<<< Snapshot de calles cargado: versión {snapshot['version']} ({len(snapshot['calles'])} calles).")
+        except FileNotFoundError:
+            self.actual = None
+        except Exception as e:
+            print(f"No se pudo leer el snapshot de calles en '{self.directorio}': {e}")
+            self.actual = None
+
+    @property
+    def version(self):
+        return self.actual["version"] if self.actual else None
+
+    def guardar(self, calles_df):
+        """Guarda calles_df como nueva versión si su contenido cambió. Devuelve las diferencias (o None si no cambió)."""
+        indice = IndiceCalles(calles_df)
+        with self._lock:
+            anterior = self.actual
+            if anterior is not None and anterior["version"] == indice.version:
+                return None
+            creado = time.time()
+            snapshot = {
+                "version": indice.version,
+                "creado": creado,
+                "calles": calles_df,
+                "indice": indice,
+                "formato_indice": FORMATO_INDICE,
+            }
+            archivo = f"calles_{datetime.fromtimestamp(creado).strftime('%Y%m%d%H%M%S')}_{indice.version}.pkl"
+            ruta_temporal = os.path.join(self.directorio, archivo + ".tmp")
+            with open(ruta_temporal, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(ruta_temporal, os.path.join(self.directorio, archivo))
+            with open(self.ruta_actual + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"archivo": archivo, "version": indice.version, "creado": creado}, f)
+            os.replace(self.ruta_actual + ".tmp", self.ruta_actual)
+
+            diferencias = diferencias_calles(
+                anterior["calles"]["Calle"].tolist() if anterior is not None else [], calles_df["Calle"].tolist()
+            )
+            with open(self.ruta_diferencias, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "desde": anterior["version"] if anterior is not None else None,
+                    "hasta": indice.version,
+                    "fecha": datetime.fromtimestamp(creado).isoformat(timespec="seconds"),
+                    **diferencias,
+                }, ensure_ascii=False) + "\n")
+            self.actual = snapshot
+            self._podar_versiones()
+        print(f"<<< Nueva versión de calles {indice.version}: +{len(diferencias['agregadas'])} / -{len(diferencias['eliminadas'])} calles.")
+        return diferencias
+
+    def _podar_versiones(self):
+        archivos = sorted(a for a in os.listdir(self.directorio) if a.startswith("calles_") and a.endswith(".pkl"))
+        for archivo in archivos[:-self.max_versiones]:
+            os.remove(os.path.join(self.directorio, archivo))
+
+    def ultimas_diferencias(self, n=1):
+        """Últimos n cambios de versión registrados (más reciente al final)."""
+        try:
+            with open(self.ruta_diferencias, encoding="utf-8") as f:
+                lineas = f.readlines()
+        except FileNotFoundError:
+            return []
+        return [json.loads(linea) for linea in lineas[-n:]]
+
+    def refrescar(self, descargar):
+        """Descarga la lista con descargar() y la guarda si cambió. Si falla, se mantiene la versión actual."""
+        self.ultimo_error = None
+        try:
+            calles_df = descargar()
+        except Exception as e:
+            calles_df, self.ultimo_error = None, str(e)
+        if calles_df is None or calles_df.empty:
+            self.ultimo_error = self.ultimo_error or "La descarga no devolvió calles."
+            print(f"Refresco de calles falló ({self.ultimo_error}); se mantiene la versión {self.version}.")
+            return None
+        return self.guardar(calles_df)
+
+    def refrescar_en_segundo_plano(self, descargar, intervalo, espera_inicial=0, reintento_sin_version=None):
+        """Inicia (una sola vez) un hilo que refresca la lista tras `espera_inicial` y luego cada `intervalo` segundos.
+
+        Mientras no haya ninguna versión buena, los refrescos fallidos se reintentan antes:
+        tras `reintento_sin_version` segundos, duplicando la espera en cada fallo hasta `intervalo`.
+        """
+        if self._hilo is not None:
+            return
+        def ciclo():
+            time.sleep(espera_inicial)
+            espera_fallo = reintento_sin_version
+            while True:
+                self.refrescar(descargar)
+                if self.actual is None and espera_fallo:
+                    time.sleep(min(espera_fallo, intervalo))
+                    espera_fallo *= 2
+                else:
+                    espera_fallo = reintento_sin_version
+                    time.sleep(intervalo)
+        self._hilo = threading.Thread(target=ciclo, name="refresco_calles", daemon=True)
+        self._hilo.start()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Trabajos de procesamiento en segundo plano, compartidos entre sesiones.
+
+Un TrabajoProcesamiento corre en un hilo propio, así que sobrevive a los reruns de
+Streamlit y a que el navegador se recargue. Publica su avance (filas corregidas y
+geocodificadas, ETA) y resultados parciales que la página puede consultar en
+cualquier momento. GestorTrabajos garantiza un solo trabajo por clave (p. ej. la
+versión de la hoja): pedir de nuevo la misma clave devuelve el trabajo existente.
+"""
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+ESTADO_CORRIENDO = "corriendo"
+ESTADO_TERMINADO = "terminado"
+ESTADO_ERROR = "error"
+
+
+class TrabajoProcesamiento:
+    """Estado observable de un procesamiento en un hilo de fondo. Las sesiones solo lo leen."""
+
+    def __init__(self, clave, objetivo):
+        self.clave = clave
+        self.estado = ESTADO_CORRIENDO
+        self.etapa = "inicio"
+        self.inicio = time.time()
+        self.fin = None
+        self.filas_total = 0
+        self.filas_por_corregir = 0
+        self.filas_corregidas = 0
+        self.filas_por_geocodificar = 0
+        self.filas_geocodificadas = 0
+        self.parcial = None # Resultado parcial publicado (se reemplaza completo, nunca se modifica)
+        self.version_parcial = 0
+        self.color_map = {} # Colores por tipo, para dibujar el resultado parcial
+        self.resultado = None # dict con el resultado final
+        self.error = None
+        self.mensajes = [] # (nivel, texto) emitidos durante el procesamiento
+        self._lock = threading.Lock()
+        self._inicio_geocodificacion = None
+        self._hilo = threading.Thread(target=self._ejecutar, args=(objetivo,), name=f"trabajo_{clave}", daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        return self
+
+    def _ejecutar(self, objetivo):
+        try:
+            self.resultado = objetivo(self)
+            self.estado = ESTADO_TERMINADO
+        except Exception as e:
+            self.error = f"{e}\n{traceback.format_exc()}"
+            self.estado = ESTADO_ERROR
+            print(f"Trabajo {self.clave} falló: {e}")
+        finally:
+            self.fin = time.time()
+
+    @property
+    def activo(self):
+        return self.estado == ESTADO_CORRIENDO
+
+    def avisar(self, nivel, mensaje):
+        with self._lock:
+            self.mensajes.append((nivel, mensaje))
+
+    def fijar_etapa(self, etapa):
+        self.etapa = etapa
+        if etapa == "geocodificacion" and self._inicio_geocodificacion is None:
+            self._inicio_geocodificacion = time.time()
+
+    def publicar_parcial(self, parcial):
+        """Reemplaza el resultado parcial por uno nuevo (las sesiones ven siempre un objeto completo)."""
+        self.parcial = parcial
+        self.version_parcial += 1
+
+    def eta(self):
+        """Segundos estimados para terminar la geocodificación (None si todavía no hay ritmo medible)."""
+        if self._inicio_geocodificacion is None or self.filas_geocodificadas == 0:
+            return None
+        ritmo = self.filas_geocodificadas / max(time.time() - self._inicio_geocodificacion, 1e-9)
+        return max(self.filas_por_geocodificar - self.filas_geocodificadas, 0) / ritmo
+
+    def fraccion(self):
+        """Avance total aproximado: la corrección pesa poco frente a la geocodificación."""
+        if self.estado != ESTADO_CORRIENDO:
+            return 1.0
+        correccion = self.filas_corregidas / self.filas_por_corregir if self.filas_por_corregir else 1.0
+        geocodificacion = self.filas_geocodificadas / self.filas_por_geocodificar if self.filas_por_geocodificar else 0.0
+        if self.etapa in ("inicio", "carga_csv"):
+            return 0.0
+        if self.etapa == "correccion":
+            return 0.1 * correccion
+        if self.etapa == "geocodificacion":
+            return 0.1 + 0.85 * geocodificacion
+        return 0.95
+
+
+class GestorTrabajos:
+    """Registro de trabajos por clave (seguro entre hilos). Conserva los últimos terminados para nuevas sesiones."""
+
+    def __init__(self, max_terminados=4):
+        self.max_terminados = max_terminados
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener_o_iniciar(self, clave, objetivo):
+        """Devuelve el trabajo de esa clave si está corriendo o terminó bien; si no, inicia uno nuevo con objetivo(trabajo)."""
+        with self._lock:
+            existente = self._trabajos.get(clave)
+            if existente is not None and existente.estado != ESTADO_ERROR:
+                return existente
+            trabajo = TrabajoProcesamiento(clave, objetivo)
+            self._trabajos[clave] = trabajo
+            self._podar()
+        return trabajo.iniciar()
+
+    def activo(self, prefijo):
+        """Trabajo en curso cuya clave (tupla) empieza con prefijo, o None."""
+        with self._lock:
+            for clave, trabajo in reversed(self._trabajos.items()):
+                if trabajo.activo and clave[:len(prefijo)] == prefijo:
+                    return trabajo
+        return None
+
+    def _podar(self):
+        terminados = [c for c, t in self._trabajos.items() if not t.activo]
+        for clave in terminados[:-self.max_terminados] if len(terminados) > self.max_terminados else []:
+            del self._trabajos[clave]